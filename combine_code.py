@@ -1,13 +1,29 @@
+import argparse
+import hashlib
+import json
 import os
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-import gitignore_parser
-import mimetypes
+from typing import Callable, Iterator, Optional
 import sys # To get the script's own name
 
+try:
+    import gitignore_parser
+except ImportError: # Checked in __main__; the generator API only needs it when USE_GITIGNORE is set
+    gitignore_parser = None
+
 # --- Configuration ---
 OUTPUT_FILENAME = "combined_code.txt" # Name of the output file
 START_DIR = "."                     # Directory to start scanning ('.' means current dir)
 
+# --- Incremental Mode ---
+INCREMENTAL = True                  # Reuse unchanged files from the previous output (use --full to disable)
+MANIFEST_FILENAME = ".combined_code_manifest.json" # Path, mtime, size and hash of every file in the output
+MANIFEST_VERSION = 1
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4) # Threads reading and sniffing files
+
 # --- Filtering Options ---
 USE_GITIGNORE = True          # Set to True to respect .gitignore files
 GITIGNORE_PATH = ".gitignore" # Path to the main .gitignore file (relative to START_DIR)
@@ -15,7 +31,7 @@ GITIGNORE_PATH = ".gitignore" # Path to the main .gitignore file (relative to ST
 # --- File/Directory Skipping ---
 # Specific file exclusions
 SKIP_SELF_SCRIPT = True       # Exclude this script file itself?
-SKIP_OUTPUT_FILE = True       # Exclude the generated output file?
+SKIP_OUTPUT_FILE = True       # Exclude the generated output file (and its manifest)?
 SKIP_GITIGNORE_FILE = True    # Exclude the .gitignore file specified in GITIGNORE_PATH?
 
 # Django specific exclusions
@@ -45,193 +61,322 @@ except NameError:
 # --- End Script Filename ---
 
 
-def is_likely_binary(file_path: Path) -> bool:
-    """Tries to guess if a file is binary by checking for null bytes or decoding errors."""
-    try:
-        with open(file_path, 'rb') as f:
-            chunk = f.read(MAX_BINARY_CHECK_BYTES)
-        if not chunk: # Handle empty files - treat as text
-             return False
-        if b'\0' in chunk:
-            return True
-        try:
-            chunk.decode('utf-8')
-        except UnicodeDecodeError:
-            return True # Failed to decode as UTF-8, likely binary
-    except IOError:
+@dataclass
+class BundledFile:
+    """One file of the bundle. `content` is None for binary files and files that could not be read."""
+    path: str                   # Relative to the start directory, with forward slashes
+    mtime_ns: int
+    size: int
+    sha256: Optional[str] = None
+    binary: bool = False
+    content: Optional[str] = None
+    error: Optional[str] = None
+    reused: bool = False        # Taken from the previous output instead of read from disk
+
+
+def is_likely_binary(chunk: bytes) -> bool:
+    """Tries to guess if a file is binary by checking its first bytes for null bytes or decoding errors."""
+    if not chunk: # Handle empty files - treat as text
+        return False
+    if b'\0' in chunk:
         return True
-    except Exception:
-         return True
+    try:
+        chunk.decode('utf-8')
+    except UnicodeDecodeError:
+        return True # Failed to decode as UTF-8, likely binary
     return False
 
-def should_ignore_dir(dir_name: str, dir_path: Path, base_path: Path) -> bool:
-    """Checks if a directory name or path should be ignored based on rules."""
+def should_ignore_dir(dir_name: str) -> bool:
+    """Checks if a directory name should be ignored based on rules."""
     dir_name_lower = dir_name.lower()
     if dir_name in ALWAYS_IGNORE_DIRS:
         return True
-
-    relative_path = dir_path.relative_to(base_path) # Keep for potential future rules
     if IGNORE_DJANGO_MIGRATIONS and dir_name_lower == DJANGO_MIGRATIONS_DIR_NAME:
         return True
     if IGNORE_DJANGO_STATIC and dir_name_lower in DJANGO_STATIC_DIRS_NAMES:
         return True
     return False
 
-def should_ignore_file(file_name: str, file_path: Path, base_path: Path, output_path: Path, gitignore_path_obj: Path) -> bool:
-    """Checks if a file name or path should be ignored based on various rules."""
+def file_skip_reason(file_name: str, file_path: Path, generated_paths: set, gitignore_path_obj: Path) -> Optional[str]:
+    """The rule excluding a file by name or location, or None. Binary files are detected when read."""
     # 1. Specific file exclusions (Script, Output, .gitignore)
     if SKIP_SELF_SCRIPT and SCRIPT_FILENAME and file_name == SCRIPT_FILENAME:
-        print(f"Skipping file (Self): {file_path.relative_to(base_path)}")
-        return True
-    if SKIP_OUTPUT_FILE and file_path == output_path:
-        # This check might be redundant if output is in an ignored dir, but good practice
-        print(f"Skipping file (Output): {file_path.relative_to(base_path)}")
-        return True
+        return "Self"
+    if SKIP_OUTPUT_FILE and file_path in generated_paths:
+        return "Output"
     if SKIP_GITIGNORE_FILE and file_path == gitignore_path_obj:
-        print(f"Skipping file (.gitignore): {file_path.relative_to(base_path)}")
-        return True
+        return ".gitignore"
 
     # 2. Always ignore list
     if file_name in ALWAYS_IGNORE_FILES:
-        print(f"Skipping file (Always Ignore Rule): {file_path.relative_to(base_path)}")
-        return True
+        return "Always Ignore Rule"
+    # Django rules need no check here: their directories are pruned during the walk.
+    return None
+
+
+def load_gitignore(gitignore_path_obj: Path, log: Callable[[str], None]):
+    """The .gitignore matcher, or None when .gitignore handling is off or the file is missing."""
+    if not USE_GITIGNORE:
+        return None
+    if not gitignore_path_obj.is_file():
+        log(f"INFO: .gitignore file not found at {gitignore_path_obj}. Skipping .gitignore checks.")
+        return None
+    if gitignore_parser is None:
+        raise ImportError("The 'gitignore-parser' library is required when USE_GITIGNORE is set.")
+    try:
+        log(f"Loading .gitignore rules from: {gitignore_path_obj}")
+        with open(gitignore_path_obj, 'r', encoding='utf-8') as f_ignore:
+            matches = gitignore_parser.parse(f_ignore)
+        log(".gitignore rules loaded successfully.")
+        return matches
+    except Exception as e:
+        log(f"WARNING: Could not read or parse {gitignore_path_obj}: {e}")
+        return None
+
 
-    # 3. Django rules (check parent directory parts)
+def rules_fingerprint(gitignore_path_obj: Path) -> str:
+    """Changes whenever the rules that select files change, which invalidates the manifest."""
+    digest = hashlib.sha256()
+    settings = (
+        USE_GITIGNORE, SKIP_SELF_SCRIPT, SKIP_OUTPUT_FILE, SKIP_GITIGNORE_FILE, IGNORE_DJANGO_MIGRATIONS,
+        IGNORE_DJANGO_STATIC, DJANGO_MIGRATIONS_DIR_NAME, DJANGO_STATIC_DIRS_NAMES, sorted(ALWAYS_IGNORE_DIRS),
+        sorted(ALWAYS_IGNORE_FILES), SKIP_BINARY_FILES, MAX_BINARY_CHECK_BYTES, SCRIPT_FILENAME,
+    )
+    digest.update(repr(settings).encode())
+    if USE_GITIGNORE and gitignore_path_obj.is_file():
+        digest.update(gitignore_path_obj.read_bytes())
+    return digest.hexdigest()
+
+
+def read_file(full_path: Path, relative: str, stat: os.stat_result) -> BundledFile:
+    """
+    Sniff, read and hash one file. Binary files are only sniffed, so they are never
+    read whole and get no hash. Runs on the thread pool.
+    """
+    entry = BundledFile(relative, stat.st_mtime_ns, stat.st_size)
     try:
-        relative_path = file_path.relative_to(base_path)
-        parent_parts = relative_path.parent.parts
-        if IGNORE_DJANGO_MIGRATIONS and DJANGO_MIGRATIONS_DIR_NAME in parent_parts:
-            print(f"Skipping file (Django Migrations Dir): {relative_path}")
-            return True
-        if IGNORE_DJANGO_STATIC and any(p in parent_parts for p in DJANGO_STATIC_DIRS_NAMES):
-            print(f"Skipping file (Django Static Dir): {relative_path}")
-            return True
-    except ValueError: # Should not happen if file_path is under base_path
-        pass
-
-    # 4. Binary file check
-    if SKIP_BINARY_FILES and is_likely_binary(file_path):
-        print(f"Skipping file (Binary?): {file_path.relative_to(base_path)}")
-        return True
+        with open(full_path, 'rb') as f_in:
+            data = f_in.read(MAX_BINARY_CHECK_BYTES)
+            if SKIP_BINARY_FILES and is_likely_binary(data):
+                entry.binary = True
+                return entry
+            data += f_in.read()
+    except Exception as e:
+        entry.error = str(e)
+        entry.binary = SKIP_BINARY_FILES # Unreadable files were always treated as binary
+        return entry
+    entry.sha256 = hashlib.sha256(data).hexdigest()
+    # Same text as reading in text mode with errors='ignore' (universal newlines).
+    entry.content = data.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+    return entry
+
+
+class PreviousBundle:
+    """The manifest and output of the last run, used to skip reading files that have not changed."""
+
+    def __init__(self, base_path: Path, output_filename: str, fingerprint: str):
+        self.files = {}
+        self.output = None
+        manifest_path = base_path / MANIFEST_FILENAME
+        output_path = base_path / output_filename
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f_manifest:
+                manifest = json.load(f_manifest)
+            stat = output_path.stat()
+        except (OSError, ValueError):
+            return
+        if (
+            manifest.get('version') != MANIFEST_VERSION or manifest.get('rules') != fingerprint
+            or manifest.get('output_size') != stat.st_size or manifest.get('output_mtime_ns') != stat.st_mtime_ns
+        ):
+            return # Different rules, or the output was changed since: start over
+        self.files = manifest['files']
+        self.output = open(output_path, 'rb')
+
+    def get(self, relative: str, stat: os.stat_result) -> Optional[BundledFile]:
+        """The file's entry from the last run if its mtime and size are unchanged."""
+        record = self.files.get(relative)
+        if not record or record['error'] or record['mtime_ns'] != stat.st_mtime_ns or record['size'] != stat.st_size:
+            return None # Files that failed to read are always retried
+        entry = BundledFile(
+            relative, record['mtime_ns'], record['size'], record['sha256'], record['binary'], error=record['error'],
+            reused=True,
+        )
+        if record['length'] is not None:
+            self.output.seek(record['offset'])
+            entry.content = self.output.read(record['length']).decode('utf-8')
+        return entry
+
+    def close(self):
+        if self.output:
+            self.output.close()
+
+
+def walk_files(base_path: Path, output_filename: str, ignore_matches=None, known: frozenset = frozenset(),
+               log: Callable[[str], None] = lambda message: None, skipped: Optional[Counter] = None) -> Iterator[tuple]:
+    """
+    Yield (relative path, full path, stat) for every file the rules allow, in sorted
+    order. Paths in `known` were allowed by the same rules last run, so .gitignore is
+    not matched against them again. Pruned directories and excluded files are counted
+    in `skipped` under 'dirs' and 'files'.
+    """
+    if skipped is None:
+        skipped = Counter()
+    generated_paths = {base_path / output_filename, base_path / f'{output_filename}.tmp', base_path / MANIFEST_FILENAME}
+    gitignore_path_obj = (base_path / GITIGNORE_PATH).resolve()
+    for dirpath, dirnames, filenames in os.walk(base_path, topdown=True):
+        current_dir_path = Path(dirpath)
+        relative_dir_path = current_dir_path.relative_to(base_path)
+
+        # --- Prune Ignored Directories ---
+        kept = []
+        for dir_name in sorted(dirnames):
+            if should_ignore_dir(dir_name):
+                log(f"Skipping directory (Rule): {relative_dir_path / dir_name}")
+                skipped['dirs'] += 1
+            elif ignore_matches and ignore_matches(current_dir_path / dir_name):
+                log(f"Skipping directory (.gitignore): {relative_dir_path / dir_name}")
+                skipped['dirs'] += 1
+            else:
+                kept.append(dir_name)
+        # Modify dirnames *in-place* for os.walk pruning; sorted so output order is deterministic
+        dirnames[:] = kept
+
+        for filename in sorted(filenames):
+            file_full_path = current_dir_path / filename
+            relative = (relative_dir_path / filename).as_posix()
+            reason = file_skip_reason(filename, file_full_path, generated_paths, gitignore_path_obj)
+            if reason is None and relative not in known and ignore_matches and ignore_matches(file_full_path):
+                reason = ".gitignore"
+            if reason:
+                log(f"Skipping file ({reason}): {relative}")
+                skipped['files'] += 1
+                continue
+            try:
+                stat = file_full_path.stat()
+            except OSError as e:
+                log(f"ERROR: Could not stat file {relative}: {e}")
+                skipped['files'] += 1
+                continue
+            yield relative, file_full_path, stat
 
-    # If none of the above rules match, don't ignore based on these checks
-    return False
 
+def iter_bundle(start_dir: str = START_DIR, output_filename: str = OUTPUT_FILENAME, incremental: bool = INCREMENTAL,
+                max_workers: int = MAX_WORKERS, log: Callable[[str], None] = lambda message: None,
+                skipped: Optional[Counter] = None) -> Iterator[BundledFile]:
+    """
+    Yield a BundledFile for every file that would go into the bundle, in the same
+    deterministic order as the output file, without writing anything. Files are read
+    on a thread pool while earlier ones are consumed. With `incremental`, files whose
+    mtime and size match the last run's manifest are taken from the previous output.
+    Binary and unreadable files are yielded too; check `binary` and `error`. Files
+    and directories excluded by the rules are counted in `skipped`, as in walk_files().
+    """
+    if max_workers < 1:
+        raise ValueError(f"max_workers must be at least 1, not {max_workers}.")
+    base_path = Path(start_dir).resolve()
+    gitignore_path_obj = (base_path / GITIGNORE_PATH).resolve()
+    ignore_matches = load_gitignore(gitignore_path_obj, log)
+    previous = PreviousBundle(base_path, output_filename, rules_fingerprint(gitignore_path_obj)) if incremental else None
+    known = frozenset(previous.files) if previous else frozenset()
 
-def combine_code_from_walk(start_dir: str, output_filename: str):
+    # A window of pending reads, consumed in walk order, bounds memory on large trees.
+    window = max_workers * 4
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for relative, full_path, stat in walk_files(base_path, output_filename, ignore_matches, known, log, skipped):
+                entry = previous.get(relative, stat) if previous else None
+                pending.append(entry or pool.submit(read_file, full_path, relative, stat))
+                while len(pending) > window or (pending and isinstance(pending[0], BundledFile)):
+                    head = pending.popleft()
+                    yield head if isinstance(head, BundledFile) else head.result()
+            while pending:
+                head = pending.popleft()
+                yield head if isinstance(head, BundledFile) else head.result()
+    finally:
+        if previous:
+            previous.close()
+
+
+def _block(relative: str, body: str) -> tuple:
+    """The encoded header, body and footer of one file in the output."""
+    return (
+        f"--- START FILE: {relative} ---\n\n".encode('utf-8'),
+        body.encode('utf-8'),
+        f"\n\n--- END FILE: {relative} ---\n\n\n".encode('utf-8'),
+    )
+
+
+def combine_code_from_walk(start_dir: str, output_filename: str, incremental: bool = INCREMENTAL,
+                           max_workers: int = MAX_WORKERS):
     """
     Walks the directory tree, applying ignore rules, and concatenates allowed files.
+    The output is written to a temporary file and swapped in, together with a
+    manifest that lets the next run skip unchanged files.
     """
     base_path = Path(start_dir).resolve()
     output_path = base_path / output_filename
-    # Resolve the gitignore path object for direct comparison later
-    gitignore_path_obj = (base_path / GITIGNORE_PATH).resolve()
+    manifest_path = base_path / MANIFEST_FILENAME
+    temp_output_path = base_path / f'{output_filename}.tmp'
 
     print(f"Starting directory scan from: {base_path}")
     print(f"Output will be saved to: {output_path}")
     if SCRIPT_FILENAME:
         print(f"Script filename detected as: {SCRIPT_FILENAME}")
 
-    # --- Load .gitignore ---
-    ignore_matches = None
-    if USE_GITIGNORE:
-        # Use the resolved gitignore_path_obj here
-        if gitignore_path_obj.is_file():
-            try:
-                print(f"Loading .gitignore rules from: {gitignore_path_obj}")
-                with open(gitignore_path_obj, 'r', encoding='utf-8') as f_ignore:
-                    ignore_matches = gitignore_parser.parse(f_ignore)
-                print(".gitignore rules loaded successfully.")
-            except Exception as e:
-                print(f"WARNING: Could not read or parse {gitignore_path_obj}: {e}")
-        else:
-            # Check if the non-resolved path exists either, just for informative message
-            if not (Path(start_dir) / GITIGNORE_PATH).exists():
-                 print(f"INFO: .gitignore file not found at {gitignore_path_obj}. Skipping .gitignore checks.")
-            else:
-                 print(f"INFO: .gitignore found at relative path but resolved path {gitignore_path_obj} seems incorrect or inaccessible.")
-
-
     processed_files_count = 0
+    reused_files_count = 0
+    skipped = Counter() # Files and directories excluded by the rules, counted during the walk
     skipped_files_count = 0
-    skipped_dirs_count = 0
+    files = {}
 
     try:
-        with open(output_path, 'w', encoding='utf-8') as f_out:
-            for dirpath, dirnames, filenames in os.walk(base_path, topdown=True):
-                current_dir_path = Path(dirpath)
-                relative_dir_path = current_dir_path.relative_to(base_path)
-
-                # --- Prune Ignored Directories ---
-                dirs_to_remove = set()
-                for dir_name in dirnames: # No need for index/pop, just rebuild the list
-                    dir_full_path = current_dir_path / dir_name
-                    should_skip = False
-                    reason = ""
-
-                    if should_ignore_dir(dir_name, dir_full_path, base_path):
-                        should_skip = True
-                        reason = "Rule"
-                    elif ignore_matches and ignore_matches(dir_full_path):
-                         # Check .gitignore only if not already skipped by rule
-                         should_skip = True
-                         reason = ".gitignore"
-
-                    if should_skip:
-                        print(f"Skipping directory ({reason}): {relative_dir_path / dir_name}")
-                        dirs_to_remove.add(dir_name)
-                        skipped_dirs_count += 1
-
-                # Modify dirnames *in-place* for os.walk pruning
-                dirnames[:] = [d for d in dirnames if d not in dirs_to_remove]
-
-
-                # --- Process Files in the Current Directory ---
-                for filename in filenames:
-                    file_full_path = current_dir_path / filename
-                    relative_file_path = file_full_path.relative_to(base_path)
-
-                    should_skip_file = False
-                    skip_reason = ""
-
-                    # 1. Check specific exclusions, always ignore list, Django structure, binary files
-                    if should_ignore_file(filename, file_full_path, base_path, output_path, gitignore_path_obj):
-                        should_skip_file = True
-                        # Skip reason is printed inside should_ignore_file for these rules
-
-                    # 2. Check .gitignore (only if not already skipped by other rules)
-                    elif ignore_matches and ignore_matches(file_full_path):
-                         should_skip_file = True
-                         skip_reason = ".gitignore" # Need to print reason here
-
-                    if should_skip_file:
-                        if skip_reason: # Print reason only if it wasn't printed inside should_ignore_file
-                            print(f"Skipping file ({skip_reason}): {relative_file_path}")
-                        skipped_files_count += 1
-                        continue
-
-                    # --- If file is not skipped, process it ---
-                    print(f"Processing: {relative_file_path}")
-                    processed_files_count += 1
-                    try:
-                        with open(file_full_path, 'r', encoding='utf-8', errors='ignore') as f_in:
-                            content = f_in.read()
-                        f_out.write(f"--- START FILE: {relative_file_path} ---\n\n")
-                        f_out.write(content)
-                        f_out.write(f"\n\n--- END FILE: {relative_file_path} ---\n\n\n")
-
-                    except Exception as e:
-                        print(f"ERROR: Could not read file {relative_file_path}: {e}")
-                        skipped_files_count += 1
-                        f_out.write(f"--- START FILE: {relative_file_path} ---\n\n")
-                        f_out.write(f"!!! FAILED TO READ FILE: {e} !!!")
-                        f_out.write(f"\n\n--- END FILE: {relative_file_path} ---\n\n\n")
-
+        with open(temp_output_path, 'wb') as f_out:
+            for entry in iter_bundle(start_dir, output_filename, incremental, max_workers, print, skipped):
+                record = {
+                    'mtime_ns': entry.mtime_ns, 'size': entry.size, 'sha256': entry.sha256, 'binary': entry.binary,
+                    'error': entry.error, 'offset': None, 'length': None,
+                }
+                files[entry.path] = record
+                if entry.binary:
+                    print(f"Skipping file (Binary?): {entry.path}")
+                    skipped_files_count += 1
+                    continue
+
+                processed_files_count += 1
+                if entry.reused:
+                    reused_files_count += 1
+                else:
+                    print(f"Processing: {entry.path}")
+                if entry.error is not None:
+                    print(f"ERROR: Could not read file {entry.path}: {entry.error}")
+                    skipped_files_count += 1
+                    header, body, footer = _block(entry.path, f"!!! FAILED TO READ FILE: {entry.error} !!!")
+                    f_out.write(header + body + footer)
+                    continue
+                header, body, footer = _block(entry.path, entry.content)
+                f_out.write(header)
+                record['offset'], record['length'] = f_out.tell(), len(body)
+                f_out.write(body)
+                f_out.write(footer)
+
+        os.replace(temp_output_path, output_path)
+        stat = output_path.stat()
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'rules': rules_fingerprint((base_path / GITIGNORE_PATH).resolve()),
+            'output_size': stat.st_size,
+            'output_mtime_ns': stat.st_mtime_ns,
+            'files': files,
+        }
+        with open(manifest_path, 'w', encoding='utf-8') as f_manifest:
+            json.dump(manifest, f_manifest)
 
         print(f"\n--- Summary ---")
-        print(f"Processed: {processed_files_count} files.")
-        print(f"Skipped:   {skipped_files_count} files.")
-        print(f"Skipped:   {skipped_dirs_count} directories (and their contents).")
+        print(f"Processed: {processed_files_count} files ({reused_files_count} unchanged since the last run).")
+        print(f"Skipped:   {skipped_files_count + skipped['files']} files.")
+        print(f"Skipped:   {skipped['dirs']} directories (and their contents).")
         print(f"Combined content saved to: {output_path}")
 
     except IOError as e:
@@ -240,14 +385,31 @@ def combine_code_from_walk(start_dir: str, output_filename: str):
         print(f"An unexpected error occurred during traversal: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if temp_output_path.exists():
+            temp_output_path.unlink()
 
 
-if __name__ == "__main__":
+def positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1."""
     try:
-        import gitignore_parser
-    except ImportError:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, not {value!r}")
+    return number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concatenate the project's source files into one text file.")
+    parser.add_argument('--full', action='store_true', help="Re-read every file instead of reusing the previous output.")
+    parser.add_argument('--workers', type=positive_int, default=MAX_WORKERS, help="Number of threads reading files.")
+    args = parser.parse_args()
+
+    if USE_GITIGNORE and gitignore_parser is None:
         print("ERROR: The 'gitignore-parser' library is required.")
         print("Please install it using: pip install gitignore-parser")
         sys.exit(1) # Use sys.exit
 
-    combine_code_from_walk(START_DIR, OUTPUT_FILENAME)
\ No newline at end of file
+    combine_code_from_walk(START_DIR, OUTPUT_FILENAME, incremental=INCREMENTAL and not args.full, max_workers=args.workers)
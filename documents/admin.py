@@ -1,12 +1,157 @@
 from django.contrib import admin
-from .models import DocumentType, DocumentChange, Document, DocumentRevision, DocumentRevisionPreviousRevisionActionTag, DocumentRevisionInputPart, DocumentRevisionOutputPart, DocumentRevisionAttachedFile, DocumentRevisionProcessStep
-
-admin.site.register(DocumentType)
-admin.site.register(DocumentChange)
-admin.site.register(Document)
-admin.site.register(DocumentRevision)
-admin.site.register(DocumentRevisionPreviousRevisionActionTag)
-admin.site.register(DocumentRevisionInputPart)
-admin.site.register(DocumentRevisionOutputPart)
-admin.site.register(DocumentRevisionAttachedFile)
-admin.site.register(DocumentRevisionProcessStep)
+from .models import ControlNumberSequence, DocumentType, DocumentChange, Document, DocumentRevision, DocumentRevisionPreviousRevisionActionTag, DocumentRevisionInputPart, DocumentRevisionOutputPart, DocumentRevisionAttachedFile, DocumentRevisionProcessStep, DocumentRevisionPolicySection
+from .paginators import EstimatedCountPaginator
+
+REVISION_RELATED = ('document_revision__document__document_type',)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # Avoid the two COUNT(*) queries the changelist would otherwise run per page. The
+    # unfiltered total and page count come from the last ANALYZE, so they are approximate.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ControlNumberSequenceInline(admin.StackedInline):
+    model = ControlNumberSequence
+    fields = ('prefix', 'padding', 'next_value')
+    readonly_fields = ('next_value',)
+    can_delete = False
+
+
+@admin.register(DocumentType)
+class DocumentTypeAdmin(admin.ModelAdmin):
+    list_display = ('code', 'display_name')
+    search_fields = ('code', 'display_name')
+    ordering = ('code',)
+    inlines = (ControlNumberSequenceInline,)
+
+
+@admin.register(DocumentRevisionPreviousRevisionActionTag)
+class DocumentRevisionPreviousRevisionActionTagAdmin(admin.ModelAdmin):
+    list_display = ('display_name',)
+    search_fields = ('display_name',)
+
+
+@admin.register(DocumentChange)
+class DocumentChangeAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'owner')
+    list_select_related = ('owner',)
+    search_fields = ('title',)
+    autocomplete_fields = ('owner',)
+
+
+@admin.register(Document)
+class DocumentAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'control_number', 'legacy_control_number', 'document_type')
+    list_select_related = ('document_type',)
+    list_filter = ('document_type',)
+    search_fields = ('^control_number', '^legacy_control_number')
+    autocomplete_fields = ('document_type',)
+    ordering = ('control_number',)
+
+    def get_queryset(self, request):
+        # Also used by autocomplete, which renders __str__ for every match.
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+
+class DocumentRevisionChildInline(admin.TabularInline):
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*REVISION_RELATED)
+
+
+class DocumentRevisionInputPartInline(DocumentRevisionChildInline):
+    model = DocumentRevisionInputPart
+    autocomplete_fields = ('input_part',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('input_part__document_type')
+
+
+class DocumentRevisionOutputPartInline(DocumentRevisionChildInline):
+    model = DocumentRevisionOutputPart
+    autocomplete_fields = ('output_part',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('output_part__document_type')
+
+
+class DocumentRevisionAttachedFileInline(DocumentRevisionChildInline):
+    model = DocumentRevisionAttachedFile
+
+
+class DocumentRevisionProcessStepInline(DocumentRevisionChildInline):
+    model = DocumentRevisionProcessStep
+    autocomplete_fields = ('roles', 'locations')
+
+
+class DocumentRevisionPolicySectionInline(DocumentRevisionChildInline):
+    model = DocumentRevisionPolicySection
+    fields = ('number', 'parent', 'order', 'header', 'text')
+    readonly_fields = ('number',)
+    raw_id_fields = ('parent',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).order_by('path')
+
+
+@admin.register(DocumentRevision)
+class DocumentRevisionAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'title', 'document_change', 'finished_device')
+    list_select_related = ('document__document_type', 'document_change')
+    list_filter = ('document__document_type', 'finished_device')
+    search_fields = ('^document__control_number', '^document__legacy_control_number', 'title')
+    ordering = ('-pk',)
+    autocomplete_fields = (
+        'document', 'document_change', 'previous_revision_action_tags', 'process_roles', 'process_locations',
+    )
+    inlines = (
+        DocumentRevisionInputPartInline, DocumentRevisionOutputPartInline, DocumentRevisionAttachedFileInline,
+        DocumentRevisionProcessStepInline, DocumentRevisionPolicySectionInline,
+    )
+
+    def get_queryset(self, request):
+        # Setting select_related here stops the changelist from applying list_select_related.
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+
+class DocumentRevisionChildAdmin(LargeTableAdmin):
+    list_select_related = REVISION_RELATED
+    ordering = ('-pk',)
+    search_fields = ('^document_revision__document__control_number',)
+    autocomplete_fields = ('document_revision',)
+
+
+@admin.register(DocumentRevisionInputPart)
+class DocumentRevisionInputPartAdmin(DocumentRevisionChildAdmin):
+    list_display = ('__str__', 'order', 'quantity')
+    list_select_related = REVISION_RELATED + ('input_part__document_type',)
+    autocomplete_fields = ('document_revision', 'input_part')
+
+
+@admin.register(DocumentRevisionOutputPart)
+class DocumentRevisionOutputPartAdmin(DocumentRevisionChildAdmin):
+    list_display = ('__str__', 'order')
+    list_select_related = REVISION_RELATED + ('output_part__document_type',)
+    autocomplete_fields = ('document_revision', 'output_part')
+
+
+@admin.register(DocumentRevisionAttachedFile)
+class DocumentRevisionAttachedFileAdmin(DocumentRevisionChildAdmin):
+    list_display = ('__str__', 'order')
+
+
+@admin.register(DocumentRevisionProcessStep)
+class DocumentRevisionProcessStepAdmin(DocumentRevisionChildAdmin):
+    list_display = ('__str__', 'order')
+    autocomplete_fields = ('document_revision', 'roles', 'locations')
+
+
+@admin.register(DocumentRevisionPolicySection)
+class DocumentRevisionPolicySectionAdmin(DocumentRevisionChildAdmin):
+    list_display = ('__str__', 'number')
+    ordering = ('-document_revision', 'path')
+    readonly_fields = ('number',)
+    raw_id_fields = ('parent',)
@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import time
+from dataclasses import dataclass, field
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from .models import Document, DocumentRevision, DocumentRevisionInputPart, DocumentRevisionOutputPart
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 5000
+GENERATION_KEY = 'documents:api-generation'
+
+
+@dataclass
+class Relation:
+    resource: str
+    # Forward relations read the target ids from this field of each row; reverse
+    # relations select the target rows whose `field` points at a row's id.
+    field: str
+    reverse: bool = False
+
+
+@dataclass
+class Resource:
+    queryset: object
+    # API field name -> ORM lookup passed to values().
+    fields: dict
+    filters: dict = field(default_factory=dict)
+    relations: dict = field(default_factory=dict)
+
+
+RESOURCES = {
+    'documents': Resource(
+        Document.objects.all(),
+        fields={
+            'id': 'pk',
+            'control_number': 'control_number',
+            'legacy_control_number': 'legacy_control_number',
+            'document_type': 'document_type__code',
+            'effective_revision': 'effective_revision_id',
+            'device_identifier': 'device_identifier',
+        },
+        filters={'control_number': 'control_number', 'document_type': 'document_type__code'},
+        relations={'effective_revision': Relation('revisions', 'effective_revision')},
+    ),
+    'revisions': Resource(
+        DocumentRevision.objects.all(),
+        fields={
+            'id': 'pk',
+            'document': 'document_id',
+            'document_change': 'document_change_id',
+            'major_revision': 'major_revision',
+            'legacy_revision': 'legacy_revision',
+            'title': 'title',
+            'design_ownership': 'design_ownership',
+            'manufacturing_options': 'manufacturing_options',
+            'finished_device': 'finished_device',
+            'device_identifier_number': 'device_identifier_number',
+            'device_identifier': 'device_identifier',
+            'change_description': 'change_description',
+            'previous_revision_disposition': 'previous_revision_disposition',
+            'process_purpose_and_scope': 'process_purpose_and_scope',
+        },
+        filters={'document': 'document', 'control_number': 'document__control_number'},
+        relations={
+            'document': Relation('documents', 'document'),
+            'input_parts': Relation('input-parts', 'revision', reverse=True),
+            'output_parts': Relation('output-parts', 'revision', reverse=True),
+        },
+    ),
+    'input-parts': Resource(
+        DocumentRevisionInputPart.objects.all(),
+        fields={'id': 'pk', 'revision': 'document_revision_id', 'part': 'input_part_id', 'order': 'order', 'quantity': 'quantity'},
+        filters={'revision': 'document_revision', 'part': 'input_part'},
+        relations={'revision': Relation('revisions', 'revision'), 'part': Relation('documents', 'part')},
+    ),
+    'output-parts': Resource(
+        DocumentRevisionOutputPart.objects.all(),
+        fields={'id': 'pk', 'revision': 'document_revision_id', 'part': 'output_part_id', 'order': 'order'},
+        filters={'revision': 'document_revision', 'part': 'output_part'},
+        relations={'revision': Relation('revisions', 'revision'), 'part': Relation('documents', 'part')},
+    ),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def mark_changed():
+    """Record that API data changed; conditional GETs made before this are answered in full again."""
+    transaction.on_commit(lambda: cache.set(GENERATION_KEY, time.time_ns(), None))
+
+
+def generation():
+    """The current generation of API data; it changes whenever mark_changed() commits."""
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest('Invalid cursor.')
+
+
+def _selected(resource_name, requested):
+    resource = RESOURCES[resource_name]
+    if not requested:
+        return resource.fields
+    names = ['id', *(name for name in requested.split(',') if name and name != 'id')]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        raise BadRequest(f'Unknown fields for {resource_name}: {", ".join(unknown)}.')
+    return {name: resource.fields[name] for name in names}
+
+
+def _rows(queryset, fields):
+    return [
+        {name: row[lookup] for name, lookup in fields.items()}
+        for row in queryset.values(*dict.fromkeys(fields.values()))
+    ]
+
+
+def _side_load(resource_name, rows, params, include):
+    """Load included relations with one query per relation."""
+    resource = RESOURCES[resource_name]
+    included = {}
+    for name in include:
+        if name not in resource.relations:
+            raise BadRequest(f'Unknown include for {resource_name}: {name}.')
+        relation = resource.relations[name]
+        target = RESOURCES[relation.resource]
+        fields = _selected(relation.resource, params.get(f'fields[{relation.resource}]'))
+        if relation.reverse:
+            lookup = target.fields[relation.field]
+            fields = {**fields, relation.field: lookup}
+            queryset = target.queryset.filter(**{f'{lookup}__in': [row['id'] for row in rows]})
+        else:
+            if rows and relation.field not in rows[0]:
+                raise BadRequest(f'Include {name} needs the {relation.field} field.')
+            ids = {row[relation.field] for row in rows} - {None}
+            queryset = target.queryset.filter(pk__in=ids)
+        loaded = included.setdefault(relation.resource, {})
+        for row in _rows(queryset.order_by('pk'), fields):
+            loaded.setdefault(row['id'], row)
+    return {name: list(rows.values()) for name, rows in included.items()}
+
+
+def list_resource(request, resource_name):
+    resource = RESOURCES[resource_name]
+    params = request.GET
+    try:
+        limit = max(1, min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        raise BadRequest('limit must be an integer.')
+    fields = _selected(resource_name, params.get('fields'))
+    include = [name for name in params.get('include', '').split(',') if name]
+
+    queryset = resource.queryset
+    for name, lookup in resource.filters.items():
+        if name in params:
+            try:
+                queryset = queryset.filter(**{lookup: params[name]})
+            except ValueError:
+                raise BadRequest(f'Invalid value for {name}.')
+    if resource_name == 'revisions' and params.get('effective') in ('1', 'true'):
+        queryset = queryset.effective()
+    if 'cursor' in params:
+        queryset = queryset.filter(pk__gt=decode_cursor(params['cursor']))
+
+    # Keyset pagination: one row past the page tells whether there is a next page.
+    rows = _rows(queryset.order_by('pk')[:limit + 1], fields)
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        query = params.copy()
+        query['cursor'] = encode_cursor(rows[-1]['id'])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+    body = {'data': rows, 'next': next_url}
+    if include:
+        body['included'] = _side_load(resource_name, rows, params, include)
+    return body
+
+
+def api_view(request, resource_name):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({'error': 'Method not allowed.'}, status=405, headers={'Allow': 'GET, HEAD'})
+    if resource_name not in RESOURCES:
+        return JsonResponse({'error': f'Unknown resource "{resource_name}".'}, status=404)
+
+    # Every change to API data bumps the generation, so it validates any response.
+    current = generation()
+    etag = quote_etag(hashlib.sha256(f'{current}:{request.get_full_path()}'.encode()).hexdigest()[:32])
+    last_modified = current // 1_000_000_000
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            response = JsonResponse(list_resource(request, resource_name))
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
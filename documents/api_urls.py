@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import api, views
+
+app_name = 'documents_api'
+
+urlpatterns = [
+    path('device-identifiers/resolve/', views.resolve_device_identifiers, name='resolve_device_identifiers'),
+    path('<slug:resource_name>/', api.api_view, name='list'),
+]
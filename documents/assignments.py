@@ -0,0 +1,112 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+from .commit_hooks import schedule_once
+from .models import DocumentRevision, DocumentRevisionProcessStep, ProcessStepAssignment
+
+BATCH_SIZE = 1000
+
+
+def _grouped(through, source, target, ids):
+    grouped = defaultdict(list)
+    for source_id, target_id in through.objects.filter(**{f'{source}__in': ids}).values_list(f'{source}_id', f'{target}_id'):
+        grouped[source_id].append(target_id)
+    return grouped
+
+
+def _assignments(document_ids):
+    """Assignment rows for the effective revisions of the given documents, with six queries."""
+    revisions = {
+        pk: (document, by_role, by_location)
+        for pk, document, by_role, by_location in DocumentRevision.objects.effective().filter(
+            document__in=document_ids,
+        ).values_list('pk', 'document', 'process_set_roles_by_step', 'process_set_locations_by_step')
+    }
+    steps = dict(
+        DocumentRevisionProcessStep.objects.filter(document_revision__in=revisions).values_list('pk', 'document_revision')
+    )
+    if not steps:
+        return []
+    revision_roles = _grouped(DocumentRevision.process_roles.through, 'documentrevision', 'role', revisions)
+    revision_locations = _grouped(DocumentRevision.process_locations.through, 'documentrevision', 'location', revisions)
+    step_roles = _grouped(DocumentRevisionProcessStep.roles.through, 'documentrevisionprocessstep', 'role', steps)
+    step_locations = _grouped(DocumentRevisionProcessStep.locations.through, 'documentrevisionprocessstep', 'location', steps)
+
+    rows = []
+    for step, revision in steps.items():
+        document, by_role, by_location = revisions[revision]
+        roles = step_roles[step] if by_role else revision_roles[revision]
+        locations = step_locations[step] if by_location else revision_locations[revision]
+        for role in roles or [None]:
+            for location in locations or [None]:
+                if role is not None or location is not None:
+                    rows.append(ProcessStepAssignment(document_id=document, step_id=step, role_id=role, location_id=location))
+    return rows
+
+
+@transaction.atomic
+def refresh_documents(document_ids):
+    """Recompute the assignments of the given documents from their effective revisions."""
+    document_ids = list(set(document_ids))
+    for start in range(0, len(document_ids), BATCH_SIZE):
+        batch = document_ids[start:start + BATCH_SIZE]
+        ProcessStepAssignment.objects.filter(document__in=batch).delete()
+        ProcessStepAssignment.objects.bulk_create(_assignments(batch), batch_size=BATCH_SIZE)
+
+
+def schedule_refresh(document_ids=(), revision_ids=()):
+    """Refresh once when the current transaction commits, however many changes touched the documents."""
+    schedule_once(
+        _refresh_pending, [('document', pk) for pk in document_ids] + [('revision', pk) for pk in revision_ids],
+    )
+
+
+def _refresh_pending(items):
+    documents = {pk for kind, pk in items if kind == 'document'}
+    revisions = {pk for kind, pk in items if kind == 'revision'}
+    if revisions:
+        documents.update(DocumentRevision.objects.filter(pk__in=revisions).values_list('document', flat=True))
+    if documents:
+        refresh_documents(documents)
+
+
+@transaction.atomic
+def rebuild(batch_size=BATCH_SIZE):
+    """Recompute the whole table from the effective revisions with process steps."""
+    ProcessStepAssignment.objects.all().delete()
+    document_ids = list(
+        DocumentRevisionProcessStep.objects.filter(document_revision__in=DocumentRevision.objects.effective())
+        .order_by('document_revision__document').values_list('document_revision__document', flat=True).distinct()
+    )
+    for start in range(0, len(document_ids), batch_size):
+        ProcessStepAssignment.objects.bulk_create(_assignments(document_ids[start:start + batch_size]), batch_size=batch_size)
+
+
+def assignments(role=None, location=None):
+    """Assignments of the effective process documents, for a role, a location or both (instances or primary keys)."""
+    queryset = ProcessStepAssignment.objects.all()
+    if role is not None:
+        queryset = queryset.filter(role=role)
+    if location is not None:
+        queryset = queryset.filter(location=location)
+    return queryset
+
+
+def steps(role=None, location=None):
+    """The process steps a role performs, or that are performed at a location, or both, in document order."""
+    return DocumentRevisionProcessStep.objects.filter(
+        pk__in=assignments(role, location).values('step'),
+    ).select_related('document_revision__document__document_type').order_by(
+        'document_revision__document__control_number', 'order',
+    )
+
+
+def matrix():
+    """(role id, location id, steps, documents) for every combination that has work assigned."""
+    return (
+        ProcessStepAssignment.objects.values_list('role', 'location')
+        .annotate(steps=Count('step', distinct=True), documents=Count('document', distinct=True))
+        .order_by('role', 'location')
+    )
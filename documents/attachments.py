@@ -0,0 +1,106 @@
+import os
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import derivatives
+from .models import DocumentRevisionAttachedFile, DocumentRevisionProcessStep, FileBlob
+from .storage import digest_of
+
+storage = DocumentRevisionAttachedFile._meta.get_field('file').storage
+
+# (model, file field, digest field) of the rows that reference blobs.
+BLOB_REFERENCES = (
+    (DocumentRevisionAttachedFile, 'file', 'sha256'),
+    (DocumentRevisionProcessStep, 'image', 'image_sha256'),
+)
+
+
+def _reference_count(model, digest_field):
+    references = (
+        model.objects.filter(**{digest_field: OuterRef('sha256')})
+        .order_by().values(digest_field).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(references), Value(0))
+
+
+def sync_blob_refs(digests):
+    """Create missing FileBlob rows for the given digests and recount their references."""
+    digests = {digest for digest in digests if digest}
+    if not digests:
+        return
+    known = set(FileBlob.objects.filter(sha256__in=digests).values_list('sha256', flat=True))
+    new_blobs = []
+    for model, file_field, digest_field in BLOB_REFERENCES:
+        if digests <= known:
+            break
+        rows = model.objects.filter(**{f'{digest_field}__in': digests - known}).values_list(digest_field, file_field)
+        for digest, name in rows:
+            if digest not in known:
+                known.add(digest)
+                new_blobs.append(FileBlob(sha256=digest, name=name, size=storage.size(name)))
+    FileBlob.objects.bulk_create(new_blobs, ignore_conflicts=True)
+
+    ref_count = sum(_reference_count(model, digest_field) for model, _, digest_field in BLOB_REFERENCES)
+    FileBlob.objects.filter(sha256__in=digests).update(ref_count=ref_count)
+
+
+def attach_blob(document_revision, sha256, description, order):
+    """Attach content that is already stored, without uploading or copying it."""
+    blob = FileBlob.objects.get(sha256=sha256)
+    # A gc_blobs run that already counted the blob as unreferenced now sees it reused.
+    if not storage.touch_blob(blob.name):
+        raise FileBlob.DoesNotExist(f'The file of blob {sha256} has been deleted.')
+    return DocumentRevisionAttachedFile.objects.create(
+        document_revision=document_revision, file=blob.name, description=description, order=order,
+    )
+
+
+def collect_garbage(min_age=3600, dry_run=False):
+    """
+    Delete blobs no attachment or process step references any more, with their image
+    renditions, plus blob files on disk that never got a row. Files stored or reused
+    less than min_age seconds ago are left alone, since an upload in progress is
+    stored before its row is saved. Returns the deleted names.
+    """
+    with transaction.atomic():
+        digests = set(FileBlob.objects.values_list('sha256', flat=True))
+        for model, _, digest_field in BLOB_REFERENCES:
+            digests.update(model.objects.exclude(**{digest_field: ''}).values_list(digest_field, flat=True).distinct())
+        sync_blob_refs(digests)
+    candidates = defaultdict(set)
+    for digest, name in FileBlob.objects.filter(ref_count=0).values_list('sha256', 'name'):
+        candidates[digest].add(name)
+
+    # Attachments and step images are stored in separate directories, so one digest may have a file in each.
+    live = set(FileBlob.objects.filter(ref_count__gt=0).values_list('sha256', flat=True))
+    for model, file_field, _ in BLOB_REFERENCES:
+        for dirpath, _, filenames in os.walk(storage.path(model._meta.get_field(file_field).upload_to)):
+            for filename in filenames:
+                digest = digest_of(filename)
+                if digest and digest not in live:
+                    path = os.path.join(dirpath, filename)
+                    candidates[digest].add(os.path.relpath(path, storage.location).replace(os.sep, '/'))
+
+    # Rows saved since the recount keep their blob.
+    for model, _, digest_field in BLOB_REFERENCES:
+        for digest in model.objects.filter(**{f'{digest_field}__in': candidates}).values_list(digest_field, flat=True):
+            candidates.pop(digest, None)
+    cutoff = time.time() - min_age
+    deleted = []
+    for digest, names in candidates.items():
+        gone = []
+        for name in sorted(names):
+            if dry_run:
+                if not storage.exists(name) or storage.get_modified_time(name).timestamp() < cutoff:
+                    gone.append(name)
+            elif storage.delete_blob(name, unused_since=cutoff) or not storage.exists(name):
+                derivatives.delete_renditions(name)
+                gone.append(name)
+        if len(gone) == len(names) and not dry_run:
+            FileBlob.objects.filter(sha256=digest, ref_count=0).delete()
+        deleted.extend(gone)
+    return deleted
@@ -0,0 +1,144 @@
+import platform
+import random
+import statistics
+import subprocess
+import time
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+
+from tqms.instrumentation import record_queries
+
+from . import bom, export, rendering, search
+from .models import Document, DocumentRevision
+from .synthetic import WORDS
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+class Context:
+    """Inputs shared by the benchmarks, sampled once so every run times the same work."""
+
+    def __init__(self, samples, seed):
+        rng = random.Random(seed)
+        document_ids = list(Document.objects.order_by('pk').values_list('pk', flat=True))
+        revision_ids = list(DocumentRevision.objects.effective().order_by('pk').values_list('pk', flat=True))
+        with_parts = list(
+            DocumentRevision.objects.effective().filter(documentrevisioninputpart__isnull=False)
+            .order_by('document').values_list('document', flat=True).distinct()
+        )
+        self.documents = rng.sample(document_ids, min(samples, len(document_ids)))
+        self.revisions = rng.sample(revision_ids, min(samples, len(revision_ids)))
+        self.assemblies = rng.sample(with_parts, min(samples, len(with_parts)))
+        self.terms = [' '.join(rng.sample(WORDS, 2)) for _ in range(samples)]
+        self.client = Client(HTTP_HOST='localhost')
+        user = get_user_model().objects.filter(is_superuser=True).first()
+        if user is None:
+            user = get_user_model().objects.create_superuser('benchmark', password=None)
+        self.client.force_login(user)
+
+
+@benchmark('register_export')
+def register_export(context, rows=10_000):
+    for _ in islice(export.iter_register(), rows):
+        pass
+
+
+@benchmark('bom_explode')
+def bom_explode(context):
+    for document_id in context.assemblies:
+        bom.explode(Document.objects.select_related('document_type').get(pk=document_id)).totals()
+
+
+@benchmark('revision_load')
+def revision_load(context):
+    for revision_id in context.revisions:
+        rendering.revision_queryset().get(pk=revision_id)
+
+
+@benchmark('revision_render_cold')
+def revision_render_cold(context):
+    # Not rendering.invalidate(), which waits for a commit that may never come.
+    cache.delete_many([rendering.cache_key(revision_id) for revision_id in context.revisions])
+    for revision_id in context.revisions:
+        rendering.render_revision(revision_id)
+
+
+@benchmark('revision_render_cached')
+def revision_render_cached(context):
+    for revision_id in context.revisions:
+        rendering.render_revision(revision_id)
+
+
+@benchmark('admin_document_changelist')
+def admin_document_changelist(context):
+    response = context.client.get('/admin/documents/document/', {'q': '00'})
+    assert response.status_code == 200, response.status_code
+
+
+@benchmark('admin_revision_changelist')
+def admin_revision_changelist(context):
+    response = context.client.get('/admin/documents/documentrevision/')
+    assert response.status_code == 200, response.status_code
+
+
+@benchmark('search')
+def full_text_search(context):
+    for terms in context.terms:
+        search.search(terms)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, repeat=5, samples=20, seed=1):
+    """Time each benchmark `repeat` times and return a JSON-serialisable report."""
+    context = Context(samples, seed)
+    results = {}
+    for name in names or BENCHMARKS:
+        function = BENCHMARKS[name]
+        timings, queries = [], []
+        for _ in range(repeat):
+            with record_queries() as recorder:
+                start = time.perf_counter()
+                function(context)
+                timings.append(time.perf_counter() - start)
+            queries.append(recorder.count)
+        results[name] = {
+            'min_ms': round(min(timings) * 1000, 2),
+            'median_ms': round(statistics.median(timings) * 1000, 2),
+            'max_ms': round(max(timings) * 1000, 2),
+            'queries': queries[-1],
+        }
+    cache.clear()
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'dataset': {
+            'documents': Document.objects.count(),
+            'revisions': DocumentRevision.objects.count(),
+        },
+        'settings': {'repeat': repeat, 'samples': samples, 'seed': seed},
+        'results': results,
+    }
@@ -0,0 +1,146 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import connection
+
+from .models import Document, DocumentRevision, DocumentRevisionInputPart
+
+# Deeper BOMs are reported with BOMError rather than cut off.
+DEFAULT_MAX_DEPTH = 32
+
+
+class BOMError(Exception):
+    """The parts below a revision loop back on themselves or nest deeper than allowed."""
+
+    def __init__(self, message, documents):
+        super().__init__(message)
+        # The chain of documents from the exploded one down to the offending part.
+        self.documents = documents
+
+
+@dataclass
+class BOMLine:
+    depth: int
+    order: int
+    document: Document
+    revision: DocumentRevision | None
+    quantity: int
+    total_quantity: int
+    children: list['BOMLine'] = field(default_factory=list)
+
+    def __str__(self):
+        return f'{self.document} x{self.quantity}'
+
+
+@dataclass
+class BillOfMaterials:
+    revision: DocumentRevision
+    lines: list[BOMLine]
+
+    def walk(self):
+        """Yield every line depth-first, in the order an indented BOM is printed."""
+        stack = list(reversed(self.lines))
+        while stack:
+            line = stack.pop()
+            yield line
+            stack.extend(reversed(line.children))
+
+    def totals(self):
+        """Return the rolled-up quantity of each leaf part needed for one root assembly."""
+        totals = defaultdict(int)
+        for line in self.walk():
+            if not line.children:
+                totals[line.document] += line.total_quantity
+        return dict(totals)
+
+
+def _explosion_sql(max_depth):
+    effective_sql, effective_params = (
+        DocumentRevision.objects.effective().values_list('document_id', 'pk').query.sql_with_params()
+    )
+    input_part = connection.ops.quote_name(DocumentRevisionInputPart._meta.db_table)
+    order = connection.ops.quote_name('order')
+    # ancestors lists the documents above each line as '/1/5/9/'. A part already among
+    # them is returned flagged as cyclic and not expanded, and the recursion goes one
+    # level past max_depth so that a BOM cut off by the limit can be told apart.
+    sql = f'''
+        WITH RECURSIVE effective (document_id, revision_id) AS ({effective_sql}),
+        bom (path, depth, document_id, revision_id, part_order, quantity, total_quantity, ancestors, cyclic) AS (
+            SELECT CAST(ip.id AS TEXT), 1, ip.input_part_id, e.revision_id, ip.{order},
+                   ip.quantity, CAST(ip.quantity AS BIGINT),
+                   %s || CAST(ip.input_part_id AS TEXT) || '/', CASE WHEN ip.input_part_id = %s THEN 1 ELSE 0 END
+            FROM {input_part} ip
+            LEFT JOIN effective e ON e.document_id = ip.input_part_id
+            WHERE ip.document_revision_id = %s
+            UNION ALL
+            SELECT b.path || '/' || CAST(ip.id AS TEXT), b.depth + 1, ip.input_part_id, e.revision_id, ip.{order},
+                   ip.quantity, b.total_quantity * ip.quantity,
+                   b.ancestors || CAST(ip.input_part_id AS TEXT) || '/',
+                   CASE WHEN b.ancestors LIKE '%%/' || CAST(ip.input_part_id AS TEXT) || '/%%' THEN 1 ELSE 0 END
+            FROM bom b
+            JOIN {input_part} ip ON ip.document_revision_id = b.revision_id
+            LEFT JOIN effective e ON e.document_id = ip.input_part_id
+            WHERE b.cyclic = 0 AND b.depth <= {int(max_depth)}
+        )
+        SELECT path, depth, document_id, revision_id, part_order, quantity, total_quantity, ancestors, cyclic FROM bom
+    '''
+    return sql, list(effective_params)
+
+
+def explode(document_or_revision, max_depth=DEFAULT_MAX_DEPTH):
+    """
+    Resolve the full indented bill of materials below a document or revision.
+
+    A Document is exploded from its effective revision, and every child part is
+    expanded through its own effective revision. The whole tree is loaded with a
+    single recursive query plus one query each for the documents and revisions
+    it references, regardless of depth. Raises BOMError when the parts loop back on
+    themselves or nest deeper than max_depth.
+    """
+    if isinstance(document_or_revision, Document):
+        revision = DocumentRevision.objects.effective().select_related('document__document_type').get(
+            document=document_or_revision
+        )
+    else:
+        revision = document_or_revision
+
+    sql, params = _explosion_sql(max_depth)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [f'/{revision.document_id}/', revision.document_id, revision.pk])
+        rows = cursor.fetchall()
+
+    documents = Document.objects.select_related('document_type').in_bulk(
+        {row[2] for row in rows} | {revision.document_id}
+    )
+    revisions = DocumentRevision.objects.in_bulk({row[3] for row in rows if row[3] is not None})
+
+    for _, depth, *_, ancestors, cyclic in rows:
+        if cyclic or depth > max_depth:
+            chain = [documents[int(pk)] for pk in ancestors.strip('/').split('/')]
+            if cyclic:
+                start = chain.index(chain[-1])
+                message = f'{chain[start]} uses itself as a part: ' + ' -> '.join(map(str, chain[start:])) + '.'
+            else:
+                message = f'The BOM of {chain[0]} is deeper than {max_depth} levels.'
+            raise BOMError(message, chain)
+
+    lines_by_path = {}
+    for path, depth, document_id, revision_id, order, quantity, total_quantity, _, _ in rows:
+        document = documents[document_id]
+        child_revision = revisions.get(revision_id)
+        if child_revision is not None:
+            child_revision.document = document
+        lines_by_path[path] = BOMLine(depth, order, document, child_revision, quantity, total_quantity)
+
+    roots = []
+    # Parents always have shorter paths than their children.
+    for path in sorted(lines_by_path, key=len):
+        line = lines_by_path[path]
+        parent_path = path.rpartition('/')[0]
+        siblings = lines_by_path[parent_path].children if parent_path else roots
+        siblings.append(line)
+    for line in lines_by_path.values():
+        line.children.sort(key=lambda child: child.order)
+    roots.sort(key=lambda child: child.order)
+
+    return BillOfMaterials(revision, roots)
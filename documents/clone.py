@@ -0,0 +1,86 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import api, assignments, attachments, search, where_used
+from .models import (
+    Document, DocumentRevision, DocumentRevisionAttachedFile, DocumentRevisionInputPart, DocumentRevisionOutputPart,
+    DocumentRevisionPolicySection, DocumentRevisionProcessStep, sort_key_for_revision,
+)
+
+
+def _copy_rows(model, source_id, revision_id, **changes):
+    """Insert a copy of every row of model under the new revision. Returns {old pk: new pk}."""
+    rows = list(model.objects.filter(document_revision=source_id).order_by('pk').values())
+    old_ids = [row.pop('id') for row in rows]
+    copies = [model(**{**row, **changes, 'document_revision_id': revision_id}) for row in rows]
+    model.objects.bulk_create(copies)
+    return dict(zip(old_ids, (copy.pk for copy in copies)))
+
+
+def _copy_m2m(m2m_field, id_map, source_filter):
+    through = m2m_field.remote_field.through
+    source, target = m2m_field.m2m_field_name(), m2m_field.m2m_reverse_field_name()
+    through.objects.bulk_create([
+        through(**{f'{source}_id': id_map[source_id], f'{target}_id': target_id})
+        for source_id, target_id in through.objects.filter(**source_filter).values_list(source, target)
+    ])
+
+
+@transaction.atomic
+def clone_revision(source, major_revision, document_change, **fields):
+    """
+    Copy a revision with its parts, files, process steps, policy sections and M2M
+    links into a new revision of the same document. Each table is copied with one
+    read and one bulk insert, so the number of queries does not depend on the size
+    of the revision. Extra keyword arguments override fields of the new revision.
+    """
+    if DocumentRevision.objects.filter(document=source.document_id, major_revision=major_revision).exists():
+        raise ValidationError(f'Revision {major_revision} already exists.')
+
+    row = DocumentRevision.objects.filter(pk=source.pk).values().get()
+    del row['id']
+    revision = DocumentRevision(**{
+        **row,
+        **fields,
+        'major_revision': major_revision,
+        'revision_sort_key': sort_key_for_revision(major_revision),
+        'document_change_id': getattr(document_change, 'pk', document_change),
+    })
+    DocumentRevision.objects.bulk_create([revision])
+
+    for field_name in ('previous_revision_action_tags', 'process_roles', 'process_locations'):
+        m2m_field = DocumentRevision._meta.get_field(field_name)
+        _copy_m2m(m2m_field, {source.pk: revision.pk}, {m2m_field.m2m_field_name(): source.pk})
+
+    _copy_rows(DocumentRevisionInputPart, source.pk, revision.pk)
+    _copy_rows(DocumentRevisionOutputPart, source.pk, revision.pk)
+    _copy_rows(DocumentRevisionAttachedFile, source.pk, revision.pk)
+
+    steps = _copy_rows(DocumentRevisionProcessStep, source.pk, revision.pk)
+    for field_name in ('roles', 'locations'):
+        m2m_field = DocumentRevisionProcessStep._meta.get_field(field_name)
+        _copy_m2m(m2m_field, steps, {f'{m2m_field.m2m_field_name()}__document_revision': source.pk})
+
+    # Parents are inserted in the same statement as their children, so the links are
+    # remapped afterwards. path, depth and number carry over unchanged.
+    sections = _copy_rows(DocumentRevisionPolicySection, source.pk, revision.pk, parent_id=None)
+    parents = dict(
+        DocumentRevisionPolicySection.objects.filter(document_revision=source.pk, parent__isnull=False)
+        .values_list('pk', 'parent')
+    )
+    DocumentRevisionPolicySection.objects.bulk_update(
+        [DocumentRevisionPolicySection(pk=sections[pk], parent_id=sections[parent]) for pk, parent in parents.items()],
+        ['parent'],
+    )
+
+    # bulk_create bypasses the signals that keep derived data current.
+    attachments.sync_blob_refs([
+        *DocumentRevisionAttachedFile.objects.filter(document_revision=revision).values_list('sha256', flat=True),
+        *DocumentRevisionProcessStep.objects.filter(document_revision=revision).values_list('image_sha256', flat=True),
+    ])
+    Document.objects.filter(pk=revision.document_id).refresh_effective_revisions()
+    where_used.sync_documents([revision.document_id])
+    assignments.refresh_documents([revision.document_id])
+    search.schedule_index(revision.pk)
+    api.mark_changed()
+    return revision
@@ -0,0 +1,42 @@
+import threading
+
+from django.db import transaction
+
+_state = threading.local()
+
+
+class _Batch:
+    def __init__(self, fn, pending):
+        self.fn = fn
+        self.items = set()
+        self.pending = pending
+
+    def run(self):
+        if self.pending.get(self.fn) is self:
+            del self.pending[self.fn]
+        self.fn(self.items)
+
+
+def _registered(connection, callback):
+    return any(func == callback for _, func, _ in connection.run_on_commit)
+
+
+def schedule_once(fn, items, using=None):
+    """
+    Call fn(items) once when the current transaction commits, with every item scheduled
+    for fn until then collected into one set. Outside a transaction fn runs at once.
+
+    A batch whose transaction or savepoint is rolled back is dropped with its items,
+    like any on_commit callback, and the next call starts a new one.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        fn(set(items))
+        return
+    if not hasattr(_state, 'pending'):
+        _state.pending = {}
+    batch = _state.pending.get(fn)
+    if batch is None or not _registered(connection, batch.run):
+        batch = _state.pending[fn] = _Batch(fn, _state.pending)
+        transaction.on_commit(batch.run, using=using)
+    batch.items.update(items)
@@ -0,0 +1,102 @@
+import re
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import BigIntegerField, Max
+from django.db.models.functions import Cast, Greatest, Substr
+
+from .models import ControlNumberSequence, Document
+
+
+def _highest_assigned(prefix, at_least=0):
+    """
+    The highest number after the prefix among all control numbers, computed by the
+    database. Control numbers are unique across document types, so every type's
+    numbers count. `at_least` skips lower numbers, so when the counter runs into a
+    taken number only the numbers from there on are read.
+    """
+    numbered = Document.objects.filter(
+        control_number__startswith=prefix,
+        control_number__regex=rf'^{re.escape(prefix)}[0-9]+$',
+    ).annotate(value=Cast(Substr('control_number', len(prefix) + 1), BigIntegerField()))
+    return numbered.filter(value__gte=at_least).aggregate(highest=Max('value'))['highest'] or 0
+
+
+def _sequence(document_type_id):
+    try:
+        return ControlNumberSequence.objects.get(pk=document_type_id)
+    except ControlNumberSequence.DoesNotExist:
+        pass
+    # First use: continue after the highest number already assigned by hand or drawn
+    # by another type's counter for the same prefix.
+    sequence = ControlNumberSequence(document_type_id=document_type_id)
+    sequence.next_value = max(
+        _highest_assigned(sequence.prefix) + 1,
+        ControlNumberSequence.objects.filter(prefix=sequence.prefix).aggregate(Max('next_value'))['next_value__max'] or 1,
+    )
+    try:
+        with transaction.atomic():
+            sequence.save(force_insert=True)
+    except IntegrityError:
+        # Created concurrently.
+        sequence = ControlNumberSequence.objects.get(pk=document_type_id)
+    return sequence
+
+
+def _counter(sequence):
+    """
+    The sequence whose counter the type draws from. Types with the same prefix number
+    into the same space, so they all use the counter of the first such sequence.
+    """
+    return ControlNumberSequence.objects.filter(prefix=sequence.prefix).order_by('pk').values_list('pk', flat=True)[0]
+
+
+def _can_update_returning():
+    # SQLite added UPDATE ... RETURNING in the same release as INSERT ... RETURNING.
+    # MariaDB only has the latter, so the INSERT feature flag alone does not tell.
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+
+
+def _reserve(counter, count):
+    """Advance the counter by `count` in one statement and return the first reserved value."""
+    table = connection.ops.quote_name(ControlNumberSequence._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _can_update_returning():
+            cursor.execute(
+                f'UPDATE {table} SET next_value = next_value + %s WHERE document_type_id = %s RETURNING next_value',
+                [count, counter],
+            )
+        else:
+            # The UPDATE's row lock is held until the transaction ends, so the read is ours.
+            cursor.execute(f'UPDATE {table} SET next_value = next_value + %s WHERE document_type_id = %s', [count, counter])
+            cursor.execute(f'SELECT next_value FROM {table} WHERE document_type_id = %s', [counter])
+        return cursor.fetchone()[0] - count
+
+
+def allocate(document_type_id, count=1):
+    """
+    Reserve `count` consecutive control numbers for a document type and return them
+    formatted. Reserving is a single UPDATE on the type's counter row, so parallel
+    callers never receive the same number; the row stays locked only until the
+    surrounding transaction commits, so call this outside long transactions. Numbers
+    that were assigned by hand in the meantime are skipped. Numbers of documents that
+    are never saved are not reused. Control numbers are unique across types, so types
+    with the same prefix draw from one counter.
+    """
+    sequence = _sequence(document_type_id)
+    counter = _counter(sequence)
+    numbers = []
+    while len(numbers) < count:
+        needed = count - len(numbers)
+        first = _reserve(counter, needed)
+        values = {sequence.format(value): value for value in range(first, first + needed)}
+        taken = set(Document.objects.filter(control_number__in=values).values_list('control_number', flat=True))
+        numbers += [number for number in values if number not in taken]
+        if taken:
+            # Numbers were assigned by hand ahead of the counter; jump past all of them at once.
+            lowest = min(values[number] for number in taken)
+            ControlNumberSequence.objects.filter(pk=counter).update(
+                next_value=Greatest('next_value', _highest_assigned(sequence.prefix, at_least=lowest) + 1)
+            )
+    return numbers
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+from .storage import digest_of
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> (maximum width in pixels, JPEG quality).
+RENDITIONS = {
+    'thumbnail': (320, 70),
+    'screen': (1280, 80),
+    'print': (2400, 90),
+}
+DERIVATIVES_DIR = 'derivatives'
+
+derivative_storage = FileSystemStorage()
+
+_executor = None
+_in_flight = set()
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DERIVATIVE_WORKERS', 2), thread_name_prefix='derivatives'
+            )
+        return _executor
+
+
+def source_key(image_name):
+    """The source's sha256 when it is content-addressed, otherwise a hash of its (unique) name."""
+    return digest_of(image_name) or hashlib.sha256(image_name.encode()).hexdigest()
+
+
+def derivative_name(image_name, rendition):
+    width, _ = RENDITIONS[rendition]
+    key = source_key(image_name)
+    return f'{DERIVATIVES_DIR}/{key[:2]}/{key}-{rendition}-{width}.jpg'
+
+
+def existing_url(image, rendition):
+    name = derivative_name(image.name, rendition)
+    return derivative_storage.url(name) if derivative_storage.exists(name) else None
+
+
+def generate(image_storage, image_name, rendition):
+    """Write one rendition unless it already exists. Safe to run concurrently for the same input."""
+    from PIL import Image, ImageOps
+
+    width, quality = RENDITIONS[rendition]
+    name = derivative_name(image_name, rendition)
+    path = derivative_storage.path(name)
+    if os.path.exists(path):
+        return name
+
+    with image_storage.open(image_name, 'rb') as f, Image.open(f) as source:
+        picture = ImageOps.exif_transpose(source)
+        picture.thumbnail((width, width * 4), Image.LANCZOS)
+        if picture.mode not in ('RGB', 'L'):
+            picture = picture.convert('RGB')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.derivative-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                picture.save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return name
+
+
+def delete_renditions(image_name):
+    """Delete every rendition of a source image that is being deleted."""
+    for rendition in RENDITIONS:
+        derivative_storage.delete(derivative_name(image_name, rendition))
+
+
+def _run(image_storage, image_name, rendition):
+    try:
+        generate(image_storage, image_name, rendition)
+    except Exception:
+        logger.exception('Could not generate %s rendition of %s.', rendition, image_name)
+    finally:
+        with _lock:
+            _in_flight.discard((image_name, rendition))
+
+
+def schedule(image, renditions=None):
+    """Queue missing renditions on the worker pool and return immediately."""
+    if not image:
+        return
+    for rendition in RENDITIONS if renditions is None else renditions:
+        if derivative_storage.exists(derivative_name(image.name, rendition)):
+            continue
+        with _lock:
+            if (image.name, rendition) in _in_flight:
+                continue
+            _in_flight.add((image.name, rendition))
+        _get_executor().submit(_run, image.storage, image.name, rendition)
+
+
+def rendition_url(image, rendition):
+    """URL of a rendition if it is ready; otherwise queue it and fall back to the original."""
+    if not image:
+        return ''
+    url = existing_url(image, rendition)
+    if url is None:
+        schedule(image)
+        url = image.url
+    return url
+
+
+def srcset(image):
+    """A srcset of the renditions that are ready, queueing the rest."""
+    if not image:
+        return ''
+    entries, missing = [], []
+    for rendition, (width, _) in RENDITIONS.items():
+        url = existing_url(image, rendition)
+        if url is None:
+            missing.append(rendition)
+        else:
+            entries.append(f'{url} {width}w')
+    schedule(image, missing)
+    return ', '.join(entries)
@@ -0,0 +1,265 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import rendering
+from .models import DocumentRevision
+
+# Diffs are keyed by both revisions' invalidation tokens, so they never go stale;
+# the timeout only bounds how long unused diffs occupy the cache.
+CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+COMPARED_FIELDS = (
+    'title', 'major_revision', 'legacy_revision', 'design_ownership', 'manufacturing_options', 'finished_device',
+    'device_identifier_number', 'change_description', 'previous_revision_disposition', 'process_purpose_and_scope',
+    'process_set_roles_by_step', 'process_set_locations_by_step',
+)
+
+
+@dataclass
+class FieldChange:
+    field: str
+    old: str
+    new: str
+
+
+@dataclass
+class SetChange:
+    name: str
+    added: list[str]
+    removed: list[str]
+
+
+@dataclass
+class PartChange:
+    kind: str  # added, removed, changed
+    part: str
+    old_quantity: int | None = None
+    new_quantity: int | None = None
+    old_position: int | None = None
+    new_position: int | None = None
+
+
+@dataclass
+class ItemChange:
+    """A process step or policy section. kind is unchanged, added, removed, edited or moved."""
+    kind: str
+    old_label: str = ''
+    new_label: str = ''
+    old_text: str = ''
+    new_text: str = ''
+    header: str = ''
+    assignments: list[SetChange] = field(default_factory=list)
+
+
+@dataclass
+class RevisionDiff:
+    old: str
+    new: str
+    fields: list[FieldChange]
+    assignments: list[SetChange]
+    input_parts: list[PartChange]
+    output_parts: list[PartChange]
+    steps: list[ItemChange]
+    sections: list[ItemChange]
+
+    @property
+    def has_changes(self):
+        return bool(
+            self.fields or self.assignments or self.input_parts or self.output_parts
+            or any(step.kind != 'unchanged' for step in self.steps)
+            or any(section.kind != 'unchanged' for section in self.sections)
+        )
+
+
+def _normalize(text):
+    return ' '.join(text.split())
+
+
+def align(old_items, new_items, key):
+    """
+    Align two ordered sequences on key(item). Returns (kind, old, new) triples in
+    sequence order, where kind is equal, replace, added, removed or moved. Items
+    outside the longest common subsequence that still share a key are moved; the
+    rest of each replaced block is paired positionally.
+    """
+    old_keys, new_keys = [key(item) for item in old_items], [key(item) for item in new_items]
+    opcodes = SequenceMatcher(None, old_keys, new_keys, autojunk=False).get_opcodes()
+
+    unmatched = defaultdict(list)
+    for tag, i1, i2, _, _ in opcodes:
+        if tag != 'equal':
+            for i in range(i1, i2):
+                unmatched[old_keys[i]].append(i)
+    moved = {}
+    for tag, _, _, j1, j2 in opcodes:
+        if tag != 'equal':
+            for j in range(j1, j2):
+                if unmatched.get(new_keys[j]):
+                    moved[j] = unmatched[new_keys[j]].pop(0)
+    moved_from = set(moved.values())
+
+    aligned = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            aligned.extend(('equal', old_items[i], new_items[j]) for i, j in zip(range(i1, i2), range(j1, j2)))
+            continue
+        old_block = [i for i in range(i1, i2) if i not in moved_from]
+        new_block = [j for j in range(j1, j2) if j not in moved]
+        paired = min(len(old_block), len(new_block))
+        aligned.extend(('replace', old_items[i], new_items[j]) for i, j in zip(old_block[:paired], new_block[:paired]))
+        aligned.extend(('removed', old_items[i], None) for i in old_block[paired:])
+        aligned.extend(
+            ('moved', old_items[moved[j]], new_items[j]) if j in moved else ('added', None, new_items[j])
+            for j in range(j1, j2) if j in moved or j in new_block[paired:]
+        )
+    return aligned
+
+
+def _set_change(name, old, new):
+    old, new = {str(item) for item in old}, {str(item) for item in new}
+    if old == new:
+        return None
+    return SetChange(name, sorted(new - old), sorted(old - new))
+
+
+def _field_changes(old, new):
+    changes = []
+    for name in COMPARED_FIELDS:
+        model_field = old._meta.get_field(name)
+        old_value, new_value = getattr(old, name), getattr(new, name)
+        if old_value != new_value:
+            if model_field.choices:
+                old_value, new_value = getattr(old, f'get_{name}_display')(), getattr(new, f'get_{name}_display')()
+            changes.append(FieldChange(str(model_field.verbose_name), str(old_value), str(new_value)))
+    return changes
+
+
+def _part_changes(old_links, new_links, part_field):
+    old_by_part = {getattr(link, f'{part_field}_id'): (position, link) for position, link in enumerate(old_links, start=1)}
+    new_by_part = {getattr(link, f'{part_field}_id'): (position, link) for position, link in enumerate(new_links, start=1)}
+    changes = []
+    for part_id, (position, link) in old_by_part.items():
+        if part_id not in new_by_part:
+            changes.append(PartChange('removed', str(getattr(link, part_field)), getattr(link, 'quantity', None), None, position))
+    for part_id, (position, link) in new_by_part.items():
+        quantity = getattr(link, 'quantity', None)
+        if part_id not in old_by_part:
+            changes.append(PartChange('added', str(getattr(link, part_field)), None, quantity, None, position))
+            continue
+        old_position, old_link = old_by_part[part_id]
+        old_quantity = getattr(old_link, 'quantity', None)
+        if old_quantity != quantity or old_position != position:
+            changes.append(PartChange('changed', str(getattr(link, part_field)), old_quantity, quantity, old_position, position))
+    return changes
+
+
+def _step_changes(old, new):
+    changes = []
+    old_positions = {step.pk: position for position, step in enumerate(old.process_steps, start=1)}
+    new_positions = {step.pk: position for position, step in enumerate(new.process_steps, start=1)}
+    for kind, old_step, new_step in align(old.process_steps, new.process_steps, lambda step: _normalize(step.description)):
+        change = ItemChange(
+            kind,
+            old_label=str(old_positions[old_step.pk]) if old_step else '',
+            new_label=str(new_positions[new_step.pk]) if new_step else '',
+            old_text=old_step.description if old_step else '',
+            new_text=new_step.description if new_step else '',
+        )
+        if old_step and new_step:
+            change.assignments = [
+                c for c in (
+                    _set_change('Roles', old_step.roles.all(), new_step.roles.all()),
+                    _set_change('Locations', old_step.locations.all(), new_step.locations.all()),
+                ) if c
+            ]
+            if kind == 'replace' or (kind == 'equal' and change.assignments):
+                change.kind = 'edited'
+            elif kind == 'equal':
+                change.kind = 'unchanged'
+        changes.append(change)
+    return changes
+
+
+def _section_changes(old, new):
+    def parents(revision):
+        headers = {section.pk: section.header for section in revision.policy_sections}
+        return {section.pk: headers.get(section.parent_id) for section in revision.policy_sections}
+
+    old_parents, new_parents = parents(old), parents(new)
+    changes = []
+    for kind, old_section, new_section in align(
+        old.policy_sections, new.policy_sections, lambda section: _normalize(section.header)
+    ):
+        change = ItemChange(
+            kind,
+            old_label=old_section.number if old_section else '',
+            new_label=new_section.number if new_section else '',
+            old_text=old_section.text if old_section else '',
+            new_text=new_section.text if new_section else '',
+            header=(new_section or old_section).header,
+        )
+        if kind in ('equal', 'moved'):
+            # A section that only passed a moved sibling in the outline keeps its parent and number.
+            if old_parents[old_section.pk] != new_parents[new_section.pk] or (
+                kind == 'moved' and old_section.number != new_section.number
+            ):
+                change.kind = 'moved'
+            elif _normalize(old_section.text) != _normalize(new_section.text):
+                change.kind = 'edited'
+            else:
+                change.kind = 'unchanged'
+        elif kind == 'replace':
+            change.kind = 'edited'
+            change.header = f'{old_section.header} → {new_section.header}'
+        changes.append(change)
+    return changes
+
+
+def compute_diff(old, new):
+    """Diff two revisions loaded through rendering.revision_queryset()."""
+    return RevisionDiff(
+        old=str(old),
+        new=str(new),
+        fields=_field_changes(old, new),
+        assignments=[
+            change for change in (
+                _set_change('Process roles', old.process_roles.all(), new.process_roles.all()),
+                _set_change('Process locations', old.process_locations.all(), new.process_locations.all()),
+                _set_change(
+                    'Previous revision actions',
+                    old.previous_revision_action_tags.all(), new.previous_revision_action_tags.all(),
+                ),
+            ) if change
+        ],
+        input_parts=_part_changes(old.input_parts, new.input_parts, 'input_part'),
+        output_parts=_part_changes(old.output_parts, new.output_parts, 'output_part'),
+        steps=_step_changes(old, new),
+        sections=_section_changes(old, new),
+    )
+
+
+def diff_key(old_id, new_id):
+    tokens = rendering.revision_tokens([old_id, new_id])
+    return f'documents:revision-diff:{old_id}:{tokens[old_id]}:{new_id}:{tokens[new_id]}'
+
+
+def diff_revisions(old_id, new_id):
+    """The structured diff between two revisions, loading both in bulk and caching the result."""
+    key = diff_key(old_id, new_id)
+    diff = cache.get(key)
+    if diff is None:
+        revisions = rendering.revision_queryset().in_bulk([old_id, new_id])
+        if old_id not in revisions or new_id not in revisions:
+            raise DocumentRevision.DoesNotExist('No such document revision.')
+        diff = compute_diff(revisions[old_id], revisions[new_id])
+        cache.set(key, diff, CACHE_TIMEOUT)
+    return diff
+
+
+def render_diff(diff):
+    return mark_safe(render_to_string('documents/revision_diff_body.html', {'diff': diff}))
@@ -0,0 +1,110 @@
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from .models import Document, DocumentRevision, DocumentRevisionInputPart, DocumentRevisionOutputPart
+
+DEFAULT_CHUNK_SIZE = 2000
+
+REVISION_FIELDS = (
+    'major_revision', 'legacy_revision', 'title', 'design_ownership', 'manufacturing_options', 'finished_device',
+    'device_identifier_number',
+)
+COLUMNS = (
+    'control_number', 'legacy_control_number', 'document_type', *REVISION_FIELDS,
+    'process_roles', 'process_locations', 'input_parts', 'output_parts',
+)
+LIST_SEPARATOR = '; '
+
+
+def _grouped(queryset, *fields):
+    grouped = defaultdict(list)
+    for key, *values in queryset.values_list(*fields):
+        grouped[key].append(values)
+    return grouped
+
+
+def _chunk_rows(documents):
+    effective = {
+        row['document']: row
+        for row in DocumentRevision.objects.effective().filter(document__in=[d['pk'] for d in documents])
+        .values('pk', 'document', *REVISION_FIELDS)
+    }
+    revision_ids = [row['pk'] for row in effective.values()]
+    roles = _grouped(
+        DocumentRevision.process_roles.through.objects.filter(documentrevision__in=revision_ids).order_by('role__name'),
+        'documentrevision', 'role__name',
+    )
+    locations = _grouped(
+        DocumentRevision.process_locations.through.objects.filter(documentrevision__in=revision_ids)
+        .order_by('location__name'),
+        'documentrevision', 'location__name',
+    )
+    inputs = _grouped(
+        DocumentRevisionInputPart.objects.filter(document_revision__in=revision_ids).order_by('order'),
+        'document_revision', 'input_part__control_number', 'quantity',
+    )
+    outputs = _grouped(
+        DocumentRevisionOutputPart.objects.filter(document_revision__in=revision_ids).order_by('order'),
+        'document_revision', 'output_part__control_number',
+    )
+
+    for document in documents:
+        revision = effective.get(document['pk'], {})
+        pk = revision.get('pk')
+        yield {
+            'control_number': document['control_number'],
+            'legacy_control_number': document['legacy_control_number'],
+            'document_type': document['document_type__code'],
+            **{name: revision.get(name, '') for name in REVISION_FIELDS},
+            'process_roles': [name for name, in roles.get(pk, ())],
+            'process_locations': [name for name, in locations.get(pk, ())],
+            'input_parts': [{'control_number': number, 'quantity': quantity} for number, quantity in inputs.get(pk, ())],
+            'output_parts': [number for number, in outputs.get(pk, ())],
+        }
+
+
+def iter_register(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield one dict per document with its effective revision and parts. Documents are
+    streamed with a server-side iterator and their revisions, M2M rows and part links
+    are fetched per chunk, so memory use does not grow with the size of the register.
+    """
+    documents = Document.objects.order_by('control_number').values(
+        'pk', 'control_number', 'legacy_control_number', 'document_type__code'
+    ).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(documents, chunk_size)):
+        yield from _chunk_rows(chunk)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _flatten(row):
+    return [
+        LIST_SEPARATOR.join(f'{part["control_number"]} x{part["quantity"]}' for part in value) if name == 'input_parts'
+        else LIST_SEPARATOR.join(value) if isinstance(value, list)
+        else value
+        for name, value in row.items()
+    ]
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(_flatten(row))
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson'),
+}
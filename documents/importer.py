@@ -0,0 +1,328 @@
+import csv
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from organization.models import locations, roles
+
+from . import api, assignments, control_numbers, rendering, search, validation, where_used
+from .models import (
+    Document, DocumentChange, DocumentRevision, DocumentRevisionInputPart, DocumentRevisionOutputPart, action_tags,
+    document_types, sort_key_for_revision,
+)
+
+DEFAULT_BATCH_SIZE = 1000
+LIST_SEPARATOR = ';'
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+REVISION_TEXT_FIELDS = (
+    'title', 'legacy_revision', 'design_ownership', 'manufacturing_options', 'finished_device',
+    'change_description', 'previous_revision_disposition', 'process_purpose_and_scope', 'device_identifier_number',
+)
+REVISION_FLAG_FIELDS = ('process_set_roles_by_step', 'process_set_locations_by_step')
+
+
+class RecordError(Exception):
+    def __init__(self, line, message):
+        super().__init__(f'Record {line}: {message}')
+        self.line = line
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    created: int = 0
+    existing: int = 0
+    errors: list = field(default_factory=list)
+
+
+def read_records(path, format=None):
+    """Yield (line, record) pairs from a CSV or JSONL file without loading it into memory."""
+    format = format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == 'csv':
+            for line, record in enumerate(csv.DictReader(f), start=1):
+                yield line, record
+        else:
+            line = 0
+            for raw in f:
+                if raw.strip():
+                    line += 1
+                    yield line, json.loads(raw)
+
+
+def _list(value):
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+    return list(value)
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def _required(line, record, key):
+    value = record.get(key)
+    if value in (None, ''):
+        raise RecordError(line, f'"{key}" is required.')
+    return str(value).strip() if isinstance(value, str) else value
+
+
+def _lookup(line, mapping, key, label):
+    try:
+        return mapping[key]
+    except KeyError:
+        raise RecordError(line, f'Unknown {label} "{key}".') from None
+
+
+def _message(error):
+    if isinstance(error, ValidationError):
+        return ' '.join(error.messages)
+    return f'Conflicts with existing data ({error}).'
+
+
+def _clean(line, obj, exclude):
+    try:
+        obj.clean_fields(exclude=exclude)
+    except ValidationError as e:
+        raise RecordError(line, '; '.join(f'{k}: {" ".join(v)}' for k, v in e.message_dict.items())) from None
+
+
+class Importer:
+    """
+    Bulk-loads one kind of record in batches. Foreign keys are resolved through
+    lookup maps: small reference tables are loaded once, documents and revisions
+    once per batch. Rows that already exist are counted and skipped, so an import
+    can be rerun or resumed safely.
+    """
+
+    kinds = ('documents', 'revisions', 'input_parts', 'output_parts')
+
+    def __init__(self, kind, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, document_change=None):
+        if kind not in self.kinds:
+            raise ValueError(f'Unknown kind "{kind}".')
+        self.kind = kind
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.document_change = document_change
+        self.document_types = document_types.ids_by('code')
+        self.action_tags = action_tags.ids_by('display_name')
+        self.roles = roles.ids_by('name')
+        self.locations = locations.ids_by('name')
+        self.document_changes = set(DocumentChange.objects.values_list('pk', flat=True))
+
+    def run(self, records, skip=0, on_batch=None):
+        stats = ImportStats()
+        records = islice(records, skip, None)
+        stats.read = skip
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return stats
+            stats.read += len(batch)
+            try:
+                with transaction.atomic():
+                    created, existing = getattr(self, f'_import_{self.kind}')(batch)
+                    if self.dry_run:
+                        transaction.set_rollback(True)
+                    elif created:
+                        api.mark_changed()
+            except (RecordError, IntegrityError, ValidationError) as e:
+                error = e if isinstance(e, RecordError) else RecordError(self._failing_line(batch), _message(e))
+                if not self.dry_run:
+                    raise error from e
+                stats.errors.append(error)
+                continue
+            stats.created += created
+            stats.existing += existing
+            if on_batch and not self.dry_run:
+                on_batch(stats)
+
+    def _failing_line(self, batch):
+        """
+        The line of the first record that makes the batch fail. Database constraints
+        only fail the whole batch, so growing prefixes of it are tried and rolled back.
+        """
+        dry_run, self.dry_run = self.dry_run, True
+        low, high = 1, len(batch)
+        try:
+            while low < high:
+                middle = (low + high) // 2
+                try:
+                    with transaction.atomic():
+                        getattr(self, f'_import_{self.kind}')(batch[:middle])
+                        transaction.set_rollback(True)
+                    low = middle + 1
+                except (RecordError, IntegrityError, ValidationError):
+                    high = middle
+        finally:
+            self.dry_run = dry_run
+        return batch[high - 1][0]
+
+    def _documents_by_number(self, control_numbers):
+        return dict(Document.objects.filter(control_number__in=control_numbers).values_list('control_number', 'pk'))
+
+    def _revisions_by_key(self, control_numbers):
+        rows = DocumentRevision.objects.filter(document__control_number__in=control_numbers).values_list(
+            'document__control_number', 'major_revision', 'pk'
+        )
+        return {(number, major): pk for number, major, pk in rows}
+
+    def _import_documents(self, batch):
+        existing = set(self._documents_by_number([r.get('control_number') for _, r in batch]))
+        existing_legacy = set(Document.objects.filter(
+            legacy_control_number__in=[r.get('legacy_control_number') for _, r in batch if r.get('legacy_control_number')]
+        ).values_list('legacy_control_number', flat=True))
+        documents, unnumbered = [], defaultdict(list)
+        for line, record in batch:
+            control_number = str(record.get('control_number') or '').strip()
+            legacy_control_number = str(record.get('legacy_control_number') or '').strip()
+            if control_number in existing or (not control_number and legacy_control_number in existing_legacy):
+                continue
+            if not control_number and not legacy_control_number:
+                raise RecordError(line, '"control_number" or "legacy_control_number" is required.')
+            document = Document(
+                control_number=control_number,
+                legacy_control_number=legacy_control_number,
+                document_type_id=_lookup(line, self.document_types, _required(line, record, 'document_type'), 'document type'),
+            )
+            _clean(line, document, exclude=['document_type'])
+            if control_number:
+                existing.add(control_number)
+            else:
+                # Numbered below, one block per document type.
+                existing_legacy.add(legacy_control_number)
+                unnumbered[document.document_type_id].append(document)
+            documents.append(document)
+        for document_type_id, pending in unnumbered.items():
+            for document, control_number in zip(pending, control_numbers.allocate(document_type_id, len(pending))):
+                document.control_number = control_number
+        Document.objects.bulk_create(documents, batch_size=self.batch_size)
+        return len(documents), len(batch) - len(documents)
+
+    def _import_revisions(self, batch):
+        documents = self._documents_by_number([r.get('control_number') for _, r in batch])
+        existing = set(self._revisions_by_key(documents))
+        revisions, m2m = [], []
+        for line, record in batch:
+            control_number = _required(line, record, 'control_number')
+            document_id = _lookup(line, documents, control_number, 'document')
+            major_revision = str(_required(line, record, 'major_revision'))
+            if (control_number, major_revision) in existing:
+                continue
+            document_change = record.get('document_change') or self.document_change
+            if not str(document_change or '').isdigit() or int(document_change) not in self.document_changes:
+                raise RecordError(line, f'Unknown document change "{document_change}".')
+            revision = DocumentRevision(
+                document_id=document_id,
+                document_change_id=int(document_change),
+                major_revision=major_revision,
+                revision_sort_key=sort_key_for_revision(major_revision),
+                **{name: record[name] for name in REVISION_TEXT_FIELDS if record.get(name) not in (None, '')},
+                **{name: _flag(record.get(name)) for name in REVISION_FLAG_FIELDS},
+            )
+            revision.device_identifier = revision.indexed_device_identifier()
+            _clean(line, revision, exclude=['document', 'document_change'])
+            existing.add((control_number, major_revision))
+            revisions.append(revision)
+            m2m.append((
+                [_lookup(line, self.action_tags, name, 'action tag') for name in _list(record.get('previous_revision_action_tags'))],
+                [_lookup(line, self.roles, name, 'role') for name in _list(record.get('process_roles'))],
+                [_lookup(line, self.locations, name, 'location') for name in _list(record.get('process_locations'))],
+            ))
+        DocumentRevision.objects.bulk_create(revisions, batch_size=self.batch_size)
+
+        if revisions and revisions[0].pk is None:
+            # Backends that cannot return primary keys from a bulk insert.
+            keys = self._revisions_by_key([r.get('control_number') for _, r in batch])
+            numbers = {pk: number for number, pk in documents.items()}
+            for revision in revisions:
+                revision.pk = keys[(numbers[revision.document_id], revision.major_revision)]
+
+        for field_name, position in (('previous_revision_action_tags', 0), ('process_roles', 1), ('process_locations', 2)):
+            m2m_field = DocumentRevision._meta.get_field(field_name)
+            through = m2m_field.remote_field.through
+            source, target = f'{m2m_field.m2m_field_name()}_id', f'{m2m_field.m2m_reverse_field_name()}_id'
+            through.objects.bulk_create(
+                [
+                    through(**{source: revision.pk, target: target_id})
+                    for revision, links in zip(revisions, m2m) for target_id in dict.fromkeys(links[position])
+                ],
+                batch_size=self.batch_size,
+            )
+
+        Document.objects.filter(pk__in={revision.document_id for revision in revisions}).refresh_effective_revisions()
+        if not self.dry_run:
+            where_used.sync_documents({revision.document_id for revision in revisions})
+            assignments.refresh_documents({revision.document_id for revision in revisions})
+            search.index_revisions([revision.pk for revision in revisions])
+        return len(revisions), len(batch) - len(revisions)
+
+    def _import_parts(self, batch, model, part_field):
+        numbers = set()
+        for _, record in batch:
+            numbers.update((record.get('control_number'), record.get(part_field)))
+        documents = self._documents_by_number(numbers)
+        revisions = self._revisions_by_key(numbers)
+        existing = set(model.objects.filter(document_revision__in=revisions.values()).values_list(
+            'document_revision', part_field
+        ))
+        links, lines = [], {}
+        for line, record in batch:
+            key = (_required(line, record, 'control_number'), str(_required(line, record, 'major_revision')))
+            revision_id = _lookup(line, revisions, key, 'revision')
+            part_id = _lookup(line, documents, _required(line, record, part_field), 'part document')
+            if (revision_id, part_id) in existing:
+                continue
+            link = model(document_revision_id=revision_id, order=_required(line, record, 'order'), **{f'{part_field}_id': part_id})
+            if 'quantity' in record and record['quantity'] not in (None, ''):
+                link.quantity = record['quantity']
+            _clean(line, link, exclude=['document_revision', part_field])
+            existing.add((revision_id, part_id))
+            links.append(link)
+            lines.setdefault((documents[key[0]], part_id), line)
+        # Loops through the links of any revision, and within the batch, are caught up front.
+        cycles = validation.part_cycles(lines)
+        if cycles:
+            raise RecordError(min(lines[pair] for pair in cycles), 'The part already uses this document, directly or through its parts.')
+        model.objects.bulk_create(links, batch_size=self.batch_size)
+
+        if not self.dry_run:
+            revision_ids = {link.document_revision_id for link in links}
+            rendering.invalidate(revision_ids)
+            where_used.sync_documents(
+                DocumentRevision.objects.filter(pk__in=revision_ids).values_list('document', flat=True).distinct()
+            )
+        return len(links), len(batch) - len(links)
+
+    def _import_input_parts(self, batch):
+        return self._import_parts(batch, DocumentRevisionInputPart, 'input_part')
+
+    def _import_output_parts(self, batch):
+        return self._import_parts(batch, DocumentRevisionOutputPart, 'output_part')
+
+
+def load_checkpoint(path, source, kind):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('source') != os.path.abspath(source) or checkpoint.get('kind') != kind:
+        return 0
+    return checkpoint['records']
+
+
+def save_checkpoint(path, source, kind, records):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.abspath(source), 'kind': kind, 'records': records}, f)
+    os.replace(tmp, path)
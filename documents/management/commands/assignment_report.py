@@ -0,0 +1,54 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents import assignments
+from organization.models import Location, Role, locations, roles
+
+
+class Command(BaseCommand):
+    help = (
+        'Report the work assignments of the effective process documents as CSV: the steps of a role and/or '
+        'location, or without either, the number of steps and documents per role and location.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--role', help='Role name.')
+        parser.add_argument('--location', help='Location name.')
+        parser.add_argument('--output', help='File to write; defaults to standard output.')
+
+    def handle(self, *args, **options):
+        try:
+            role = roles.get(name=options['role']) if options['role'] else None
+            location = locations.get(name=options['location']) if options['location'] else None
+        except (Role.DoesNotExist, Location.DoesNotExist) as e:
+            raise CommandError(e)
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            writer = csv.writer(out)
+            if role is None and location is None:
+                writer.writerow(['role', 'location', 'steps', 'documents'])
+                for role_id, location_id, steps, documents in assignments.matrix():
+                    writer.writerow([_name(roles, role_id), _name(locations, location_id), steps, documents])
+            else:
+                writer.writerow(['control_number', 'major_revision', 'step', 'role', 'location', 'description'])
+                rows = assignments.assignments(role, location).order_by(
+                    'document__control_number', 'step__order', 'role', 'location',
+                ).values_list(
+                    'document__control_number', 'step__document_revision__major_revision', 'step__order', 'role',
+                    'location', 'step__description',
+                )
+                for control_number, major_revision, order, role_id, location_id, description in rows.iterator():
+                    writer.writerow([
+                        control_number, major_revision, order, _name(roles, role_id), _name(locations, location_id),
+                        description,
+                    ])
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+def _name(cache, pk):
+    return cache.get(pk).name if pk is not None else ''
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documents import validation
+
+
+class Command(BaseCommand):
+    help = (
+        'Scan effective BOMs and policy section trees for cycles, the where-used and part reach indexes for missing or stale links, '
+        'and current revisions for shared device identifiers.'
+    )
+
+    def handle(self, *args, **options):
+        problems = validation.audit()
+        for problem in problems:
+            self.stdout.write(str(problem))
+        if problems:
+            raise CommandError(f'{len(problems)} structural problems found.')
+        self.stdout.write('No structural problems found.')
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Time key document operations against the current database and print the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*', metavar='name', help=f'Benchmarks to run (default all): {", ".join(benchmarks.BENCHMARKS)}.'
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--samples', type=int, default=20, help='Documents, revisions and queries sampled per run.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(benchmarks.BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}.')
+        report = benchmarks.run(options['names'], repeat=options['repeat'], samples=options['samples'], seed=options['seed'])
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
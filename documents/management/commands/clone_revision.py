@@ -0,0 +1,30 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.clone import clone_revision
+from documents.models import Document, DocumentChange, DocumentRevision
+
+
+class Command(BaseCommand):
+    help = 'Start a new revision of a document as a copy of an existing one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('control_number')
+        parser.add_argument('major_revision', help='Major revision of the new revision.')
+        parser.add_argument('--document-change', type=int, required=True, help='Primary key of the document change.')
+        parser.add_argument('--from', dest='source', help='Major revision to copy instead of the effective one.')
+
+    def handle(self, *args, **options):
+        try:
+            document = Document.objects.get(control_number=options['control_number'])
+            if options['source']:
+                source = DocumentRevision.objects.get(document=document, major_revision=options['source'])
+            else:
+                source = DocumentRevision.objects.effective().get(document=document)
+            document_change = DocumentChange.objects.get(pk=options['document_change'])
+            revision = clone_revision(source, options['major_revision'], document_change)
+        except (Document.DoesNotExist, DocumentRevision.DoesNotExist, DocumentChange.DoesNotExist) as e:
+            raise CommandError(e)
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        self.stdout.write(f'Created {revision} from {source}.')
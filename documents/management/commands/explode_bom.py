@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.bom import DEFAULT_MAX_DEPTH, BOMError, explode
+from documents.models import Document, DocumentRevision
+
+
+class Command(BaseCommand):
+    help = 'Print the multi-level bill of materials for a document.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('control_number')
+        parser.add_argument('--revision', help='Major revision to explode instead of the effective one.')
+        parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH)
+        parser.add_argument('--totals', action='store_true', help='Print rolled-up leaf part quantities instead of the tree.')
+
+    def handle(self, *args, **options):
+        try:
+            document = Document.objects.select_related('document_type').get(control_number=options['control_number'])
+            if options['revision']:
+                target = DocumentRevision.objects.get(document=document, major_revision=options['revision'])
+                target.document = document
+            else:
+                target = document
+            bom = explode(target, max_depth=options['max_depth'])
+        except (Document.DoesNotExist, DocumentRevision.DoesNotExist, BOMError) as e:
+            raise CommandError(e)
+
+        self.stdout.write(str(bom.revision))
+        if options['totals']:
+            for part, quantity in sorted(bom.totals().items(), key=lambda item: item[0].control_number):
+                self.stdout.write(f'{quantity:>8}  {part}')
+            return
+
+        for line in bom.walk():
+            revision = f'Rev. {line.revision.major_revision}' if line.revision else 'no revision'
+            self.stdout.write(f'{"  " * line.depth}{line.quantity} x {line.document} ({revision}) = {line.total_quantity}')
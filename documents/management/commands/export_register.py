@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from documents import export
+
+
+class Command(BaseCommand):
+    help = 'Stream the document register, one row per document with its effective revision, as CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write; defaults to standard output.')
+        parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        writer, _ = export.FORMATS[options['format']]
+        rows = export.iter_register(chunk_size=options['chunk_size'])
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for chunk in writer(rows):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from documents import attachments
+
+
+class Command(BaseCommand):
+    help = 'Recount attachment blob references and delete blobs nothing refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600, help='Seconds since a blob was last stored or reused.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        deleted = attachments.collect_garbage(min_age=options['min_age'], dry_run=options['dry_run'])
+        for name in deleted:
+            self.stdout.write(name)
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(f'{len(deleted)} blobs {verb}.')
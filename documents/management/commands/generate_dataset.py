@@ -0,0 +1,22 @@
+import dataclasses
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.models import Document
+from documents.synthetic import DatasetSpec, Generator
+
+
+class Command(BaseCommand):
+    help = 'Fill an empty database with a synthetic dataset of documents, revisions, BOMs, steps and policy trees.'
+
+    def add_arguments(self, parser):
+        for spec_field in dataclasses.fields(DatasetSpec):
+            parser.add_argument(f'--{spec_field.name.replace("_", "-")}', type=int, default=spec_field.default)
+        parser.add_argument('--skip-index', action='store_true', help='Do not rebuild where-used and the search index.')
+
+    def handle(self, *args, **options):
+        if Document.objects.exists():
+            raise CommandError('The database already contains documents.')
+        spec = DatasetSpec(**{spec_field.name: options[spec_field.name] for spec_field in dataclasses.fields(DatasetSpec)})
+        Generator(spec, log=self.stdout.write).run(index=not options['skip_index'])
+        self.stdout.write(f'Generated {spec.documents} documents with {spec.revisions} revisions each.')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from documents import derivatives
+from documents.models import DocumentRevisionProcessStep
+
+
+class Command(BaseCommand):
+    help = 'Generate missing process step image renditions. Existing renditions are left untouched.'
+
+    def handle(self, *args, **options):
+        names = (
+            DocumentRevisionProcessStep.objects.exclude(image='').order_by().values_list('image', flat=True).distinct()
+        )
+        storage = DocumentRevisionProcessStep._meta.get_field('image').storage
+        count = 0
+        for name in names.iterator():
+            for rendition in derivatives.RENDITIONS:
+                try:
+                    derivatives.generate(storage, name, rendition)
+                except Exception as e:
+                    self.stderr.write(f'{name} ({rendition}): {e}')
+            count += 1
+        self.stdout.write(f'Processed {count} images.')
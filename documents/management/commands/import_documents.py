@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.importer import DEFAULT_BATCH_SIZE, Importer, RecordError, load_checkpoint, read_records, save_checkpoint
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import documents, revisions or part links from a CSV or JSONL file. Import documents first, '
+        'then revisions, then input_parts/output_parts. List columns in CSV are separated by ";".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=Importer.kinds)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--document-change', type=int, help='DocumentChange id for revisions that do not name one.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate every batch, then roll it back.')
+        parser.add_argument('--checkpoint', help='File recording progress, so an interrupted import resumes where it stopped.')
+
+    def handle(self, *args, **options):
+        kind, path, checkpoint = options['kind'], options['path'], options['checkpoint']
+        importer = Importer(
+            kind,
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            document_change=options['document_change'],
+        )
+        skip = 0 if options['dry_run'] else load_checkpoint(checkpoint, path, kind)
+        if skip:
+            self.stdout.write(f'Resuming after record {skip}.')
+
+        def on_batch(stats):
+            if checkpoint:
+                save_checkpoint(checkpoint, path, kind, stats.read)
+            self.stdout.write(f'{stats.read} records read, {stats.created} created.')
+
+        try:
+            stats = importer.run(read_records(path, options['format']), skip=skip, on_batch=on_batch)
+        except RecordError as e:
+            raise CommandError(f'{e} Nothing after the last reported batch was imported.')
+
+        for error in stats.errors:
+            self.stderr.write(str(error))
+        verb = 'would be created' if options['dry_run'] else 'created'
+        self.stdout.write(f'{stats.read} records read, {stats.created} {verb}, {stats.existing} already present.')
+        if stats.errors:
+            raise CommandError(f'{len(stats.errors)} batches failed validation.')
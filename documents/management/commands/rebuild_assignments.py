@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from documents import assignments
+from documents.models import ProcessStepAssignment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the role and location work assignments from the effective process documents.'
+
+    def handle(self, *args, **options):
+        assignments.rebuild()
+        self.stdout.write(f'Indexed {ProcessStepAssignment.objects.count()} assignments.')
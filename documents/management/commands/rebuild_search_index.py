@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from documents import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over all document revisions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=search.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        count = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f'Indexed {count} revisions.')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from documents import where_used
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the where-used index from the effective revisions, and the part reach index used by '
+        'cycle checks from every revision.'
+    )
+
+    def handle(self, *args, **options):
+        where_used.rebuild()
+        for graph in where_used.GRAPHS:
+            self.stdout.write(
+                f'{graph.label.capitalize()}: {graph.link_model.objects.count()} links and '
+                f'{graph.closure_model.objects.count()} closure rows.'
+            )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from documents import rendering
+from documents.models import DocumentRevision
+
+
+class Command(BaseCommand):
+    help = 'Render document revisions into the cache ahead of the first view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Warm every revision, not only the effective ones.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--force', action='store_true', help='Re-render revisions that are already cached.')
+
+    def handle(self, *args, **options):
+        revisions = DocumentRevision.objects.all() if options['all'] else DocumentRevision.objects.effective()
+        revision_ids = revisions.order_by('pk').values_list('pk', flat=True)
+        rendered = rendering.warm(revision_ids, batch_size=options['batch_size'], force=options['force'])
+        self.stdout.write(f'Rendered {rendered} revisions.')
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_alter_document_legacy_control_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentRevisionPolicySection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveIntegerField()),
+                ('header', models.CharField(max_length=255)),
+                ('text', models.TextField()),
+                ('document_revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevision')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevisionpolicysection')),
+            ],
+        ),
+    ]
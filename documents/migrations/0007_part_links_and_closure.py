@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_documentrevisionpolicysection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPartClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path_count', models.PositiveIntegerField(default=1)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='documents_closure_where_used')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentPartLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='used_in_links', to='documents.document')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='part_links', to='documents.document')),
+            ],
+            options={
+                'unique_together': {('parent', 'child')},
+            },
+        ),
+    ]
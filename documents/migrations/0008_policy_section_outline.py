@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_part_links_and_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentrevisionpolicysection',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='documentrevisionpolicysection',
+            name='number',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='documentrevisionpolicysection',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=1024),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevisionpolicysection',
+            index=models.Index(fields=['document_revision', 'path'], name='documents_policy_outline'),
+        ),
+    ]
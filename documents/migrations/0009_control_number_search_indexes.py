@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:56
+
+from django.db import migrations
+
+# Case-insensitive prefix indexes for the admin's ^control_number searches. The
+# expression each backend can use for ILIKE/UPPER-LIKE prefix scans differs, so
+# they are created per vendor rather than through Meta.indexes.
+INDEXED_COLUMNS = ('control_number', 'legacy_control_number')
+
+
+def index_sql(vendor, column):
+    name = f'documents_document_{column}_prefix'
+    if vendor == 'sqlite':
+        return f'CREATE INDEX IF NOT EXISTS {name} ON documents_document ({column} COLLATE NOCASE)'
+    if vendor == 'postgresql':
+        return f'CREATE INDEX IF NOT EXISTS {name} ON documents_document (UPPER({column}) varchar_pattern_ops)'
+    return None
+
+
+def create_indexes(apps, schema_editor):
+    for column in INDEXED_COLUMNS:
+        sql = index_sql(schema_editor.connection.vendor, column)
+        if sql:
+            schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    for column in INDEXED_COLUMNS:
+        if index_sql(schema_editor.connection.vendor, column):
+            schema_editor.execute(f'DROP INDEX IF EXISTS documents_document_{column}_prefix')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_policy_section_outline'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
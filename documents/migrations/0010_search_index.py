@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:20
+
+from django.db import migrations
+
+# The DDL as of this migration; documents.search may change later.
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS documents_search USING fts5("
+        "control_number, legacy_control_number, title, body, tokenize='unicode61', prefix='2 3 4')",
+    ],
+    'postgresql': [
+        'CREATE TABLE IF NOT EXISTS documents_search ('
+        'revision_id bigint PRIMARY KEY REFERENCES documents_documentrevision (id) ON DELETE CASCADE '
+        'DEFERRABLE INITIALLY DEFERRED, vector tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS documents_search_vector ON documents_search USING GIN (vector)',
+    ],
+}
+
+
+def create_search_table(apps, schema_editor):
+    for sql in CREATE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute('DROP TABLE IF EXISTS documents_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_control_number_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:00
+
+import documents.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='documentrevisionattachedfile',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='documentrevisionattachedfile',
+            name='file',
+            field=models.FileField(storage=documents.storage.attachment_storage, upload_to='document_revision_attached_files/'),
+        ),
+    ]
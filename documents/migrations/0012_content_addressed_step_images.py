@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:01
+
+import documents.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_content_addressed_attachments'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentrevisionprocessstep',
+            name='image',
+            field=models.ImageField(blank=True, storage=documents.storage.attachment_storage, upload_to='document_revision_process_step_images/'),
+        ),
+    ]
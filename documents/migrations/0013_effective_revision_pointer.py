@@ -0,0 +1,47 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from documents.models import sort_key_for_revision
+
+BATCH_SIZE = 1000
+
+
+def populate(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentRevision = apps.get_model('documents', 'DocumentRevision')
+    revisions = [
+        DocumentRevision(pk=pk, revision_sort_key=sort_key_for_revision(major_revision))
+        for pk, major_revision in DocumentRevision.objects.values_list('pk', 'major_revision')
+    ]
+    DocumentRevision.objects.bulk_update(revisions, ['revision_sort_key'], batch_size=BATCH_SIZE)
+
+    latest = DocumentRevision.objects.filter(document=models.OuterRef('pk')).order_by('-revision_sort_key', '-pk')
+    Document.objects.update(effective_revision=models.Subquery(latest.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_content_addressed_step_images'),
+        ('organization', '0003_location_registered_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='effective_revision',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='documents.documentrevision'),
+        ),
+        migrations.AddField(
+            model_name='documentrevision',
+            name='revision_sort_key',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevision',
+            index=models.Index(fields=['document', 'revision_sort_key'], name='documents_revision_sort'),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_effective_revision_pointer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControlNumberSequence',
+            fields=[
+                ('document_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='documents.documenttype')),
+                ('prefix', models.CharField(blank=True, max_length=50)),
+                ('padding', models.PositiveSmallIntegerField(default=6)),
+                ('next_value', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='control_number',
+            field=models.CharField(blank=True, max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_control_number_sequences'),
+        ('organization', '0003_location_registered_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='document_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.documenttype'),
+        ),
+        migrations.AlterField(
+            model_name='documentchange',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='documentrevision',
+            name='document',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.document'),
+        ),
+        migrations.AlterField(
+            model_name='documentrevisionattachedfile',
+            name='document_revision',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevision'),
+        ),
+        migrations.AlterField(
+            model_name='documentrevisioninputpart',
+            name='document_revision',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevision'),
+        ),
+        migrations.AlterField(
+            model_name='documentrevisionoutputpart',
+            name='document_revision',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevision'),
+        ),
+        migrations.AlterField(
+            model_name='documentrevisionpolicysection',
+            name='document_revision',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevision'),
+        ),
+        migrations.AlterField(
+            model_name='documentrevisionprocessstep',
+            name='document_revision',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='documents.documentrevision'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['document_type', 'control_number'], name='documents_type_number'),
+        ),
+        migrations.AddIndex(
+            model_name='documentchange',
+            index=models.Index(fields=['owner', 'id'], name='documents_change_owner'),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevisionattachedfile',
+            index=models.Index(fields=['document_revision', 'order'], name='documents_attachment_order'),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevisioninputpart',
+            index=models.Index(fields=['document_revision', 'order', 'input_part', 'quantity'], name='documents_input_part_order'),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevisionoutputpart',
+            index=models.Index(fields=['document_revision', 'order', 'output_part'], name='documents_output_part_order'),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevisionpolicysection',
+            index=models.Index(fields=['document_revision', 'parent', 'order'], name='documents_policy_siblings'),
+        ),
+        migrations.AddIndex(
+            model_name='documentrevisionprocessstep',
+            index=models.Index(fields=['document_revision', 'order'], name='documents_step_order'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:23
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+from documents.models import normalize_device_identifier
+
+BATCH_SIZE = 1000
+
+
+def populate(apps, schema_editor):
+    Document = apps.get_model('documents', 'Document')
+    DocumentRevision = apps.get_model('documents', 'DocumentRevision')
+    revisions = [
+        DocumentRevision(pk=pk, device_identifier=normalize_device_identifier(number))
+        for pk, number in DocumentRevision.objects.filter(finished_device='SHIPPABLE')
+        .exclude(device_identifier_number='').values_list('pk', 'device_identifier_number')
+    ]
+    DocumentRevision.objects.bulk_update(revisions, ['device_identifier'], batch_size=BATCH_SIZE)
+
+    # The constraint added below would fail on identifiers that the current revisions of
+    # several documents share. Stop with the list rather than pick a document to keep them.
+    holders = defaultdict(list)
+    for pk, control_number, device_identifier in Document.objects.filter(
+        effective_revision__device_identifier__gt='',
+    ).order_by('control_number').values_list('pk', 'control_number', 'effective_revision__device_identifier'):
+        holders[device_identifier].append((pk, control_number))
+    conflicts = {device_identifier: documents for device_identifier, documents in holders.items() if len(documents) > 1}
+    if conflicts:
+        raise RuntimeError(
+            'The current revisions of several documents share a device identifier. Give each a distinct '
+            'device identifier number and migrate again:\n' + '\n'.join(
+                f'{device_identifier} is used by ' + ', '.join(number for _, number in documents)
+                for device_identifier, documents in sorted(conflicts.items())
+            )
+        )
+    Document.objects.bulk_update(
+        [Document(pk=documents[0][0], device_identifier=device_identifier) for device_identifier, documents in holders.items()],
+        ['device_identifier'], batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_index_pack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='device_identifier',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='documentrevision',
+            name='device_identifier',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='document',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_identifier', ''), _negated=True), fields=('device_identifier',), name='documents_unique_device_identifier'),
+        ),
+    ]
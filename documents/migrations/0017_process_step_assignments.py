@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0016_device_identifiers'),
+        ('organization', '0003_location_registered_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessStepAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+                ('location', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='organization.location')),
+                ('role', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='organization.role')),
+                ('step', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.documentrevisionprocessstep')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['role', 'location', 'step'], name='documents_assignment_role'), models.Index(fields=['location', 'role', 'step'], name='documents_assignment_location')],
+            },
+        ),
+    ]
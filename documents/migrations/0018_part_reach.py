@@ -0,0 +1,93 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:02
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def populate(apps, schema_editor):
+    """Index the part links of every revision, leaving out links that close a loop."""
+    DocumentPartUse = apps.get_model('documents', 'DocumentPartUse')
+    DocumentPartReach = apps.get_model('documents', 'DocumentPartReach')
+    children = defaultdict(set)
+    for model, field in (('DocumentRevisionInputPart', 'input_part'), ('DocumentRevisionOutputPart', 'output_part')):
+        for parent, child in apps.get_model('documents', model).objects.values_list('document_revision__document', field):
+            if parent != child:
+                children[parent].add(child)
+
+    # Path counts below each document in post-order; an edge back to a document still
+    # being expanded closes a loop and is skipped, as documents.where_used does.
+    reach, visiting, cyclic = {}, set(), set()
+    for root in list(children):
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node in reach or (node in visiting and not expanded):
+                continue
+            if not expanded:
+                visiting.add(node)
+                stack.append((node, True))
+                stack.extend((child, False) for child in children.get(node, ()) if child not in reach)
+                continue
+            counts = defaultdict(int)
+            for child in children.get(node, ()):
+                if child not in reach:
+                    cyclic.add((node, child))
+                    continue
+                counts[child] += 1
+                for descendant, paths in reach[child].items():
+                    counts[descendant] += paths
+            reach[node] = counts
+            visiting.discard(node)
+
+    DocumentPartUse.objects.bulk_create(
+        (
+            DocumentPartUse(parent_id=parent, child_id=child)
+            for parent, kids in children.items() for child in kids if (parent, child) not in cyclic
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    DocumentPartReach.objects.bulk_create(
+        (
+            DocumentPartReach(ancestor_id=ancestor, descendant_id=descendant, path_count=paths)
+            for ancestor, counts in reach.items() for descendant, paths in counts.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0017_process_step_assignments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPartReach',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path_count', models.PositiveIntegerField(default=1)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+            ],
+            options={
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentPartUse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.document')),
+            ],
+            options={
+                'unique_together': {('parent', 'child')},
+            },
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
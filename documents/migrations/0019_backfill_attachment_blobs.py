@@ -0,0 +1,71 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:10
+
+import os
+import re
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+BATCH_SIZE = 1000
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def digest_of(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if DIGEST_PATTERN.match(stem) else ''
+
+
+def backfill(apps, schema_editor):
+    """
+    Move attachments uploaded before 0011 to their content-addressed names and give
+    every stored digest a FileBlob with its reference count. Rows whose file is
+    missing are left as they are.
+    """
+    DocumentRevisionAttachedFile = apps.get_model('documents', 'DocumentRevisionAttachedFile')
+    FileBlob = apps.get_model('documents', 'FileBlob')
+    field = DocumentRevisionAttachedFile._meta.get_field('file')
+    storage = field.storage
+
+    stored, batch = {}, []
+    for attachment in DocumentRevisionAttachedFile.objects.filter(sha256='').exclude(file='').order_by('pk').iterator():
+        name = attachment.file.name
+        if name not in stored:
+            stored[name] = name
+            if not digest_of(name) and storage.exists(name):
+                with storage.open(name, 'rb') as f:
+                    stored[name] = storage.save(f'{field.upload_to}{os.path.basename(name)}', f)
+        attachment.file.name = stored[name]
+        attachment.sha256 = digest_of(stored[name])
+        batch.append(attachment)
+        if len(batch) >= BATCH_SIZE:
+            DocumentRevisionAttachedFile.objects.bulk_update(batch, ['file', 'sha256'])
+            batch = []
+    DocumentRevisionAttachedFile.objects.bulk_update(batch, ['file', 'sha256'])
+
+    references = (
+        DocumentRevisionAttachedFile.objects.exclude(sha256='').order_by()
+        .values('sha256').annotate(name=Min('file'), count=Count('pk')).values_list('sha256', 'name', 'count')
+    )
+    blobs = [
+        FileBlob(sha256=digest, name=name, size=storage.size(name), ref_count=count)
+        for digest, name, count in references.iterator() if storage.exists(name)
+    ]
+    FileBlob.objects.bulk_create(
+        blobs, batch_size=BATCH_SIZE, update_conflicts=True, unique_fields=['sha256'], update_fields=['ref_count'],
+    )
+
+    # The storage never deletes, since blobs are shared; the old names are not.
+    for old, new in stored.items():
+        if old != new:
+            os.remove(storage.path(old))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0018_part_reach'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:13
+
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# documents.derivatives keys renditions of images without a digest by a hash of their name.
+RENDITIONS = {'thumbnail': 320, 'screen': 1280, 'print': 2400}
+
+
+def digest_of(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if DIGEST_PATTERN.match(stem) else ''
+
+
+def backfill(apps, schema_editor):
+    """
+    Move step images uploaded before 0012 to their content-addressed names, record
+    every step image's digest and count step images as FileBlob references.
+    """
+    DocumentRevisionProcessStep = apps.get_model('documents', 'DocumentRevisionProcessStep')
+    DocumentRevisionAttachedFile = apps.get_model('documents', 'DocumentRevisionAttachedFile')
+    FileBlob = apps.get_model('documents', 'FileBlob')
+    field = DocumentRevisionProcessStep._meta.get_field('image')
+    storage = field.storage
+
+    stored, batch = {}, []
+    for step in DocumentRevisionProcessStep.objects.exclude(image='').order_by('pk').iterator():
+        name = step.image.name
+        if name not in stored:
+            stored[name] = name
+            if not digest_of(name) and storage.exists(name):
+                with storage.open(name, 'rb') as f:
+                    stored[name] = storage.save(f'{field.upload_to}{os.path.basename(name)}', f)
+        step.image.name = stored[name]
+        step.image_sha256 = digest_of(stored[name])
+        batch.append(step)
+        if len(batch) >= BATCH_SIZE:
+            DocumentRevisionProcessStep.objects.bulk_update(batch, ['image', 'image_sha256'])
+            batch = []
+    DocumentRevisionProcessStep.objects.bulk_update(batch, ['image', 'image_sha256'])
+
+    names = (
+        DocumentRevisionProcessStep.objects.exclude(image_sha256='').order_by()
+        .values('image_sha256').annotate(name=Min('image')).values_list('image_sha256', 'name')
+    )
+    FileBlob.objects.bulk_create(
+        [FileBlob(sha256=digest, name=name, size=storage.size(name)) for digest, name in names.iterator() if storage.exists(name)],
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+
+    def references(model, digest_field):
+        count = (
+            model.objects.filter(**{digest_field: OuterRef('sha256')})
+            .order_by().values(digest_field).annotate(count=Count('pk')).values('count')
+        )
+        return Coalesce(Subquery(count), Value(0))
+
+    FileBlob.objects.update(ref_count=(
+        references(DocumentRevisionAttachedFile, 'sha256') + references(DocumentRevisionProcessStep, 'image_sha256')
+    ))
+
+    # The storage never deletes, since blobs are shared; the old names and their renditions are not.
+    derivative_storage = FileSystemStorage()
+    for old, new in stored.items():
+        if old != new:
+            os.remove(storage.path(old))
+            key = hashlib.sha256(old.encode()).hexdigest()
+            for rendition, width in RENDITIONS.items():
+                derivative_storage.delete(f'derivatives/{key[:2]}/{key}-{rendition}-{width}.jpg')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0019_backfill_attachment_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentrevisionprocessstep',
+            name='image_sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
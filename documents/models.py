@@ -1,7 +1,13 @@
+import re
+
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
 from .choices import DESIGN_OWNERSHIP_CHOICES, MANUFACTURING_OPTIONS_CHOICES, FINISHED_DEVICE_CHOICES
 from organization.models import Role, Location
+from organization.reference_cache import ReferenceCache
+from .storage import attachment_storage
 
 class DocumentType(models.Model):
     display_name = models.CharField(max_length=255)
@@ -20,29 +26,146 @@ class DocumentRevisionPreviousRevisionActionTag(models.Model):
 
 class DocumentChange(models.Model):
     title = models.CharField(max_length=255)
-    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     reason_for_change = models.TextField()
     description_of_change = models.TextField()
 
     def __str__(self):
         return f'DC-{self.pk} - {self.title}'
 
+    class Meta:
+        indexes = [
+            # A user's changes, newest first.
+            models.Index(fields=['owner', 'id'], name='documents_change_owner'),
+        ]
+
+REVISION_TOKEN = re.compile(r'\d+|[^\W\d_]+')
+
+def sort_key_for_revision(revision):
+    """
+    A string that sorts revisions naturally: '9' < '10' and 'Z' < 'AA'. Each run of
+    digits or letters is prefixed with its kind and length, so numbers compare by
+    magnitude and letter runs compare by length first; separators are ignored.
+    """
+    parts = []
+    for token in REVISION_TOKEN.findall(revision):
+        if token.isdigit():
+            token = token.lstrip('0')
+            parts.append(f'0{len(token):02d}{token}')
+        else:
+            parts.append(f'1{len(token):02d}{token.upper()}')
+    return ''.join(parts)[:255]
+
+GS1_BRACKETED = re.compile(r'\(01\)(\d{14})')
+GS1_ELEMENT_STRING = re.compile(r'01(\d{14})(?:\d{2}.*)?')
+SYMBOLOGY_IDENTIFIER = re.compile(r'^\][A-Z]\d')
+
+def normalize_device_identifier(value):
+    """
+    The form device identifiers are stored and looked up in: without whitespace and
+    upper-cased. GS1 identifiers are reduced to the 14-digit GTIN, whether scanned
+    as a full UDI with production identifiers, written with the (01) prefix, or
+    given as a shorter GTIN.
+    """
+    value = SYMBOLOGY_IDENTIFIER.sub('', ''.join(value.split()).upper())
+    if match := GS1_BRACKETED.match(value) or GS1_ELEMENT_STRING.fullmatch(value):
+        return match[1]
+    if value.isdigit() and len(value) in (8, 12, 13):
+        return value.zfill(14)
+    return value
+
+DUPLICATE_DEVICE_IDENTIFIER = 'The current revision of another document has this device identifier.'
+
+class DocumentQuerySet(models.QuerySet):
+    def refresh_effective_revisions(self):
+        # One UPDATE; the correlated subqueries are answered from the (document, revision_sort_key) index.
+        latest = DocumentRevision.objects.filter(document=models.OuterRef('pk')).order_by('-revision_sort_key', '-pk')
+        try:
+            with transaction.atomic(using=self.db):
+                return self.update(
+                    effective_revision=models.Subquery(latest.values('pk')[:1]),
+                    device_identifier=Coalesce(models.Subquery(latest.values('device_identifier')[:1]), models.Value('')),
+                )
+        except IntegrityError:
+            # Only documents_unique_device_identifier can fail: a revision saved without
+            # clean() made another document's current device identifier current here too.
+            raise ValidationError({'device_identifier_number': DUPLICATE_DEVICE_IDENTIFIER})
+
 class Document(models.Model):
-    control_number = models.CharField(max_length=255, unique=True)
+    # Left blank, a number is allocated from the document type's ControlNumberSequence.
+    control_number = models.CharField(max_length=255, unique=True, blank=True)
     legacy_control_number = models.CharField(max_length=255, blank=True, unique=True)
-    document_type = models.ForeignKey(DocumentType, on_delete=models.CASCADE)
+    document_type = models.ForeignKey(DocumentType, on_delete=models.CASCADE, db_index=False)
+    effective_revision = models.ForeignKey(
+        'DocumentRevision', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+'
+    )
+    # The effective revision's device identifier, so it can be unique across current revisions.
+    device_identifier = models.CharField(max_length=255, blank=True, editable=False)
+
+    objects = DocumentQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self.control_number:
+            from .control_numbers import allocate
+            self.control_number, = allocate(self.document_type_id)
+        # effective_revision and device_identifier are only written by refresh_effective_revisions();
+        # saving an instance loaded before its revisions changed must not put back stale values.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('effective_revision', 'device_identifier')
+            ]
+        super().save(*args, **kwargs)
     
     def __str__(self):
         if self.legacy_control_number:
-            return f'{self.document_type.code}-{self.control_number} ({self.legacy_control_number})'
+            return f'{self.document_type_code}-{self.control_number} ({self.legacy_control_number})'
         else:
-            return f'{self.document_type.code}-{self.control_number}'
+            return f'{self.document_type_code}-{self.control_number}'
+
+    @property
+    def document_type_code(self):
+        # Use the loaded type if there is one, otherwise the reference cache rather than a query.
+        if Document.document_type.is_cached(self):
+            return self.document_type.code
+        return document_types.get(self.document_type_id).code
+
+    class Meta:
+        indexes = [
+            # The document list filtered by type, in control number order.
+            models.Index(fields=['document_type', 'control_number'], name='documents_type_number'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device_identifier'], condition=~models.Q(device_identifier=''),
+                name='documents_unique_device_identifier',
+            ),
+        ]
+
+class ControlNumberSequence(models.Model):
+    # Numbers are allocated by documents.control_numbers, which advances next_value atomically.
+    document_type = models.OneToOneField(DocumentType, on_delete=models.CASCADE, primary_key=True)
+    prefix = models.CharField(max_length=50, blank=True)
+    padding = models.PositiveSmallIntegerField(default=6)
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    def format(self, value):
+        return f'{self.prefix}{value:0{self.padding}d}'
+
+    def __str__(self):
+        return f'{self.document_type.code} control numbers'
+
+class DocumentRevisionQuerySet(models.QuerySet):
+    def effective(self):
+        # The effective revision of a document is its highest revision, kept in Document.effective_revision.
+        return self.filter(document__effective_revision=models.F('pk'))
 
 class DocumentRevision(models.Model):
-    document = models.ForeignKey(Document, on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, db_index=False)
     document_change = models.ForeignKey(DocumentChange, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     major_revision = models.CharField(max_length=255)
+    revision_sort_key = models.CharField(max_length=255, blank=True, editable=False)
     legacy_revision = models.CharField(max_length=255, blank=True)
     design_ownership = models.CharField(max_length=255, choices=DESIGN_OWNERSHIP_CHOICES, default='SELF')
     manufacturing_options = models.CharField(max_length=255, choices=MANUFACTURING_OPTIONS_CHOICES, default='SELF')
@@ -62,9 +185,47 @@ class DocumentRevision(models.Model):
 
     # Only used for shippable finished device
     device_identifier_number = models.CharField(max_length=255, blank=True)
+    # Normalized device_identifier_number of shippable revisions, for lookups by scanned UDI.
+    device_identifier = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+
+    objects = DocumentRevisionQuerySet.as_manager()
 
     class Meta:
         unique_together = ('document', 'major_revision')
+        indexes = [
+            models.Index(fields=['document', 'revision_sort_key'], name='documents_revision_sort'),
+        ]
+
+    def indexed_device_identifier(self):
+        if self.finished_device != 'SHIPPABLE':
+            return ''
+        return normalize_device_identifier(self.device_identifier_number)
+
+    def is_effective_candidate(self):
+        """Whether this revision is, or once saved would become, its document's effective revision."""
+        sort_key = sort_key_for_revision(self.major_revision)
+        higher = models.Q(revision_sort_key__gt=sort_key)
+        if self.pk is not None:
+            higher |= models.Q(revision_sort_key=sort_key, pk__gt=self.pk)
+        return not DocumentRevision.objects.filter(higher, document=self.document_id).exclude(pk=self.pk).exists()
+
+    def clean(self):
+        # Only effective revisions' identifiers are indexed, so superseded ones may repeat them.
+        device_identifier = self.indexed_device_identifier()
+        if device_identifier and Document.objects.filter(device_identifier=device_identifier).exclude(
+            pk=self.document_id
+        ).exists() and self.is_effective_candidate():
+            raise ValidationError({'device_identifier_number': DUPLICATE_DEVICE_IDENTIFIER})
+
+    def save(self, *args, **kwargs):
+        self.revision_sort_key = sort_key_for_revision(self.major_revision)
+        self.device_identifier = self.indexed_device_identifier()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = {'major_revision': 'revision_sort_key', 'device_identifier_number': 'device_identifier',
+                       'finished_device': 'device_identifier'}
+            kwargs['update_fields'] = {*update_fields, *(derived[name] for name in update_fields if name in derived)}
+        super().save(*args, **kwargs)
     
     def __str__(self):
         if self.legacy_revision:
@@ -73,55 +234,185 @@ class DocumentRevision(models.Model):
             return f'{self.document} - Rev. {self.major_revision}'
 
 class DocumentRevisionInputPart(models.Model):
-    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE)
+    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE, db_index=False)
     input_part = models.ForeignKey(Document, on_delete=models.CASCADE)
     order = models.PositiveIntegerField()
     quantity = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return f'{self.document_revision} Input Part: {self.input_part}'
+
+    def clean(self):
+        from .validation import validate_part_link
+        validate_part_link(self)
     
     class Meta:
         unique_together = ('document_revision', 'input_part')
+        indexes = [
+            # Covers a revision's parts in order, including the BOM explosion's recursive join.
+            models.Index(fields=['document_revision', 'order', 'input_part', 'quantity'], name='documents_input_part_order'),
+        ]
 
 class DocumentRevisionOutputPart(models.Model):
     # Some process documents can describe how to make multiple parts.
-    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE)
+    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE, db_index=False)
     output_part = models.ForeignKey(Document, on_delete=models.CASCADE)
     order = models.PositiveIntegerField()
 
     def __str__(self):
         return f'{self.document_revision} Output Part: {self.output_part}'
+
+    def clean(self):
+        from .validation import validate_part_link
+        validate_part_link(self)
     
     class Meta:
         unique_together = ('document_revision', 'output_part')
+        indexes = [
+            models.Index(fields=['document_revision', 'order', 'output_part'], name='documents_output_part_order'),
+        ]
+
+class FileBlob(models.Model):
+    # One stored file, shared by every attachment and process step image with the same
+    # content. ref_count is maintained by signals on both; gc_blobs deletes blobs at zero.
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
 
 class DocumentRevisionAttachedFile(models.Model):
-    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE)
-    file = models.FileField(upload_to='document_revision_attached_files/')
+    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE, db_index=False)
+    file = models.FileField(upload_to='document_revision_attached_files/', storage=attachment_storage)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
     description = models.TextField()
     order = models.PositiveIntegerField()
 
     def __str__(self):
         return f'{self.document_revision} Attached File: {self.file.name}'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['document_revision', 'order'], name='documents_attachment_order'),
+        ]
+
 class DocumentRevisionProcessStep(models.Model):
-    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE)
+    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE, db_index=False)
     order = models.PositiveIntegerField()
     roles = models.ManyToManyField(Role, blank=True)
     locations = models.ManyToManyField(Location, blank=True)
     description = models.TextField()
-    image = models.ImageField(upload_to='document_revision_process_step_images/', blank=True)
+    image = models.ImageField(upload_to='document_revision_process_step_images/', blank=True, storage=attachment_storage)
+    image_sha256 = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
 
     def __str__(self):
-        return f'{self.document_revision} Process{self.process_document}'
+        return f'{self.document_revision} Process Step: {self.order}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document_revision', 'order'], name='documents_step_order'),
+        ]
 
 class DocumentRevisionPolicySection(models.Model):
-    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE)
+    document_revision = models.ForeignKey(DocumentRevision, on_delete=models.CASCADE, db_index=False)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True)
     order = models.PositiveIntegerField()
     header = models.CharField(max_length=255)
     text = models.TextField()
 
+    # Maintained by documents.policy_tree. The path holds the zero-padded position
+    # of each ancestor among its siblings, so ordering by it yields the outline.
+    path = models.CharField(max_length=1024, blank=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    number = models.CharField(max_length=255, blank=True, editable=False)
+
+    def __str__(self):
+        return f'{self.document_revision} Policy Section: {self.header}'
+
+    def clean(self):
+        from .validation import validate_policy_parent
+        validate_policy_parent(self)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document_revision', 'path'], name='documents_policy_outline'),
+            models.Index(fields=['document_revision', 'parent', 'order'], name='documents_policy_siblings'),
+        ]
+
+class DocumentPartLink(models.Model):
+    # Direct part usage by the effective revision of `parent`, through either its
+    # input parts or its output parts. Maintained by documents.where_used.
+    parent = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='part_links')
+    child = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='used_in_links')
+
+    def __str__(self):
+        return f'{self.parent_id} uses {self.child_id}'
+
+    class Meta:
+        unique_together = ('parent', 'child')
+
+class DocumentPartClosure(models.Model):
+    # Transitive closure of DocumentPartLink, counting distinct paths so links can
+    # be removed without rewalking the graph.
+    ancestor = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+    descendant = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+    path_count = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f'{self.ancestor_id} reaches {self.descendant_id}'
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'ancestor'], name='documents_closure_where_used'),
+        ]
+
+class DocumentPartUse(models.Model):
+    # Direct part usage by any revision of `parent`, superseded ones included: deleting
+    # a newer revision brings an older one back into effect. Maintained by
+    # documents.where_used so part cycles can be refused without walking the links.
+    parent = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+    child = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+
+    def __str__(self):
+        return f'{self.parent_id} uses {self.child_id}'
+
+    class Meta:
+        unique_together = ('parent', 'child')
+
+class DocumentPartReach(models.Model):
+    # Transitive closure of DocumentPartUse, with path counts like DocumentPartClosure.
+    ancestor = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+    descendant = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+    path_count = models.PositiveIntegerField(default=1)
+
     def __str__(self):
-        return f'{self.document_revision} Policy Section: {self.header}'
\ No newline at end of file
+        return f'{self.ancestor_id} reaches {self.descendant_id}'
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+class ProcessStepAssignment(models.Model):
+    # Who performs each step of the effective process documents, and where: one row per
+    # step, role and location, with the revision-wide or per-step roles and locations
+    # chosen by the revision's settings. Role or location is null when none is set.
+    # Maintained by documents.assignments.
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='+')
+    step = models.ForeignKey(DocumentRevisionProcessStep, on_delete=models.CASCADE, related_name='+')
+    role = models.ForeignKey(Role, on_delete=models.CASCADE, null=True, related_name='+', db_index=False)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, null=True, related_name='+', db_index=False)
+
+    def __str__(self):
+        return f'{self.step_id}: {self.role_id} at {self.location_id}'
+
+    class Meta:
+        indexes = [
+            # Lookups by role, by location or by both read only the index.
+            models.Index(fields=['role', 'location', 'step'], name='documents_assignment_role'),
+            models.Index(fields=['location', 'role', 'step'], name='documents_assignment_location'),
+        ]
+
+document_types = ReferenceCache(DocumentType, 'code')
+action_tags = ReferenceCache(DocumentRevisionPreviousRevisionActionTag, 'display_name')
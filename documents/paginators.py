@@ -0,0 +1,46 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Below this many rows an exact COUNT(*) is cheap enough to keep.
+ESTIMATE_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for large admin changelists. An unfiltered queryset is counted from
+    the planner statistics instead of a full COUNT(*): pg_class.reltuples on
+    PostgreSQL, sqlite_stat1 on SQLite. Both are only as fresh as the last ANALYZE,
+    so the count and the number of pages are approximate. Filtered querysets, small
+    tables and tables without statistics are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where or query.is_sliced or query.distinct:
+            return super().count
+        estimate = self._estimate()
+        if estimate is None or estimate < ESTIMATE_THRESHOLD:
+            return super().count
+        return estimate
+
+    def _estimate(self):
+        model = self.object_list.model
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+                row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                # The statistics table only exists once ANALYZE has run on the database.
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [model._meta.db_table])
+                # One row per index, each starting with the number of rows it covers;
+                # partial indexes cover fewer, so the table size is the largest.
+                return max((int(stat.split()[0]) for stat, in cursor.fetchall()), default=None)
+        return None
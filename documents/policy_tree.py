@@ -0,0 +1,166 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+
+from . import rendering
+from .commit_hooks import schedule_once
+from .models import DocumentRevisionPolicySection
+
+PATH_WIDTH = 6
+PATH_SEPARATOR = '.'
+
+
+def compute_outline(rows):
+    """
+    Given (pk, parent_id, order) rows of one revision, return {pk: (path, depth, number)}.
+
+    Siblings are numbered by order, then pk, starting at 1. Sections that cannot be
+    reached from a root are left out.
+    """
+    children = defaultdict(list)
+    for pk, parent_id, order in rows:
+        children[parent_id].append((order, pk))
+
+    outline = {}
+    stack = [(None, '', '', 0)]
+    while stack:
+        parent_id, parent_path, parent_number, depth = stack.pop()
+        for position, (_, pk) in enumerate(sorted(children.get(parent_id, ())), start=1):
+            if pk in outline:
+                continue
+            path = f'{parent_path}{PATH_SEPARATOR if parent_path else ""}{position:0{PATH_WIDTH}d}'
+            number = f'{parent_number}{"." if parent_number else ""}{position}'
+            outline[pk] = (path, depth, number)
+            stack.append((pk, path, number, depth + 1))
+    return outline
+
+
+def rebuild_tree(revision_id):
+    """Recompute path, depth and number for a revision's sections, writing only rows that changed."""
+    sections = list(
+        DocumentRevisionPolicySection.objects.filter(document_revision=revision_id)
+        .only('pk', 'parent_id', 'order', 'path', 'depth', 'number')
+    )
+    outline = compute_outline((section.pk, section.parent_id, section.order) for section in sections)
+    changed = []
+    for section in sections:
+        if section.pk in outline and (section.path, section.depth, section.number) != outline[section.pk]:
+            section.path, section.depth, section.number = outline[section.pk]
+            changed.append(section)
+    DocumentRevisionPolicySection.objects.bulk_update(changed, ['path', 'depth', 'number'], batch_size=500)
+    if changed:
+        # bulk_update sends no signals, so the rendering is dropped here.
+        rendering.invalidate([revision_id])
+    return outline
+
+
+def _rebuild_pending(revision_ids):
+    for revision_id in sorted(revision_ids):
+        rebuild_tree(revision_id)
+
+
+def schedule_rebuild(revision_id):
+    """Rebuild once when the current transaction commits, however many sections it touched."""
+    schedule_once(_rebuild_pending, [revision_id])
+
+
+def place_section(section):
+    """
+    Give a saved section its own path, depth and number from its parent and the
+    siblings ordered before it, with two queries. Returns whether the rest of the
+    revision still has to be rebuilt: only a section added after all its siblings
+    leaves every other path as it was.
+    """
+    siblings = DocumentRevisionPolicySection.objects.filter(
+        document_revision=section.document_revision_id, parent=section.parent_id,
+    ).exclude(pk=section.pk)
+    counts = siblings.aggregate(
+        before=Count('pk', filter=Q(order__lt=section.order) | Q(order=section.order, pk__lt=section.pk)),
+        total=Count('pk'),
+    )
+    position = counts['before'] + 1
+    if section.parent_id is None:
+        section.path, section.depth, section.number = f'{position:0{PATH_WIDTH}d}', 0, str(position)
+    else:
+        parent = DocumentRevisionPolicySection.objects.filter(pk=section.parent_id).values('path', 'depth', 'number').get()
+        section.path = f'{parent["path"]}{PATH_SEPARATOR}{position:0{PATH_WIDTH}d}'
+        section.depth = parent['depth'] + 1
+        section.number = f'{parent["number"]}.{position}'
+    DocumentRevisionPolicySection.objects.filter(pk=section.pk).update(
+        path=section.path, depth=section.depth, number=section.number,
+    )
+    return position <= counts['total']
+
+
+def ancestors(section_id):
+    """
+    {pk: revision pk} of a section and all its ancestors, in one query that follows
+    the parent links rather than the stored paths, so it holds inside a transaction
+    whose outline has not been rebuilt yet. Terminates on a loop.
+    """
+    table = connection.ops.quote_name(DocumentRevisionPolicySection._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            WITH RECURSIVE up (id, parent_id, document_revision_id) AS (
+                SELECT id, parent_id, document_revision_id FROM {table} WHERE id = %s
+                UNION
+                SELECT s.id, s.parent_id, s.document_revision_id FROM {table} s JOIN up ON s.id = up.parent_id
+            )
+            SELECT id, document_revision_id FROM up
+            ''',
+            [section_id],
+        )
+        return dict(cursor.fetchall())
+
+def section_tree(revision):
+    """All sections of a revision in outline order, with depth and number, in one query."""
+    return DocumentRevisionPolicySection.objects.filter(document_revision=revision).order_by('path')
+
+
+def subtree(section):
+    return DocumentRevisionPolicySection.objects.filter(
+        document_revision=section.document_revision_id,
+        path__startswith=f'{section.path}{PATH_SEPARATOR}',
+    ).order_by('path')
+
+
+# move_section's default for parent, since None moves a section to the top level.
+KEEP_PARENT = object()
+
+
+@transaction.atomic
+def move_section(section, parent=KEEP_PARENT, order=None):
+    """
+    Re-parent and/or reorder a section; parent=None makes it a top-level section.
+    The outline is rebuilt at once, so the section and every other section whose
+    position changed, its subtree included, get their new path and number.
+    """
+    if parent is not KEEP_PARENT:
+        if parent is not None:
+            if parent.document_revision_id != section.document_revision_id:
+                raise ValidationError('A policy section can only be moved within its own revision.')
+            if section.pk in ancestors(parent.pk):
+                raise ValidationError('A policy section cannot be moved under itself.')
+        section.parent = parent
+    if order is not None:
+        section.order = order
+    DocumentRevisionPolicySection.objects.filter(pk=section.pk).update(parent=section.parent_id, order=section.order)
+    rendering.invalidate([section.document_revision_id])
+    section.path, section.depth, section.number = rebuild_tree(section.document_revision_id)[section.pk]
+
+
+@transaction.atomic
+def reorder_sections(sections):
+    """Give the sections, siblings of one parent, consecutive orders in the sequence passed."""
+    sections = list(sections)
+    for order, section in enumerate(sections, start=1):
+        section.order = order
+    DocumentRevisionPolicySection.objects.bulk_update(sections, ['order'])
+    if sections:
+        rendering.invalidate({section.document_revision_id for section in sections})
+        outline = rebuild_tree(sections[0].document_revision_id)
+        for section in sections:
+            section.path, section.depth, section.number = outline[section.pk]
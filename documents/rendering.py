@@ -0,0 +1,164 @@
+import asyncio
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import derivatives
+from .commit_hooks import schedule_once
+from .models import (
+    DocumentRevision, DocumentRevisionAttachedFile, DocumentRevisionInputPart, DocumentRevisionOutputPart,
+    DocumentRevisionPolicySection, DocumentRevisionProcessStep,
+)
+
+# Bump when revision_body.html changes so stale renderings are not served.
+TEMPLATE_VERSION = 1
+# Renderings that still point at original images are only kept until the renditions exist.
+PROVISIONAL_TIMEOUT = 60
+
+
+def cache_key(revision_id):
+    return f'documents:revision-html:v{TEMPLATE_VERSION}:{revision_id}'
+
+
+def token_key(revision_id):
+    return f'documents:revision-token:{revision_id}'
+
+
+def revision_tokens(revision_ids):
+    """
+    An opaque token per revision that changes whenever the revision is invalidated.
+    Caches derived from several revisions (such as diffs) include these in their keys.
+    """
+    tokens = cache.get_many([token_key(revision_id) for revision_id in revision_ids])
+    result = {}
+    for revision_id in revision_ids:
+        token = tokens.get(token_key(revision_id))
+        if token is None:
+            cache.add(token_key(revision_id), uuid.uuid4().hex, None)
+            token = cache.get(token_key(revision_id))
+        result[revision_id] = token
+    return result
+
+
+def _child_querysets():
+    # to_attr -> (reverse accessor, queryset) for the collections the revision template shows.
+    return {
+        'input_parts': (
+            'documentrevisioninputpart_set',
+            DocumentRevisionInputPart.objects.select_related('input_part__document_type').order_by('order'),
+        ),
+        'output_parts': (
+            'documentrevisionoutputpart_set',
+            DocumentRevisionOutputPart.objects.select_related('output_part__document_type').order_by('order'),
+        ),
+        'attached_files': ('documentrevisionattachedfile_set', DocumentRevisionAttachedFile.objects.order_by('order')),
+        'process_steps': (
+            'documentrevisionprocessstep_set',
+            DocumentRevisionProcessStep.objects.prefetch_related('roles', 'locations').order_by('order'),
+        ),
+        'policy_sections': ('documentrevisionpolicysection_set', DocumentRevisionPolicySection.objects.order_by('path')),
+    }
+
+
+def _revision_base_queryset():
+    return DocumentRevision.objects.select_related('document__document_type', 'document_change__owner').prefetch_related(
+        'previous_revision_action_tags', 'process_roles', 'process_locations',
+    )
+
+
+def revision_queryset():
+    """Everything the revision template shows, in a fixed number of queries."""
+    return _revision_base_queryset().prefetch_related(*(
+        Prefetch(lookup, queryset=queryset, to_attr=to_attr) for to_attr, (lookup, queryset) in _child_querysets().items()
+    ))
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+async def aload_revision(revision_id):
+    """Load a revision like revision_queryset() does, fetching its child collections concurrently."""
+    children = _child_querysets()
+    revision, *collections = await asyncio.gather(
+        _revision_base_queryset().aget(pk=revision_id),
+        *(_alist(queryset.filter(document_revision=revision_id)) for _, queryset in children.values()),
+    )
+    for to_attr, rows in zip(children, collections):
+        setattr(revision, to_attr, rows)
+    return revision
+
+
+def _render(revision):
+    body = render_to_string('documents/revision_body.html', {'revision': revision})
+    ready = all(
+        derivatives.existing_url(step.image, rendition) is not None
+        for step in revision.process_steps if step.image
+        for rendition in derivatives.RENDITIONS
+    )
+    rendering = (str(revision), body)
+    cache.set(cache_key(revision.pk), rendering, None if ready else PROVISIONAL_TIMEOUT)
+    return rendering
+
+
+def render_revision(revision_id):
+    """
+    Return (title, body HTML) for a revision. A cached rendering costs a single cache
+    lookup; signals delete it whenever the revision or anything it shows changes.
+    """
+    rendering = cache.get(cache_key(revision_id))
+    if rendering is None:
+        rendering = _render(revision_queryset().get(pk=revision_id))
+    title, body = rendering
+    return title, mark_safe(body)
+
+
+async def arender_revision(revision_id):
+    """render_revision() for async views; a cache hit never leaves the event loop."""
+    rendering = await cache.aget(cache_key(revision_id))
+    if rendering is None:
+        rendering = await sync_to_async(_render)(await aload_revision(revision_id))
+    title, body = rendering
+    return title, mark_safe(body)
+
+
+async def arevision_token(revision_id):
+    token = await cache.aget(token_key(revision_id))
+    if token is None:
+        await cache.aadd(token_key(revision_id), uuid.uuid4().hex, None)
+        token = await cache.aget(token_key(revision_id))
+    return token
+
+
+def invalidate(revision_ids):
+    """
+    Drop the renderings and tokens of the given revisions when the current transaction
+    commits. Dropped earlier, a reader could render the uncommitted-over rows again
+    and cache them with no timeout.
+    """
+    schedule_once(_invalidate_now, list(revision_ids))
+
+
+def _invalidate_now(revision_ids):
+    cache.delete_many(
+        [cache_key(revision_id) for revision_id in revision_ids] + [token_key(revision_id) for revision_id in revision_ids]
+    )
+
+
+def warm(revision_ids, batch_size=100, force=False):
+    """Render revisions that are not cached yet, loading them in batches. Returns how many were rendered."""
+    revision_ids = list(revision_ids)
+    rendered = 0
+    for start in range(0, len(revision_ids), batch_size):
+        batch = revision_ids[start:start + batch_size]
+        if not force:
+            cached = cache.get_many([cache_key(revision_id) for revision_id in batch])
+            batch = [revision_id for revision_id in batch if cache_key(revision_id) not in cached]
+        for revision in revision_queryset().filter(pk__in=batch):
+            _render(revision)
+            rendered += 1
+    return rendered
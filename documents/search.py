@@ -0,0 +1,179 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .commit_hooks import schedule_once
+from .models import DocumentRevision, DocumentRevisionPolicySection, DocumentRevisionProcessStep
+
+TABLE = 'documents_search'
+BATCH_SIZE = 500
+
+
+@dataclass
+class SearchResult:
+    revision: DocumentRevision
+    rank: float
+
+
+class SQLiteSearchBackend:
+    """FTS5 table whose rowid is the DocumentRevision pk, created by migration 0010."""
+
+    key_column = 'rowid'
+
+    def delete(self, cursor, revision_ids):
+        placeholders = ', '.join(['%s'] * len(revision_ids))
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({placeholders})', list(revision_ids))
+
+    def insert(self, cursor, entries):
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, control_number, legacy_control_number, title, body) VALUES (%s, %s, %s, %s, %s)',
+            entries,
+        )
+
+    def query(self, terms):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # bm25 is lower-is-better; control numbers outweigh the title, which outweighs the body.
+        return (
+            f'SELECT rowid, bm25({TABLE}, 10.0, 10.0, 4.0, 1.0) AS rank FROM {TABLE} WHERE {TABLE} MATCH %s',
+            [match],
+            'rank',
+        )
+
+
+class PostgresSearchBackend:
+    """
+    Regular table with a weighted tsvector and a GIN index, created by migrations 0010
+    and 0021. Like the FTS5 table it has no foreign key, which would stop flush from
+    truncating the revisions; entries of deleted revisions are dropped by reindexing.
+    """
+
+    key_column = 'revision_id'
+
+    def delete(self, cursor, revision_ids):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE revision_id = ANY(%s)', [list(revision_ids)])
+
+    def insert(self, cursor, entries):
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (revision_id, vector) VALUES (%s, "
+            f"setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'A') || "
+            f"setweight(to_tsvector('simple', %s), 'B') || setweight(to_tsvector('simple', %s), 'C'))",
+            entries,
+        )
+
+    def query(self, terms):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        return (
+            f"SELECT revision_id, ts_rank_cd(vector, to_tsquery('simple', %s)) AS rank FROM {TABLE} "
+            f"WHERE vector @@ to_tsquery('simple', %s)",
+            [tsquery, tsquery],
+            'rank DESC',
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    backend = BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+def _entries(revision_ids):
+    sections = defaultdict(list)
+    for revision_id, header, text in DocumentRevisionPolicySection.objects.filter(
+        document_revision__in=revision_ids
+    ).order_by('path').values_list('document_revision', 'header', 'text'):
+        sections[revision_id].extend((header, text))
+    steps = defaultdict(list)
+    for revision_id, description in DocumentRevisionProcessStep.objects.filter(
+        document_revision__in=revision_ids
+    ).order_by('order').values_list('document_revision', 'description'):
+        steps[revision_id].append(description)
+
+    revisions = DocumentRevision.objects.filter(pk__in=revision_ids).values_list(
+        'pk', 'document__control_number', 'document__legacy_control_number', 'title',
+        'change_description', 'process_purpose_and_scope',
+    )
+    for pk, control_number, legacy_control_number, title, change_description, purpose in revisions:
+        body = '\n'.join([change_description, purpose, *sections[pk], *steps[pk]])
+        yield (pk, control_number, legacy_control_number, title, body)
+
+
+def index_revisions(revision_ids):
+    """Replace the index entries of the given revisions; deleted revisions simply drop out."""
+    backend = get_backend()
+    revision_ids = list(revision_ids)
+    if backend is None or not revision_ids:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(revision_ids), BATCH_SIZE):
+            batch = revision_ids[start:start + BATCH_SIZE]
+            backend.delete(cursor, batch)
+            backend.insert(cursor, list(_entries(batch)))
+
+
+def schedule_index(revision_id):
+    """Reindex once when the current transaction commits, however many rows of the revision changed."""
+    schedule_once(_index_pending, [revision_id])
+
+
+def _index_pending(revision_ids):
+    index_revisions(sorted(revision_ids))
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Reindex every revision in batches, streaming primary keys from the database."""
+    backend = get_backend()
+    if backend is None:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    count = 0
+    batch = []
+    for pk in DocumentRevision.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            index_revisions(batch)
+            count += len(batch)
+            batch = []
+    index_revisions(batch)
+    return count + len(batch)
+
+
+def search(text, document_type=None, role=None, location=None, limit=50):
+    """
+    Ranked revisions matching every word of `text` as a prefix, optionally limited
+    to a DocumentType, or to revisions assigning a Role or Location either to the
+    whole process or to any of its steps.
+    """
+    backend = get_backend()
+    terms = re.findall(r'\w+', text)
+    if backend is None or not terms:
+        return []
+
+    sql, params, order = backend.query(terms)
+    candidates = DocumentRevision.objects.all()
+    if document_type is not None:
+        candidates = candidates.filter(document__document_type=document_type)
+    if role is not None:
+        candidates = candidates.filter(Q(process_roles=role) | Q(documentrevisionprocessstep__roles=role))
+    if location is not None:
+        candidates = candidates.filter(Q(process_locations=location) | Q(documentrevisionprocessstep__locations=location))
+    if candidates.query.where:
+        candidate_sql, candidate_params = candidates.values('pk').query.sql_with_params()
+        sql = f'{sql} AND {backend.key_column} IN ({candidate_sql})'
+        params += list(candidate_params)
+    sql = f'{sql} ORDER BY {order} LIMIT %s'
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ranked = cursor.fetchall()
+    revisions = DocumentRevision.objects.select_related('document__document_type').in_bulk([pk for pk, _ in ranked])
+    return [SearchResult(revisions[pk], rank) for pk, rank in ranked if pk in revisions]
@@ -0,0 +1,270 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from organization.models import Location, Role
+
+from . import api, assignments, attachments, derivatives, policy_tree, rendering, search, validation, where_used
+from .models import (
+    Document, DocumentChange, DocumentRevision, DocumentRevisionAttachedFile, DocumentRevisionInputPart,
+    DocumentRevisionOutputPart, DocumentRevisionPolicySection, DocumentRevisionPreviousRevisionActionTag,
+    DocumentRevisionProcessStep, DocumentType,
+)
+from .storage import digest_of
+
+
+@receiver(post_save, sender=DocumentRevision)
+@receiver(post_delete, sender=DocumentRevision)
+def revision_changed(sender, instance, **kwargs):
+    # The effective revision pointer has to be current before where-used reads it.
+    Document.objects.filter(pk=instance.document_id).refresh_effective_revisions()
+    where_used.sync_documents([instance.document_id])
+    search.schedule_index(instance.pk)
+
+
+@receiver(pre_save, sender=DocumentRevisionPolicySection)
+def policy_section_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        validation.validate_policy_parent(instance)
+
+
+@receiver(post_save, sender=DocumentRevisionInputPart)
+@receiver(post_delete, sender=DocumentRevisionInputPart)
+@receiver(post_save, sender=DocumentRevisionOutputPart)
+@receiver(post_delete, sender=DocumentRevisionOutputPart)
+def part_link_changed(sender, instance, **kwargs):
+    document_id = DocumentRevision.objects.filter(pk=instance.document_revision_id).values_list('document', flat=True).first()
+    if document_id is not None:
+        where_used.sync_documents([document_id])
+
+
+@receiver(post_save, sender=Document)
+def document_saved(sender, instance, created, **kwargs):
+    if not created:
+        for revision_id in DocumentRevision.objects.filter(document=instance).values_list('pk', flat=True):
+            search.schedule_index(revision_id)
+
+
+@receiver(pre_delete, sender=Document)
+def document_deleting(sender, instance, **kwargs):
+    where_used.detach_document(instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def document_deleted(sender, instance, **kwargs):
+    where_used.document_deleted(instance.pk)
+
+
+@receiver(post_save, sender=DocumentRevisionPolicySection)
+def policy_section_saved(sender, instance, created, **kwargs):
+    # The saved section is numbered at once; siblings and subtrees it shifts are
+    # renumbered by one rebuild of the revision when the transaction commits.
+    if policy_tree.place_section(instance) or not created:
+        policy_tree.schedule_rebuild(instance.document_revision_id)
+
+
+@receiver(post_delete, sender=DocumentRevisionPolicySection)
+def policy_section_deleted(sender, instance, **kwargs):
+    policy_tree.schedule_rebuild(instance.document_revision_id)
+
+
+@receiver(post_save, sender=DocumentRevisionPolicySection)
+@receiver(post_delete, sender=DocumentRevisionPolicySection)
+@receiver(post_save, sender=DocumentRevisionProcessStep)
+@receiver(post_delete, sender=DocumentRevisionProcessStep)
+def searchable_text_changed(sender, instance, **kwargs):
+    search.schedule_index(instance.document_revision_id)
+
+
+@receiver(pre_save, sender=DocumentRevisionAttachedFile)
+def attached_file_saving(sender, instance, **kwargs):
+    instance._previous_sha256 = instance.sha256
+
+
+@receiver(post_save, sender=DocumentRevisionAttachedFile)
+def attached_file_saved(sender, instance, **kwargs):
+    # The file is only stored (and so named by its digest) while the row is saved.
+    digest = digest_of(instance.file.name)
+    if digest != instance.sha256:
+        instance.sha256 = digest
+        DocumentRevisionAttachedFile.objects.filter(pk=instance.pk).update(sha256=digest)
+    attachments.sync_blob_refs({digest, getattr(instance, '_previous_sha256', '')})
+
+
+@receiver(post_delete, sender=DocumentRevisionAttachedFile)
+def attached_file_deleted(sender, instance, **kwargs):
+    attachments.sync_blob_refs([instance.sha256])
+
+
+@receiver(pre_save, sender=DocumentRevisionProcessStep)
+def process_step_saving(sender, instance, **kwargs):
+    instance._previous_image_sha256 = instance.image_sha256
+
+
+@receiver(post_save, sender=DocumentRevisionProcessStep)
+def process_step_saved(sender, instance, **kwargs):
+    # Step images are blobs too, so gc_blobs can tell when the last step lets go of one.
+    digest = digest_of(instance.image.name)
+    if digest != instance.image_sha256:
+        instance.image_sha256 = digest
+        DocumentRevisionProcessStep.objects.filter(pk=instance.pk).update(image_sha256=digest)
+    attachments.sync_blob_refs({digest, getattr(instance, '_previous_image_sha256', '')})
+    if instance.image:
+        transaction.on_commit(lambda: derivatives.schedule(instance.image))
+
+
+@receiver(post_delete, sender=DocumentRevisionProcessStep)
+def process_step_deleted(sender, instance, **kwargs):
+    attachments.sync_blob_refs([instance.image_sha256])
+
+
+# Work assignments (documents.assignments) follow the effective revisions' steps, roles and locations.
+
+@receiver(post_save, sender=DocumentRevision)
+@receiver(post_delete, sender=DocumentRevision)
+def revision_assignments_changed(sender, instance, **kwargs):
+    # Saving or deleting a revision can also change which revision is effective.
+    assignments.schedule_refresh(document_ids=[instance.document_id])
+
+
+@receiver(post_save, sender=DocumentRevisionProcessStep)
+@receiver(post_delete, sender=DocumentRevisionProcessStep)
+def step_assignments_changed(sender, instance, **kwargs):
+    assignments.schedule_refresh(revision_ids=[instance.document_revision_id])
+
+
+@receiver(m2m_changed, sender=DocumentRevision.process_roles.through)
+@receiver(m2m_changed, sender=DocumentRevision.process_locations.through)
+def revision_m2m_assignments_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            assignments.schedule_refresh(document_ids=[instance.document_id])
+    elif action == 'pre_clear':
+        assignments.schedule_refresh(revision_ids=_linked(sender, instance, 'documentrevision'))
+    elif action.startswith('post_') and pk_set:
+        assignments.schedule_refresh(revision_ids=pk_set)
+
+
+@receiver(m2m_changed, sender=DocumentRevisionProcessStep.roles.through)
+@receiver(m2m_changed, sender=DocumentRevisionProcessStep.locations.through)
+def step_m2m_assignments_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            assignments.schedule_refresh(revision_ids=[instance.document_revision_id])
+    elif action == 'pre_clear':
+        assignments.schedule_refresh(revision_ids=_linked(sender, instance, 'documentrevisionprocessstep__document_revision'))
+    elif action.startswith('post_') and pk_set:
+        assignments.schedule_refresh(
+            revision_ids=DocumentRevisionProcessStep.objects.filter(pk__in=pk_set).values_list('document_revision', flat=True)
+        )
+
+
+# Rendered revisions (documents.rendering) are dropped whenever anything they show changes, on commit.
+
+@receiver(post_save, sender=DocumentRevision)
+@receiver(post_delete, sender=DocumentRevision)
+def revision_rendering_changed(sender, instance, **kwargs):
+    rendering.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=DocumentRevisionInputPart)
+@receiver(post_delete, sender=DocumentRevisionInputPart)
+@receiver(post_save, sender=DocumentRevisionOutputPart)
+@receiver(post_delete, sender=DocumentRevisionOutputPart)
+@receiver(post_save, sender=DocumentRevisionAttachedFile)
+@receiver(post_delete, sender=DocumentRevisionAttachedFile)
+@receiver(post_save, sender=DocumentRevisionProcessStep)
+@receiver(post_delete, sender=DocumentRevisionProcessStep)
+@receiver(post_save, sender=DocumentRevisionPolicySection)
+@receiver(post_delete, sender=DocumentRevisionPolicySection)
+def revision_child_rendering_changed(sender, instance, **kwargs):
+    rendering.invalidate([instance.document_revision_id])
+
+
+@receiver(post_save, sender=Document)
+def document_rendering_changed(sender, instance, created, **kwargs):
+    if not created:
+        rendering.invalidate(DocumentRevision.objects.filter(
+            Q(document=instance)
+            | Q(documentrevisioninputpart__input_part=instance)
+            | Q(documentrevisionoutputpart__output_part=instance)
+        ).values_list('pk', flat=True).distinct())
+
+
+@receiver(post_save, sender=DocumentChange)
+def document_change_rendering_changed(sender, instance, created, **kwargs):
+    if not created:
+        rendering.invalidate(DocumentRevision.objects.filter(document_change=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=DocumentType)
+@receiver(post_save, sender=DocumentRevisionPreviousRevisionActionTag)
+@receiver(post_save, sender=Role)
+@receiver(post_save, sender=Location)
+def reference_rendering_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    if sender is DocumentType:
+        # Part links show their document's type code too.
+        revisions = DocumentRevision.objects.filter(
+            Q(document__document_type=instance)
+            | Q(documentrevisioninputpart__input_part__document_type=instance)
+            | Q(documentrevisionoutputpart__output_part__document_type=instance)
+        )
+    elif sender is DocumentRevisionPreviousRevisionActionTag:
+        revisions = DocumentRevision.objects.filter(previous_revision_action_tags=instance)
+    elif sender is Role:
+        revisions = DocumentRevision.objects.filter(Q(process_roles=instance) | Q(documentrevisionprocessstep__roles=instance))
+    else:
+        revisions = DocumentRevision.objects.filter(
+            Q(process_locations=instance) | Q(documentrevisionprocessstep__locations=instance)
+        )
+    rendering.invalidate(revisions.values_list('pk', flat=True).distinct())
+
+
+def _linked(through, instance, column):
+    """Values of `column` in the through rows that point at `instance`."""
+    field = next(f for f in through._meta.fields if f.related_model is type(instance))
+    return through.objects.filter(**{field.name: instance}).values_list(column, flat=True)
+
+
+@receiver(m2m_changed, sender=DocumentRevision.previous_revision_action_tags.through)
+@receiver(m2m_changed, sender=DocumentRevision.process_roles.through)
+@receiver(m2m_changed, sender=DocumentRevision.process_locations.through)
+def revision_m2m_rendering_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            rendering.invalidate([instance.pk])
+    elif action == 'pre_clear':
+        # After a reverse clear() nothing records which revisions were linked.
+        rendering.invalidate(_linked(sender, instance, 'documentrevision'))
+    elif action.startswith('post_') and pk_set:
+        rendering.invalidate(pk_set)
+
+
+@receiver(m2m_changed, sender=DocumentRevisionProcessStep.roles.through)
+@receiver(m2m_changed, sender=DocumentRevisionProcessStep.locations.through)
+def step_m2m_rendering_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            rendering.invalidate([instance.document_revision_id])
+    elif action == 'pre_clear':
+        rendering.invalidate(_linked(sender, instance, 'documentrevisionprocessstep__document_revision').distinct())
+    elif action.startswith('post_') and pk_set:
+        rendering.invalidate(
+            DocumentRevisionProcessStep.objects.filter(pk__in=pk_set).values_list('document_revision', flat=True).distinct()
+        )
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+@receiver(post_save, sender=DocumentRevision)
+@receiver(post_delete, sender=DocumentRevision)
+@receiver(post_save, sender=DocumentRevisionInputPart)
+@receiver(post_delete, sender=DocumentRevisionInputPart)
+@receiver(post_save, sender=DocumentRevisionOutputPart)
+@receiver(post_delete, sender=DocumentRevisionOutputPart)
+@receiver(post_save, sender=DocumentType)
+def api_data_changed(sender, **kwargs):
+    api.mark_changed()
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+CHUNK_SIZE = 1024 * 1024
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def digest_of(name):
+    """The sha256 a content-addressed name was stored under, or '' for any other name."""
+    stem = os.path.splitext(os.path.basename(name or ''))[0]
+    return stem if DIGEST_PATTERN.match(stem) else ''
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every upload under the sha256 of its content, e.g.
+    ``document_revision_attached_files/ab/cd/abcd...ef.pdf``. The upload is hashed
+    while it is streamed to a temporary file; if a blob with that digest already
+    exists the temporary file is discarded, so identical content is kept once.
+    Blobs are never deleted through the storage API because other rows may still
+    reference them; the gc_blobs command removes unreferenced ones. Reusing a blob
+    touches it, so its mtime tells gc_blobs when it was last stored or reused.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        os.makedirs(self.location, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            hexdigest = digest.hexdigest()
+            blob_name = os.path.join(directory, hexdigest[:2], hexdigest[2:4], f'{hexdigest}{extension}')
+            blob_path = self.path(blob_name)
+            if not self.touch_blob(blob_name):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return blob_name.replace('\\', '/')
+
+    def delete(self, name):
+        pass
+
+    def touch_blob(self, name):
+        """Mark a blob as just reused; False if it does not exist (any more)."""
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete_blob(self, name, unused_since=None):
+        """
+        Delete a blob unless it was stored or reused at or after the unused_since
+        timestamp. Returns whether it was deleted. The blob is first moved aside, so
+        an upload of the same content either touched it before, which its mtime then
+        shows, or finds it gone and stores it again.
+        """
+        path = self.path(name)
+        moved = f'{path}.deleting'
+        try:
+            os.replace(path, moved)
+        except FileNotFoundError:
+            return False
+        if unused_since is not None and os.path.getmtime(moved) >= unused_since:
+            os.replace(moved, path)
+            return False
+        os.remove(moved)
+        return True
+
+
+def attachment_storage():
+    return ContentAddressedStorage()
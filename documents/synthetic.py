@@ -0,0 +1,227 @@
+import random
+import string
+from dataclasses import dataclass
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from organization.models import Location, Role
+
+from . import api, assignments, search, where_used
+from .models import (
+    Document, DocumentChange, DocumentRevision, DocumentRevisionInputPart, DocumentRevisionPolicySection,
+    DocumentRevisionPreviousRevisionActionTag, DocumentRevisionProcessStep, DocumentType, sort_key_for_revision,
+)
+from .policy_tree import PATH_SEPARATOR, PATH_WIDTH
+
+WORDS = (
+    'assembly bearing bracket calibrate clean coat cure deburr drill fastener fixture gasket grind harness housing '
+    'inspect label laser machine mold pack polish press seal solder sterilize torque valve verify weld'
+).split()
+
+
+@dataclass
+class DatasetSpec:
+    document_types: int = 10
+    documents: int = 100_000
+    revisions: int = 3
+    bom_depth: int = 4
+    bom_fan_out: int = 4
+    process_every: int = 5
+    steps: int = 12
+    policy_every: int = 10
+    sections: int = 40
+    section_depth: int = 4
+    roles: int = 30
+    locations: int = 20
+    users: int = 50
+    changes: int = 2_000
+    batch_size: int = 1_000
+    seed: int = 1
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def revision_label(index):
+    """A, B, ..., Z, AA, AB, ... for index 0, 1, ..."""
+    label = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        label = string.ascii_uppercase[remainder] + label
+    return label
+
+
+def _chunks(items, size):
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Generator:
+    """
+    Fill an empty database with synthetic documents. Every document is assigned a
+    BOM level from 0 (raw parts) to bom_depth; each revision of a document above
+    level 0 consumes bom_fan_out parts of the level below, so BOMs are exactly
+    bom_depth deep. Every process_every-th document gets process steps with role and
+    location assignments and every policy_every-th document a policy-section tree.
+    """
+
+    def __init__(self, spec, log=None):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.log = log or (lambda message: None)
+
+    def run(self, index=True):
+        spec = self.spec
+        self._reference_data()
+        self._documents()
+        for chunk in _chunks(range(spec.documents), spec.batch_size):
+            with transaction.atomic():
+                self._revisions(chunk)
+            self.log(f'{chunk[-1] + 1} of {spec.documents} documents have revisions.')
+        Document.objects.refresh_effective_revisions()
+        api.mark_changed()
+        if index:
+            self.log('Rebuilding where-used.')
+            where_used.rebuild()
+            self.log('Rebuilding work assignments.')
+            assignments.rebuild()
+            self.log('Rebuilding the search index.')
+            search.rebuild()
+
+    def _reference_data(self):
+        spec = self.spec
+        self.types = DocumentType.objects.bulk_create(
+            DocumentType(display_name=f'Type {i}', code=f'T{i:02d}', description='') for i in range(spec.document_types)
+        )
+        self.roles = Role.objects.bulk_create(Role(name=f'Role {i}') for i in range(spec.roles))
+        self.locations = Location.objects.bulk_create(Location(name=f'Location {i}') for i in range(spec.locations))
+        self.action_tags = DocumentRevisionPreviousRevisionActionTag.objects.bulk_create(
+            DocumentRevisionPreviousRevisionActionTag(display_name=name, description='')
+            for name in ('Use as is', 'Rework', 'Scrap')
+        )
+        password = make_password(None)
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(username=f'user{i}', password=password) for i in range(spec.users)
+        )
+        self.changes = DocumentChange.objects.bulk_create(
+            DocumentChange(
+                title=f'Change {i}', owner=self.rng.choice(users),
+                reason_for_change=_text(self.rng, 8), description_of_change=_text(self.rng, 12),
+            )
+            for i in range(spec.changes)
+        )
+
+    def _documents(self):
+        spec = self.spec
+        documents = []
+        for chunk in _chunks(range(spec.documents), spec.batch_size):
+            documents += Document.objects.bulk_create(
+                Document(
+                    control_number=f'{i:07d}', legacy_control_number=f'L-{i:07d}', document_type=self.rng.choice(self.types),
+                )
+                for i in chunk
+            )
+        self.document_ids = [document.pk for document in documents]
+        self.levels = [[] for _ in range(spec.bom_depth + 1)]
+        for i, pk in enumerate(self.document_ids):
+            self.levels[i % (spec.bom_depth + 1)].append(pk)
+        self.log(f'{spec.documents} documents created.')
+
+    def _revisions(self, chunk):
+        spec, rng = self.spec, self.rng
+        revisions = []
+        for i in chunk:
+            for r in range(spec.revisions):
+                major_revision = revision_label(r)
+                revisions.append(DocumentRevision(
+                    document_id=self.document_ids[i],
+                    document_change=rng.choice(self.changes),
+                    title=_text(rng, 4).title(),
+                    major_revision=major_revision,
+                    revision_sort_key=sort_key_for_revision(major_revision),
+                    change_description=_text(rng, 20),
+                    previous_revision_disposition=_text(rng, 6),
+                    process_purpose_and_scope=_text(rng, 30) if i % spec.process_every == 0 else '',
+                ))
+        DocumentRevision.objects.bulk_create(revisions)
+
+        parts, steps, sections = [], [], []
+        index_of = {pk: n for n, pk in enumerate(self.document_ids[chunk[0]:chunk[-1] + 1], start=chunk[0])}
+        for revision in revisions:
+            i = index_of[revision.document_id]
+            level = i % (spec.bom_depth + 1)
+            if level:
+                below = self.levels[level - 1]
+                for order, part in enumerate(rng.sample(below, min(spec.bom_fan_out, len(below))), start=1):
+                    parts.append(DocumentRevisionInputPart(
+                        document_revision=revision, input_part_id=part, order=order, quantity=rng.randint(1, 10),
+                    ))
+            if i % spec.process_every == 0:
+                steps += [
+                    DocumentRevisionProcessStep(document_revision=revision, order=order, description=_text(rng, 25))
+                    for order in range(1, spec.steps + 1)
+                ]
+            if i % spec.policy_every == 0:
+                sections.append(self._section_tree(revision))
+
+        DocumentRevisionInputPart.objects.bulk_create(parts)
+        DocumentRevisionProcessStep.objects.bulk_create(steps)
+        self._assignments(revisions, steps)
+        self._insert_sections(sections)
+
+    def _assignments(self, revisions, steps):
+        rng = self.rng
+        links = (
+            (DocumentRevision.process_roles.through, 'documentrevision', 'role', revisions, self.roles),
+            (DocumentRevision.process_locations.through, 'documentrevision', 'location', revisions, self.locations),
+            (DocumentRevisionProcessStep.roles.through, 'documentrevisionprocessstep', 'role', steps, self.roles),
+            (DocumentRevisionProcessStep.locations.through, 'documentrevisionprocessstep', 'location', steps, self.locations),
+        )
+        for through, source, target, objects, choices in links:
+            through.objects.bulk_create(
+                through(**{f'{source}_id': obj.pk, f'{target}_id': choice.pk})
+                for obj in objects for choice in rng.sample(choices, min(2, len(choices)))
+            )
+        tags = DocumentRevision.previous_revision_action_tags.through
+        tags.objects.bulk_create(
+            tags(documentrevision_id=revision.pk, documentrevisionpreviousrevisionactiontag_id=rng.choice(self.action_tags).pk)
+            for revision in revisions
+        )
+
+    def _section_tree(self, revision):
+        """Sections of one revision as (section, parent index or None), parents first."""
+        spec, rng = self.spec, self.rng
+        tree, children = [], {}
+        for n in range(spec.sections):
+            candidates = [k for k, (section, _) in enumerate(tree) if section.depth < spec.section_depth - 1]
+            parent = rng.choice(candidates) if candidates and rng.random() < 0.7 else None
+            position = children[parent] = children.get(parent, 0) + 1
+            if parent is None:
+                path, number, depth = f'{position:0{PATH_WIDTH}d}', str(position), 0
+            else:
+                parent_section = tree[parent][0]
+                path = f'{parent_section.path}{PATH_SEPARATOR}{position:0{PATH_WIDTH}d}'
+                number, depth = f'{parent_section.number}.{position}', parent_section.depth + 1
+            tree.append((DocumentRevisionPolicySection(
+                document_revision=revision, order=position, header=_text(rng, 3).title(), text=_text(rng, 60),
+                path=path, depth=depth, number=number,
+            ), parent))
+        return tree
+
+    def _insert_sections(self, trees):
+        # One insert per depth, so every parent has a primary key before its children.
+        for depth in range(self.spec.section_depth):
+            level = []
+            for tree in trees:
+                for section, parent in tree:
+                    if section.depth == depth:
+                        if parent is not None:
+                            section.parent_id = tree[parent][0].pk
+                        level.append(section)
+            DocumentRevisionPolicySection.objects.bulk_create(level)
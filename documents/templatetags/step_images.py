@@ -0,0 +1,28 @@
+from django import template
+from django.utils.html import format_html
+
+from documents import derivatives
+
+register = template.Library()
+
+
+@register.simple_tag
+def step_image_url(step, rendition='screen'):
+    return derivatives.rendition_url(step.image, rendition)
+
+
+@register.simple_tag
+def step_image_srcset(step):
+    return derivatives.srcset(step.image)
+
+
+@register.simple_tag
+def step_image(step, rendition='screen', sizes='100vw'):
+    """An <img> tag that never waits for renditions: missing ones are queued and the original is shown."""
+    if not step.image:
+        return ''
+    srcset = derivatives.srcset(step.image)
+    src = derivatives.rendition_url(step.image, rendition)
+    if srcset:
+        return format_html('<img src="{}" srcset="{}" sizes="{}" alt="" loading="lazy">', src, srcset, sizes)
+    return format_html('<img src="{}" alt="" loading="lazy">', src)
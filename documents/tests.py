@@ -1,3 +1,1741 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from importlib import import_module
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+
+from organization.models import Location, Role, roles
+from tqms.instrumentation import QueryInstrumentationMiddleware, assert_indexed, assert_query_budget, record_queries
+from tqms.routers import ReplicaRouter, read_only_view, replica_iterator, replica_reads
+
+from . import (
+    api, assignments, attachments, benchmarks, bom, clone, control_numbers, derivatives, diff, export, importer, policy_tree,
+    rendering, search, synthetic, validation, views, where_used,
+)
+from .commit_hooks import schedule_once
+from .paginators import EstimatedCountPaginator
+from .models import (
+    ControlNumberSequence, Document, DocumentChange, DocumentPartClosure, DocumentPartLink, DocumentPartReach, DocumentRevision,
+    DocumentRevisionAttachedFile, DocumentRevisionInputPart, DocumentRevisionOutputPart, DocumentRevisionPolicySection,
+    DocumentRevisionPreviousRevisionActionTag, DocumentRevisionProcessStep, DocumentType, FileBlob, ProcessStepAssignment,
+    normalize_device_identifier, sort_key_for_revision,
+)
+from .storage import digest_of
+
+IDS = [1, 2, 3]
+
+# (name, queryset factory, sort allowed). Sorts are allowed where rows of several
+# revisions are merged into one ordering, which no index can produce.
+CANONICAL_QUERIES = [
+    ('document by control number', lambda: Document.objects.filter(control_number='000001'), False),
+    ('documents of a type', lambda: Document.objects.filter(document_type=1).order_by('control_number'), False),
+    ('changes of an owner', lambda: DocumentChange.objects.filter(owner=1).order_by('-pk'), False),
+    ('revisions of a document', lambda: DocumentRevision.objects.filter(document=1).order_by('-revision_sort_key', '-pk'), False),
+    ('effective revisions', lambda: DocumentRevision.objects.effective().filter(document__in=IDS), False),
+    ('revisions of a change', lambda: DocumentRevision.objects.filter(document_change=1), False),
+    ('input parts', lambda: DocumentRevisionInputPart.objects.filter(document_revision=1).order_by('order'), False),
+    ('input parts of revisions', lambda: DocumentRevisionInputPart.objects.filter(document_revision__in=IDS).order_by('order'), True),
+    ('uses of a part', lambda: DocumentRevisionInputPart.objects.filter(input_part=1), False),
+    ('output parts', lambda: DocumentRevisionOutputPart.objects.filter(document_revision=1).order_by('order'), False),
+    ('outputs of a part', lambda: DocumentRevisionOutputPart.objects.filter(output_part=1), False),
+    ('attached files', lambda: DocumentRevisionAttachedFile.objects.filter(document_revision=1).order_by('order'), False),
+    ('process steps', lambda: DocumentRevisionProcessStep.objects.filter(document_revision=1).order_by('order'), False),
+    ('policy outline', lambda: DocumentRevisionPolicySection.objects.filter(document_revision=1).order_by('path'), False),
+    ('policy siblings', lambda: DocumentRevisionPolicySection.objects.filter(document_revision=1, parent=1).order_by('order'), False),
+    ('policy top level', lambda: DocumentRevisionPolicySection.objects.filter(document_revision=1, parent=None).order_by('order'), False),
+    ('part links', lambda: DocumentPartLink.objects.filter(parent__in=IDS), False),
+    ('where used', lambda: DocumentPartClosure.objects.filter(descendant=1), False),
+    ('bill of materials', lambda: DocumentPartClosure.objects.filter(ancestor=1), False),
+    ('work of a role', lambda: ProcessStepAssignment.objects.filter(role=1).values('step'), False),
+    ('work at a location', lambda: ProcessStepAssignment.objects.filter(location=1).values('step'), False),
+    ('work of a role at a location', lambda: ProcessStepAssignment.objects.filter(role=1, location=1).values('step'), False),
+]
+
+
+class QueryPlanTests(TestCase):
+    """The application's hot queries must stay on indexes: no full table scans, no avoidable sorts."""
+
+    def test_canonical_queries_use_indexes(self):
+        for name, queryset, allow_sort in CANONICAL_QUERIES:
+            with self.subTest(name):
+                assert_indexed(queryset(), allow_sort)
+
+
+class CommitHookTests(TestCase):
+    def test_schedule_once_runs_one_batch_on_commit(self):
+        calls = []
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            schedule_once(calls.append, [1, 2])
+            schedule_once(calls.append, [2, 3])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(calls, [{1, 2, 3}])
+
+    def test_rolled_back_batch_is_dropped(self):
+        calls = []
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    schedule_once(calls.append, [1])
+                    raise ValueError
+            except ValueError:
+                pass
+            schedule_once(calls.append, [2])
+        self.assertEqual(calls, [{2}])
+
+
+class DocumentTestCase(TestCase):
+    """Creates documents and revisions with only the fields a test cares about."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='author')
+        cls.document_type = DocumentType.objects.create(display_name='Procedure', code='SOP', description='')
+        cls.change = DocumentChange.objects.create(
+            title='Change', owner=cls.user, reason_for_change='-', description_of_change='-',
+        )
+
+    @contextmanager
+    def committing(self):
+        """
+        Run every on_commit callback the test registered so far at the end of the block,
+        as a commit would. Unlike captureOnCommitCallbacks(), this includes batches that
+        were opened before the block and that later changes joined.
+        """
+        yield
+        while connection.run_on_commit:
+            _, callback, _ = connection.run_on_commit.pop(0)
+            callback()
+
+    def document(self, number):
+        return Document.objects.create(
+            control_number=number, legacy_control_number=f'L-{number}', document_type=self.document_type,
+        )
+
+    def revision(self, document, major_revision='A', **fields):
+        fields = {
+            'title': f'{document.control_number} {major_revision}', 'change_description': '-',
+            'previous_revision_disposition': '-', **fields,
+        }
+        return DocumentRevision.objects.create(
+            document=document, document_change=self.change, major_revision=major_revision, **fields,
+        )
+
+
+class PolicyTreeTests(DocumentTestCase):
+    def setUp(self):
+        self.revision_ = self.revision(self.document('P1'))
+
+    def section(self, header, order, parent=None):
+        return DocumentRevisionPolicySection.objects.create(
+            document_revision=self.revision_, parent=parent, order=order, header=header, text='-',
+        )
+
+    def outline(self):
+        return [(s.number, s.header) for s in policy_tree.section_tree(self.revision_)]
+
+    def test_appended_sections_are_numbered_at_once(self):
+        a = self.section('a', 1)
+        a1 = self.section('a1', 1, a)
+        a2 = self.section('a2', 2, a)
+        self.section('b', 2)
+        self.assertEqual(self.outline(), [('1', 'a'), ('1.1', 'a1'), ('1.2', 'a2'), ('2', 'b')])
+        self.assertEqual((a2.path, a2.depth, a2.number), ('000001.000002', 1, '1.2'))
+        self.assertEqual([s.header for s in policy_tree.subtree(a)], ['a1', 'a2'])
+        self.assertEqual(list(policy_tree.subtree(a1)), [])
+
+    def test_inserted_section_renumbers_siblings_and_subtrees_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            a = self.section('a', 2)
+            self.section('a1', 1, a)
+            self.section('z', 1)
+        self.assertEqual(self.outline(), [('1', 'z'), ('2', 'a'), ('2.1', 'a1')])
+
+    def test_deleted_section_renumbers_on_commit(self):
+        a = self.section('a', 1)
+        b = self.section('b', 2)
+        self.section('b1', 1, b)
+        with self.captureOnCommitCallbacks(execute=True):
+            a.delete()
+        self.assertEqual(self.outline(), [('1', 'b'), ('1.1', 'b1')])
+
+    def test_reordering_keeps_the_parent(self):
+        a = self.section('a', 1)
+        c1 = self.section('c1', 1, a)
+        c2 = self.section('c2', 2, a)
+        policy_tree.move_section(c2, order=0)
+        c2.refresh_from_db()
+        self.assertEqual((c2.parent_id, c2.number), (a.pk, '1.1'))
+        self.assertEqual(self.outline(), [('1', 'a'), ('1.1', 'c2'), ('1.2', 'c1')])
+        policy_tree.reorder_sections([c1, c2])
+        self.assertEqual(self.outline(), [('1', 'a'), ('1.1', 'c1'), ('1.2', 'c2')])
+
+    def test_moving_takes_the_subtree_along(self):
+        a = self.section('a', 1)
+        b = self.section('b', 2)
+        b1 = self.section('b1', 1, b)
+        self.section('b1x', 1, b1)
+        policy_tree.move_section(b, parent=a, order=1)
+        self.assertEqual(self.outline(), [('1', 'a'), ('1.1', 'b'), ('1.1.1', 'b1'), ('1.1.1.1', 'b1x')])
+        policy_tree.move_section(b1, parent=None, order=5)
+        self.assertEqual(self.outline(), [('1', 'a'), ('1.1', 'b'), ('2', 'b1'), ('2.1', 'b1x')])
+
+    def test_moves_drop_the_rendering(self):
+        cache.clear()
+        a = self.section('a', 1)
+        b = self.section('b', 2)
+
+        def headers():
+            _, body = rendering.render_revision(self.revision_.pk)
+            return re.findall(r'<h3 class="h6">\S+ (\w+)</h3>', body)
+
+        self.assertEqual(headers(), ['a', 'b'])
+        with self.committing():
+            policy_tree.move_section(b, order=0)
+        self.assertEqual(headers(), ['b', 'a'])
+        with self.committing():
+            policy_tree.reorder_sections([a, b])
+        self.assertEqual(headers(), ['a', 'b'])
+
+    def test_moving_under_own_subsection_is_rejected(self):
+        a = self.section('a', 1)
+        a1 = self.section('a1', 1, a)
+        with self.assertRaises(ValidationError):
+            policy_tree.move_section(a, parent=a1)
+        other = DocumentRevisionPolicySection.objects.create(
+            document_revision=self.revision(self.revision_.document, 'B'), order=1, header='other', text='-',
+        )
+        with self.assertRaises(ValidationError):
+            policy_tree.move_section(a1, parent=other)
+
+
+class StructureValidationTests(DocumentTestCase):
+    def setUp(self):
+        self.a, self.b, self.c = (self.document(number) for number in ('A', 'B', 'C'))
+        self.revisions = {document: self.revision(document) for document in (self.a, self.b, self.c)}
+
+    def link(self, document, part, revision=None):
+        # Validated like a form save; plain saves are not checked.
+        link = DocumentRevisionInputPart(document_revision=revision or self.revisions[document], input_part=part, order=1)
+        link.full_clean()
+        link.save()
+        return link
+
+    def test_direct_cycle_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.link(self.a, self.a)
+        self.link(self.a, self.b)
+        with self.assertRaises(ValidationError):
+            self.link(self.b, self.a)
+
+    def test_indirect_cycle_is_rejected(self):
+        self.link(self.a, self.b)
+        self.link(self.b, self.c)
+        with self.assertRaises(ValidationError):
+            self.link(self.c, self.a)
+        with self.assertRaises(ValidationError):
+            DocumentRevisionOutputPart(document_revision=self.revisions[self.c], output_part=self.a, order=1).full_clean()
+
+    def test_cycle_through_a_superseded_revision_is_rejected(self):
+        # A revision A uses B; A revision B, now effective, does not.
+        self.link(self.a, self.b)
+        newer = self.revision(self.a, 'B')
+        self.assertFalse(DocumentPartClosure.objects.filter(ancestor=self.a, descendant=self.b).exists())
+        self.assertTrue(DocumentPartReach.objects.filter(ancestor=self.a, descendant=self.b).exists())
+        # The unique check, the revision's document and one lookup in the reach index.
+        with assert_query_budget(3):
+            with self.assertRaises(ValidationError):
+                self.link(self.b, self.a)
+        # Had it been accepted, deleting the newer revision would have brought the loop back.
+        newer.delete()
+        self.assertTrue(DocumentPartClosure.objects.filter(ancestor=self.a, descendant=self.b).exists())
+        self.assertEqual(validation.audit(), [])
+
+    def test_batch_cycles(self):
+        a, b, c = self.a.pk, self.b.pk, self.c.pk
+        self.assertEqual(validation.part_cycles([(a, b), (b, c)]), set())
+        self.assertEqual(validation.part_cycles([(a, b), (b, a), (b, c)]), {(a, b), (b, a)})
+        self.link(self.c, self.a)
+        self.assertEqual(validation.part_cycles([(a, b), (b, c)]), {(a, b), (b, c)})
+
+    def test_audit_reports_links_the_index_skipped(self):
+        self.link(self.a, self.b)
+        # bulk_create skips the validation, as a raw import would.
+        DocumentRevisionInputPart.objects.bulk_create([
+            DocumentRevisionInputPart(document_revision=self.revisions[self.b], input_part=self.a, order=1),
+        ])
+        self.assertEqual(where_used.sync_documents([self.b.pk]), [(self.b.pk, self.a.pk)])
+        problems = validation.audit()
+        self.assertEqual({problem.kind for problem in problems}, {'part cycle', 'where-used'})
+        messages = [problem.message for problem in problems]
+        self.assertIn('B -> A is missing from the where-used index.', messages)
+        self.assertIn('B -> A is missing from the part reach index.', messages)
+
+    def test_reach_index_follows_link_and_revision_deletion(self):
+        older = self.link(self.a, self.b)
+        self.link(self.b, self.c)
+        newer = self.revision(self.a, 'B')
+        reach = lambda: set(DocumentPartReach.objects.values_list('ancestor__control_number', 'descendant__control_number'))
+        self.assertEqual(reach(), {('A', 'B'), ('A', 'C'), ('B', 'C')})
+        newer.delete()
+        older.delete()
+        self.assertEqual(reach(), {('B', 'C')})
+        self.link(self.c, self.a)
+        self.revisions[self.b].delete()
+        self.assertEqual(reach(), {('C', 'A')})
+        self.assertEqual(validation.where_used_problems(), [])
+
+    def test_policy_parent_loops_are_rejected(self):
+        revision = self.revisions[self.a]
+        a = DocumentRevisionPolicySection.objects.create(document_revision=revision, order=1, header='a', text='-')
+        a1 = DocumentRevisionPolicySection.objects.create(document_revision=revision, parent=a, order=1, header='a1', text='-')
+        a1x = DocumentRevisionPolicySection.objects.create(document_revision=revision, parent=a1, order=1, header='a1x', text='-')
+        a.parent = a
+        with self.assertRaises(ValidationError):
+            a.save()
+        a.parent = a1x
+        with self.assertRaises(ValidationError):
+            a.save()
+        a.parent = DocumentRevisionPolicySection.objects.create(
+            document_revision=self.revisions[self.b], order=1, header='b', text='-',
+        )
+        with self.assertRaises(ValidationError):
+            a.full_clean()
+
+        DocumentRevisionPolicySection.objects.filter(pk=a.pk).update(parent=a1x)
+        problems = validation.policy_tree_problems()
+        self.assertEqual([(problem.kind, sorted(problem.ids)) for problem in problems], [('policy cycle', sorted([a.pk, a1.pk, a1x.pk]))])
+
+
+class BOMTests(DocumentTestCase):
+    def setUp(self):
+        self.top, self.sub, self.screw, self.plate = (self.document(n) for n in ('TOP', 'SUB', 'SCREW', 'PLATE'))
+        self.revisions = {document: self.revision(document) for document in (self.top, self.sub, self.screw)}
+        self.use(self.top, self.sub, 2, order=1)
+        self.use(self.top, self.screw, 3, order=2)
+        self.use(self.sub, self.screw, 4, order=1)
+        self.use(self.sub, self.plate, 1, order=2)
+
+    def use(self, document, part, quantity, order=1):
+        DocumentRevisionInputPart.objects.create(
+            document_revision=self.revisions[document], input_part=part, quantity=quantity, order=order,
+        )
+
+    def test_nested_quantities(self):
+        tree = bom.explode(self.top)
+        self.assertEqual(tree.revision, self.revisions[self.top])
+        self.assertEqual(
+            [(line.depth, line.document.control_number, line.quantity, line.total_quantity) for line in tree.walk()],
+            [(1, 'SUB', 2, 2), (2, 'SCREW', 4, 8), (2, 'PLATE', 1, 2), (1, 'SCREW', 3, 3)],
+        )
+
+    def test_totals_roll_up_leaf_parts(self):
+        self.assertEqual(bom.explode(self.top).totals(), {self.screw: 11, self.plate: 2})
+
+    def test_part_without_effective_revision_is_a_leaf(self):
+        plate = next(line for line in bom.explode(self.top).walk() if line.document == self.plate)
+        self.assertIsNone(plate.revision)
+        self.assertEqual(plate.children, [])
+
+    def test_cycle_is_reported(self):
+        # Saved through bulk_create, which skips the cycle validation.
+        DocumentRevisionInputPart.objects.bulk_create([
+            DocumentRevisionInputPart(document_revision=self.revisions[self.screw], input_part=self.sub, order=1),
+        ])
+        with self.assertRaisesMessage(bom.BOMError, 'uses itself as a part'):
+            bom.explode(self.top)
+
+    def test_depth_limit_is_reported(self):
+        self.assertEqual(len(list(bom.explode(self.top, max_depth=2).walk())), 4)
+        with self.assertRaises(bom.BOMError) as raised:
+            bom.explode(self.top, max_depth=1)
+        self.assertEqual(raised.exception.documents[:2], [self.top, self.sub])
+
+
+class WhereUsedTests(DocumentTestCase):
+    def setUp(self):
+        # A diamond: TOP uses LEFT and RIGHT, which both use BASE, which uses RAW.
+        self.top, self.left, self.right, self.base, self.raw = (
+            self.document(n) for n in ('TOP', 'LEFT', 'RIGHT', 'BASE', 'RAW')
+        )
+        self.revisions = {
+            document: self.revision(document) for document in (self.top, self.left, self.right, self.base)
+        }
+        self.inputs = {
+            (parent, child): DocumentRevisionInputPart.objects.create(
+                document_revision=self.revisions[parent], input_part=child, order=order,
+            )
+            for order, (parent, child) in enumerate([
+                (self.top, self.left), (self.top, self.right), (self.left, self.base), (self.right, self.base),
+                (self.base, self.raw),
+            ])
+        }
+
+    def closure(self):
+        return {
+            (row.ancestor.control_number, row.descendant.control_number): row.path_count
+            for row in DocumentPartClosure.objects.select_related('ancestor', 'descendant')
+        }
+
+    def links(self):
+        return set(DocumentPartLink.objects.values_list('parent__control_number', 'child__control_number'))
+
+    def assert_rebuild_agrees(self):
+        closure, links = self.closure(), self.links()
+        where_used.rebuild()
+        self.assertEqual(self.closure(), closure)
+        self.assertEqual(self.links(), links)
+        self.assertEqual(validation.where_used_problems(), [])
+
+    def test_paths_are_counted_across_the_diamond(self):
+        closure = self.closure()
+        self.assertEqual(closure[('TOP', 'BASE')], 2)
+        self.assertEqual(closure[('TOP', 'RAW')], 2)
+        self.assertEqual(closure[('LEFT', 'RAW')], 1)
+        self.assertEqual(set(where_used.where_used([self.raw])), {self.top, self.left, self.right, self.base})
+        self.assert_rebuild_agrees()
+
+    def test_removing_one_path_keeps_the_other(self):
+        self.inputs[self.left, self.base].delete()
+        closure = self.closure()
+        self.assertEqual(closure[('TOP', 'BASE')], 1)
+        self.assertEqual(closure[('TOP', 'RAW')], 1)
+        self.assertNotIn(('LEFT', 'BASE'), closure)
+        self.assertNotIn(('LEFT', 'RAW'), closure)
+        self.assert_rebuild_agrees()
+
+        self.inputs[self.right, self.base].delete()
+        self.assertEqual(set(where_used.where_used([self.base])), set())
+        self.assert_rebuild_agrees()
+
+    def test_output_parts_and_new_revisions_are_followed(self):
+        DocumentRevisionOutputPart.objects.create(document_revision=self.revisions[self.top], output_part=self.raw, order=1)
+        self.assertEqual(self.closure()[('TOP', 'RAW')], 3)
+        # The next revision of LEFT no longer uses BASE.
+        self.revision(self.left, 'B')
+        self.assertEqual(self.closure()[('TOP', 'RAW')], 2)
+        self.assert_rebuild_agrees()
+
+    def test_deleting_a_document_detaches_it(self):
+        self.right.delete()
+        closure = self.closure()
+        self.assertEqual(closure[('TOP', 'BASE')], 1)
+        self.assertFalse(any('RIGHT' in pair for pair in closure))
+        self.assert_rebuild_agrees()
+
+        self.base.delete()
+        self.assertEqual(self.closure(), {('TOP', 'LEFT'): 1})
+        self.assert_rebuild_agrees()
+
+
+class QueryBudgetTests(DocumentTestCase):
+    """Page and API queries stay within a fixed budget, whatever the size of the revision."""
+
+    def setUp(self):
+        cache.clear()
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+        document = self.document('TOP')
+        self.old = self.revision(document, 'A')
+        self.new = self.revision(document, 'B')
+        for order in range(5):
+            part = self.document(f'PART{order}')
+            self.revision(part)
+            DocumentRevisionInputPart.objects.create(document_revision=self.new, input_part=part, order=order)
+            DocumentRevisionProcessStep.objects.create(document_revision=self.new, order=order, description='Step')
+            DocumentRevisionPolicySection.objects.create(document_revision=self.new, order=order, header='Section', text='-')
+
+    def aget(self, url, **headers):
+        return async_to_sync(self.async_client.get)(url, headers=headers)
+
+    def test_revision_detail(self):
+        url = f'/documents/revisions/{self.new.pk}/'
+        with assert_query_budget(13):
+            self.assertEqual(self.aget(url).status_code, 200)
+        # Session and user only: the rendering comes from the cache.
+        with assert_query_budget(2):
+            self.assertEqual(self.aget(url).status_code, 200)
+
+    def test_revision_body(self):
+        url = f'/documents/revisions/{self.new.pk}/body/'
+        with assert_query_budget(13):
+            response = self.aget(url)
+        with assert_query_budget(2):
+            self.assertEqual(self.aget(url, if_none_match=response['ETag']).status_code, 304)
+
+    def test_revision_diff(self):
+        with assert_query_budget(13):
+            response = self.client.get(f'/documents/revisions/{self.old.pk}/diff/{self.new.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_api(self):
+        with assert_query_budget(5):
+            self.assertEqual(self.client.get('/api/v1/revisions/?include=document,input_parts').status_code, 200)
+        with assert_query_budget(4):
+            self.assertEqual(self.client.get('/api/v1/documents/?include=effective_revision').status_code, 200)
+        with assert_query_budget(3):
+            response = self.client.get('/api/v1/device-identifiers/resolve/?identifier=00844588003288&identifier=x')
+        self.assertEqual(response.status_code, 200)
+
+    def test_budget_overrun_fails(self):
+        with self.assertRaisesMessage(AssertionError, 'Query budget of 1 exceeded'):
+            with assert_query_budget(1):
+                list(Document.objects.all())
+                list(DocumentRevision.objects.all())
+
+
+class APITests(DocumentTestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.documents = [self.document(f'DOC-{number}') for number in range(1, 6)]
+        self.revisions = [self.revision(document) for document in self.documents]
+        DocumentRevisionInputPart.objects.create(
+            document_revision=self.revisions[0], input_part=self.documents[1], order=1, quantity=2,
+        )
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_cursor_pagination_walks_every_row_once(self):
+        url, ids, pages = '/api/v1/documents/?limit=2&fields=control_number', [], 0
+        while url:
+            body = self.get(url).json()
+            ids += [row['id'] for row in body['data']]
+            url, pages = body['next'], pages + 1
+        self.assertEqual(ids, [document.pk for document in self.documents])
+        self.assertEqual(pages, 3)
+        self.assertEqual(self.get('/api/v1/documents/?cursor=@@').status_code, 400)
+
+    def test_sparse_fields(self):
+        rows = self.get('/api/v1/documents/?fields=control_number&document_type=SOP').json()['data']
+        self.assertEqual(rows[0], {'id': self.documents[0].pk, 'control_number': 'DOC-1'})
+        self.assertEqual(self.get('/api/v1/documents/?fields=secret').status_code, 400)
+
+    def test_include_side_loads_relations(self):
+        body = self.get(
+            f'/api/v1/revisions/?document={self.documents[0].pk}&include=document,input_parts'
+            '&fields[documents]=control_number',
+        ).json()
+        self.assertEqual(body['included']['documents'], [{'id': self.documents[0].pk, 'control_number': 'DOC-1'}])
+        part, = body['included']['input-parts']
+        self.assertEqual((part['revision'], part['part'], part['quantity']), (self.revisions[0].pk, self.documents[1].pk, 2))
+        self.assertEqual(self.get('/api/v1/revisions/?include=secret').status_code, 400)
+        self.assertEqual(self.get('/api/v1/revisions/?fields=title&include=document').status_code, 400)
+
+    def test_conditional_get(self):
+        url = '/api/v1/documents/?limit=2'
+        response = self.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.get(url, if_none_match=etag).status_code, 304)
+        self.assertNotEqual(self.get('/api/v1/documents/?limit=3')['ETag'], etag)
+
+        with self.committing():
+            self.revision(self.documents[0], 'B')
+        response = self.get(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class AsyncRevisionViewTests(DocumentTestCase):
+    def setUp(self):
+        cache.clear()
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+        self.part = self.document('PART')
+        self.top = self.revision(self.document('TOP'))
+        DocumentRevisionInputPart.objects.create(document_revision=self.top, input_part=self.part, order=1, quantity=7)
+        DocumentRevisionOutputPart.objects.create(document_revision=self.top, output_part=self.part, order=1)
+        for order in (2, 1):
+            DocumentRevisionProcessStep.objects.create(document_revision=self.top, order=order, description=f'Step {order}')
+            DocumentRevisionPolicySection.objects.create(
+                document_revision=self.top, order=order, header=f'Header {order}', text='-',
+            )
+
+    def aget(self, url, **headers):
+        return async_to_sync(self.async_client.get)(url, headers=headers)
+
+    def test_views_are_async(self):
+        self.assertTrue(iscoroutinefunction(views.revision_detail))
+        self.assertTrue(iscoroutinefunction(views.revision_body))
+
+    def test_concurrent_load_matches_the_prefetching_queryset(self):
+        loaded = async_to_sync(rendering.aload_revision)(self.top.pk)
+        prefetched = rendering.revision_queryset().get(pk=self.top.pk)
+        self.assertEqual(loaded, prefetched)
+        for to_attr in ('input_parts', 'output_parts', 'attached_files', 'process_steps', 'policy_sections'):
+            with self.subTest(to_attr):
+                self.assertEqual(getattr(loaded, to_attr), getattr(prefetched, to_attr))
+        self.assertEqual([step.description for step in loaded.process_steps], ['Step 1', 'Step 2'])
+        self.assertEqual(rendering._render(loaded), rendering._render(prefetched))
+
+    def test_revision_detail(self):
+        response = self.aget(f'/documents/revisions/{self.top.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'TOP A')
+        self.assertContains(response, 'Step 2')
+        self.assertContains(response, 'Header 1')
+
+    def test_cache_hit_skips_the_database(self):
+        url = f'/documents/revisions/{self.top.pk}/body/'
+        first = self.aget(url)
+        self.assertIsNotNone(cache.get(rendering.cache_key(self.top.pk)))
+        with mock.patch.object(rendering, 'aload_revision', side_effect=AssertionError('cache missed')):
+            second = self.aget(url)
+        self.assertEqual(second.content, first.content)
+
+    def test_revision_body_etag_follows_changes(self):
+        url = f'/documents/revisions/{self.top.pk}/body/'
+        response = self.aget(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<html')
+        self.assertEqual(self.aget(url, if_none_match=response['ETag']).status_code, 304)
+
+        with self.committing():
+            DocumentRevisionProcessStep.objects.filter(document_revision=self.top, order=1).update(description='Changed')
+            DocumentRevisionProcessStep.objects.get(document_revision=self.top, order=1).save()
+            # Until the change commits, the cached rendering is still served.
+            self.assertEqual(self.aget(url, if_none_match=response['ETag']).status_code, 304)
+        changed = self.aget(url, if_none_match=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'Changed')
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_missing_revision_and_anonymous_user(self):
+        for url in ('/documents/revisions/0/', '/documents/revisions/0/body/'):
+            with self.subTest(url):
+                self.assertEqual(self.aget(url).status_code, 404)
+        response = async_to_sync(AsyncClient().get)(f'/documents/revisions/{self.top.pk}/')
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(QUERY_INSTRUMENTATION=True)
+class QueryInstrumentationTests(DocumentTestCase):
+    def setUp(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.revision_ = self.revision(self.document('DOC'))
+
+    def test_middleware_follows_the_handler(self):
+        async def async_view(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(QueryInstrumentationMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(QueryInstrumentationMiddleware(lambda request: None)))
+
+    def test_async_view_queries_are_recorded(self):
+        client = AsyncClient()
+        client.force_login(self.user)
+        with record_queries() as recorder:
+            response = async_to_sync(client.get)(f'/documents/revisions/{self.revision_.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(re.search(r'desc="(\d+) queries"', response['Server-Timing'])[1], str(recorder.count))
+
+    def test_streaming_response_queries_are_recorded(self):
+        client = Client()
+        client.force_login(self.user)
+        with self.assertLogs('tqms.queries', 'INFO') as logs, record_queries() as recorder:
+            response = client.get('/documents/register/export/')
+            self.assertEqual(logs.records, [])
+            b''.join(response.streaming_content)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(logs.records[-1].query_summary['queries'], recorder.count)
+
+
+# Prints the database and cache settings tqms.settings derives from the environment.
+SETTINGS_PROBE = """
+import json
+from tqms import settings
+print(json.dumps({
+    'databases': {alias: {key: str(value) for key, value in db.items()} for alias, db in settings.DATABASES.items()},
+    'cache': settings.CACHES['default']['BACKEND'],
+}))
+"""
+
+
+class DatabaseRoutingTests(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.enterContext(mock.patch.dict(settings.DATABASES, {'replica': {}}))
+
+    def test_reads_use_the_replica_only_inside_replica_reads(self):
+        self.assertIsNone(self.router.db_for_read(Document))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Document), 'replica')
+            self.assertEqual(self.router.db_for_write(Document), 'default')
+        self.assertIsNone(self.router.db_for_read(Document))
+
+        del settings.DATABASES['replica']
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(Document))
+
+    def test_cache_table_reads_stay_on_the_default_database(self):
+        cache_entry = DatabaseCache('tqms_cache', {}).cache_model_class
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(cache_entry))
+
+    def test_migrations_skip_the_replica(self):
+        self.assertTrue(self.router.allow_migrate('default', 'documents'))
+        self.assertFalse(self.router.allow_migrate('replica', 'documents'))
+
+    def test_read_only_views_and_streams(self):
+        def view(request):
+            return self.router.db_for_read(Document)
+
+        async def async_view(request):
+            return self.router.db_for_read(Document)
+
+        self.assertEqual(read_only_view(view)(None), 'replica')
+        self.assertTrue(iscoroutinefunction(read_only_view(async_view)))
+        self.assertEqual(async_to_sync(read_only_view(async_view))(None), 'replica')
+
+        # A streamed body is consumed after the view returned; each item is still read from the replica.
+        stream = replica_iterator(self.router.db_for_read(Document) for _ in range(2))
+        self.assertEqual(list(stream), ['replica', 'replica'])
+        self.assertIsNone(self.router.db_for_read(Document))
+
+    def probe(self, **environ):
+        env = {key: value for key, value in os.environ.items() if not key.startswith('TQMS_')}
+        result = subprocess.run(
+            [sys.executable, '-c', SETTINGS_PROBE], cwd=settings.BASE_DIR, env={**env, **environ},
+            capture_output=True, text=True,
+        )
+        if result.returncode:
+            return result.stderr
+        return json.loads(result.stdout)
+
+    def test_settings_follow_the_environment(self):
+        sqlite = self.probe(TQMS_DATABASE_REPLICA_NAME='/tmp/replica.sqlite3')
+        self.assertEqual(set(sqlite['databases']), {'default', 'replica'})
+        self.assertIn("'transaction_mode': 'IMMEDIATE'", sqlite['databases']['default']['OPTIONS'])
+        self.assertIn("'transaction_mode': 'DEFERRED'", sqlite['databases']['replica']['OPTIONS'])
+        self.assertEqual(sqlite['databases']['replica']['TEST'], "{'MIRROR': 'default'}")
+        self.assertEqual(sqlite['cache'], 'django.core.cache.backends.locmem.LocMemCache')
+
+        postgres = self.probe(
+            TQMS_DATABASE_PROFILE='postgresql', TQMS_DATABASE_REPLICA_HOST='replica.example', TQMS_CACHE_BACKEND='redis',
+        )
+        default, replica = postgres['databases']['default'], postgres['databases']['replica']
+        self.assertEqual(default['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((default['OPTIONS'], default['CONN_MAX_AGE']), ("{'pool': True}", '0'))
+        self.assertEqual((replica['HOST'], replica['NAME']), ('replica.example', default['NAME']))
+        self.assertEqual(postgres['cache'], 'django.core.cache.backends.redis.RedisCache')
+
+        unpooled = self.probe(TQMS_DATABASE_PROFILE='postgresql', TQMS_DATABASE_POOL='0')['databases']
+        self.assertEqual(set(unpooled), {'default'})
+        self.assertEqual((unpooled['default']['OPTIONS'], unpooled['default']['CONN_MAX_AGE']), ('{}', '60'))
+
+        self.assertIn('Unknown TQMS_DATABASE_PROFILE "mysql"', self.probe(TQMS_DATABASE_PROFILE='mysql'))
+        self.assertIn('Unknown TQMS_CACHE_BACKEND "disk"', self.probe(TQMS_CACHE_BACKEND='disk'))
+
+
+class ControlNumberTests(DocumentTestCase):
+    def test_prefix_and_padding(self):
+        ControlNumberSequence.objects.create(document_type=self.document_type, prefix='SOP-', padding=4)
+        self.assertEqual(control_numbers.allocate(self.document_type.pk), ['SOP-0001'])
+        document = Document.objects.create(legacy_control_number='L-1', document_type=self.document_type)
+        self.assertEqual(document.control_number, 'SOP-0002')
+
+    def test_bulk_reservation_is_consecutive(self):
+        self.assertEqual(control_numbers.allocate(self.document_type.pk, 3), ['000001', '000002', '000003'])
+        self.assertEqual(control_numbers.allocate(self.document_type.pk, 2), ['000004', '000005'])
+
+    def test_first_use_continues_after_numbers_assigned_by_hand(self):
+        for number in ('000041', '000007', 'OLD-99', '00012A'):
+            self.document(number)
+        self.assertEqual(control_numbers.allocate(self.document_type.pk), ['000042'])
+
+    def test_numbers_assigned_by_hand_are_skipped(self):
+        self.assertEqual(control_numbers.allocate(self.document_type.pk), ['000001'])
+        self.document('000003')
+        self.document('000009')
+        # 3 is taken, so the counter jumps past the highest number assigned by hand.
+        self.assertEqual(control_numbers.allocate(self.document_type.pk, 3), ['000002', '000004', '000010'])
+        self.assertEqual(ControlNumberSequence.objects.get(pk=self.document_type.pk).next_value, 11)
+
+    def test_types_with_the_same_prefix_share_the_number_space(self):
+        work_instruction = DocumentType.objects.create(display_name='Work instruction', code='WI', description='')
+        self.document('000005')
+        self.assertEqual(control_numbers.allocate(self.document_type.pk, 2), ['000006', '000007'])
+        self.assertEqual(control_numbers.allocate(work_instruction.pk), ['000008'])
+        self.assertEqual(control_numbers.allocate(self.document_type.pk), ['000009'])
+
+        ControlNumberSequence.objects.filter(pk=work_instruction.pk).update(prefix='WI-')
+        self.assertEqual(control_numbers.allocate(work_instruction.pk), ['WI-000008'])
+        self.assertEqual(control_numbers.allocate(self.document_type.pk), ['000010'])
+
+    def test_numbers_are_compared_numerically(self):
+        ControlNumberSequence.objects.create(document_type=self.document_type, prefix='X', padding=1, next_value=9)
+        self.document('X9')
+        self.document('X10')
+        self.assertEqual(control_numbers.allocate(self.document_type.pk), ['X11'])
+        self.assertEqual(ControlNumberSequence.objects.get(pk=self.document_type.pk).next_value, 12)
+
+
+class ParallelControlNumberTests(TransactionTestCase):
+    def test_parallel_callers_get_distinct_numbers(self):
+        document_type = DocumentType.objects.create(display_name='Procedure', code='SOP', description='')
+        control_numbers.allocate(document_type.pk)
+        allocated, errors = [], []
+
+        def allocate():
+            try:
+                for _ in range(10):
+                    allocated.extend(control_numbers.allocate(document_type.pk, 3))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=allocate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(allocated), 240)
+        self.assertEqual(len(set(allocated)), 240)
+
+
+# Run by another interpreter, as a second worker sharing the cache and the database.
+OTHER_WORKER = """
+import django
+django.setup()
+from documents import api, rendering
+from organization.models import Role
+Role.objects.create(name='Inspector')
+api.mark_changed()
+rendering.invalidate([1])
+"""
+
+
+class SharedCacheTests(TransactionTestCase):
+    def other_worker(self, location):
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'tqms.settings',
+            'TQMS_CACHE_BACKEND': 'file',
+            'TQMS_CACHE_LOCATION': location,
+            'TQMS_DATABASE_NAME': str(connection.settings_dict['NAME']),
+        }
+        connection.close()
+        subprocess.run(
+            [sys.executable, '-c', OTHER_WORKER], cwd=settings.BASE_DIR, env=env, check=True, capture_output=True,
+        )
+
+    def test_invalidation_reaches_other_processes(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location.name}
+        with override_settings(CACHES={'default': backend}):
+            Role.objects.create(name='Operator')
+            self.assertEqual([role.name for role in roles.all()], ['Operator'])
+            before = api.generation()
+            cache.set(rendering.cache_key(1), '<p>A</p>', None)
+
+            self.other_worker(location.name)
+
+            self.assertEqual(roles.get(name='Inspector').name, 'Inspector')
+            self.assertNotEqual(api.generation(), before)
+            self.assertIsNone(cache.get(rendering.cache_key(1)))
+
+
+class EffectiveRevisionTests(DocumentTestCase):
+    def test_revisions_sort_naturally(self):
+        for lower, higher in [('9', '10'), ('Z', 'AA'), ('B.2', 'B.10'), ('B', 'B.1'), ('A9', 'A10'), ('09', '10')]:
+            with self.subTest(lower=lower, higher=higher):
+                self.assertLess(sort_key_for_revision(lower), sort_key_for_revision(higher))
+        self.assertEqual(sort_key_for_revision('b-01'), sort_key_for_revision('B1'))
+
+    def effective(self, document):
+        document.refresh_from_db()
+        return document.effective_revision
+
+    def test_pointer_follows_added_and_deleted_revisions(self):
+        document = self.document('DOC')
+        self.assertIsNone(self.effective(document))
+        nine = self.revision(document, '9')
+        ten = self.revision(document, '10')
+        self.assertEqual(self.effective(document), ten)
+        # An older revision added later does not take over.
+        self.revision(document, '2')
+        self.assertEqual(self.effective(document), ten)
+        ten.delete()
+        self.assertEqual(self.effective(document), nine)
+        self.assertEqual(list(DocumentRevision.objects.effective()), [nine])
+
+    def test_stale_document_does_not_overwrite_derived_fields(self):
+        document = self.document('DOC')
+        stale = Document.objects.get(pk=document.pk)
+        revision = self.revision(document, 'A', finished_device='SHIPPABLE', device_identifier_number='(01)00844588003288')
+        stale.legacy_control_number = 'L-RENAMED'
+        stale.save()
+        document.refresh_from_db()
+        self.assertEqual(document.legacy_control_number, 'L-RENAMED')
+        self.assertEqual(document.effective_revision, revision)
+        self.assertEqual(document.device_identifier, '00844588003288')
+
+
+class DeviceIdentifierTests(DocumentTestCase):
+    GTIN = '00844588003288'
+
+    def test_normalization(self):
+        cases = {
+            '00844588003288': self.GTIN,
+            '(01)00844588003288': self.GTIN,
+            '(01)00844588003288(17)251231(10)LOT1': self.GTIN,
+            '0100844588003288': self.GTIN,
+            '01008445880032881725123110LOT1': self.GTIN,
+            ']C101008445880032881725123110LOT1': self.GTIN,
+            ']d20100844588003288': self.GTIN,
+            ' 0084 4588\t003288 ': self.GTIN,
+            '844588003288': self.GTIN,
+            '0844588003288': self.GTIN,
+            '12345670': '00000012345670',
+            'hibc-123': 'HIBC-123',
+            '1234567': '1234567',
+        }
+        for value, normalized in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(normalize_device_identifier(value), normalized)
+
+    def shippable(self, number, device_identifier_number):
+        return self.revision(
+            self.document(number), finished_device='SHIPPABLE', device_identifier_number=device_identifier_number,
+        )
+
+    def test_bulk_resolve(self):
+        revision = self.shippable('DEVICE', '(01)00844588003288')
+        self.client.force_login(self.user)
+        url = '/api/v1/device-identifiers/resolve/'
+        identifiers = ['01008445880032881725123110LOT1', '844588003288', '00000000000000']
+        response = self.client.post(url, {'identifiers': identifiers}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(set(data), set(identifiers))
+        self.assertIsNone(data['00000000000000'])
+        for identifier in identifiers[:2]:
+            self.assertEqual(data[identifier]['document_id'], revision.document_id)
+            self.assertEqual(data[identifier]['revision_id'], revision.pk)
+            self.assertEqual(data[identifier]['device_identifier'], self.GTIN)
+
+        for payload in ({'identifiers': 'x'}, {'identifiers': [1]}, {}):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.client.post(url, payload, content_type='application/json').status_code, 400)
+        self.assertEqual(Client().post(url, {'identifiers': []}, content_type='application/json').status_code, 401)
+
+    def test_oversized_bulk_request_is_rejected_before_resolving(self):
+        self.client.force_login(self.user)
+        identifiers = ['844588003288'] * (api.MAX_LIMIT + 1)
+        with mock.patch('documents.udi.resolve') as resolve:
+            response = self.client.post(
+                '/api/v1/device-identifiers/resolve/', {'identifiers': identifiers}, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 400)
+        resolve.assert_not_called()
+
+    def test_only_current_revisions_must_have_distinct_identifiers(self):
+        self.shippable('FIRST', self.GTIN)
+        second = self.document('SECOND')
+        self.revision(second, 'B')
+        superseded = DocumentRevision(
+            document=second, document_change=self.change, major_revision='A',
+            finished_device='SHIPPABLE', device_identifier_number=self.GTIN,
+        )
+        superseded.clean()
+        current = DocumentRevision(
+            document=second, document_change=self.change, major_revision='C',
+            finished_device='SHIPPABLE', device_identifier_number=self.GTIN,
+        )
+        with self.assertRaises(ValidationError):
+            current.clean()
+
+    def test_duplicate_saved_without_clean_raises_validation_error(self):
+        self.shippable('FIRST', self.GTIN)
+        with self.assertRaisesMessage(ValidationError, 'another document has this device identifier'):
+            self.shippable('SECOND', '844588003288')
+        # The failed refresh was rolled back to its savepoint; the transaction is still usable.
+        self.assertEqual(Document.objects.get(control_number='FIRST').device_identifier, self.GTIN)
+
+    def test_migration_stops_on_shared_identifiers(self):
+        populate = import_module('documents.migrations.0016_device_identifiers').populate
+        first, second = self.shippable('FIRST', '(01)00844588003288'), self.shippable('SECOND', '')
+        # Shared before the constraint existed: written past the save() that would refresh the document.
+        DocumentRevision.objects.filter(pk=second.pk).update(device_identifier_number='844588003288')
+        Document.objects.update(device_identifier='')
+        with self.assertRaisesMessage(RuntimeError, f'{self.GTIN} is used by FIRST, SECOND'):
+            populate(apps, None)
+
+        DocumentRevision.objects.filter(pk=second.pk).update(device_identifier_number='12345670')
+        populate(apps, None)
+        self.assertEqual(
+            dict(Document.objects.values_list('control_number', 'device_identifier')),
+            {'FIRST': self.GTIN, 'SECOND': '00000012345670'},
+        )
+
+
+class SearchTests(DocumentTestCase):
+    def setUp(self):
+        self.operator, self.line = Role.objects.create(name='Operator'), Location.objects.create(name='Line')
+        self.work_instruction = DocumentType.objects.create(display_name='Work instruction', code='WI', description='')
+        self.titled = self.revision(self.document('CAL-1'), title='Calibration of gauges')
+        self.described = self.revision(self.document('DOC-2'), title='Receiving', change_description='Add calibration step')
+        step_document = Document.objects.create(control_number='DOC-3', document_type=self.work_instruction)
+        self.stepped = self.revision(step_document, title='Torque check')
+        step = DocumentRevisionProcessStep.objects.create(
+            document_revision=self.stepped, order=1, description='Verify calibration sticker',
+        )
+        step.roles.add(self.operator)
+        self.described.process_locations.add(self.line)
+        with self.committing():
+            pass
+
+    def found(self, text, **filters):
+        return [result.revision for result in search.search(text, **filters)]
+
+    def test_ranking_prefers_control_numbers_and_titles(self):
+        results = self.found('calibration')
+        self.assertEqual(results[0], self.titled)
+        self.assertCountEqual(results, [self.titled, self.described, self.stepped])
+        self.assertEqual(self.found('cal-1'), [self.titled])
+
+    def test_every_word_is_a_prefix(self):
+        self.assertCountEqual(self.found('calib'), [self.titled, self.described, self.stepped])
+        self.assertEqual(self.found('calib stick'), [self.stepped])
+        self.assertEqual(self.found('calibration nothing'), [])
+        self.assertEqual(self.found('  -- '), [])
+
+    def test_filters(self):
+        self.assertCountEqual(self.found('calibration', document_type=self.document_type), [self.titled, self.described])
+        self.assertEqual(self.found('calibration', document_type=self.work_instruction), [self.stepped])
+        self.assertEqual(self.found('calibration', role=self.operator), [self.stepped])
+        self.assertEqual(self.found('calibration', location=self.line), [self.described])
+        self.assertEqual(self.found('calibration', limit=1), [self.titled])
+
+    def test_index_follows_changes(self):
+        with self.committing():
+            self.titled.title = 'Gauges'
+            self.titled.save()
+            self.described.delete()
+        self.assertEqual(self.found('calibration'), [self.stepped])
+        self.assertEqual(search.rebuild(), 2)
+        self.assertEqual(self.found('gauges'), [self.titled])
+
+
+class ImporterTests(DocumentTestCase):
+    def revision_record(self, control_number, major_revision):
+        return {
+            'control_number': control_number, 'major_revision': major_revision, 'title': '-',
+            'change_description': '-', 'previous_revision_disposition': '-',
+        }
+
+    def run_import(self, kind, records, **kwargs):
+        return importer.Importer(kind, batch_size=2, document_change=self.change.pk, **kwargs).run(
+            enumerate(records, start=1),
+        )
+
+    def test_existing_and_repeated_records_are_skipped(self):
+        self.document('OLD')
+        stats = self.run_import('documents', [
+            {'control_number': 'OLD', 'document_type': 'SOP'},
+            {'control_number': 'NEW', 'legacy_control_number': 'L-NEW', 'document_type': 'SOP'},
+            {'control_number': 'NEW', 'legacy_control_number': 'L-NEW', 'document_type': 'SOP'},
+            {'legacy_control_number': 'L-X', 'document_type': 'SOP'},
+            {'legacy_control_number': 'L-X', 'document_type': 'SOP'},
+        ])
+        self.assertEqual((stats.read, stats.created, stats.existing), (5, 2, 3))
+        self.assertEqual(Document.objects.count(), 3)
+        self.assertNotEqual(Document.objects.get(legacy_control_number='L-X').control_number, '')
+
+        revisions = [self.revision_record('NEW', major) for major in ('A', 'B', 'A')]
+        stats = self.run_import('revisions', revisions)
+        self.assertEqual((stats.created, stats.existing), (2, 1))
+        self.assertEqual(Document.objects.get(control_number='NEW').effective_revision.major_revision, 'B')
+        stats = self.run_import('revisions', revisions)
+        self.assertEqual((stats.created, stats.existing), (0, 3))
+
+    def test_errors_name_the_record(self):
+        records = [
+            {'control_number': 'A', 'legacy_control_number': 'L-A', 'document_type': 'SOP'},
+            {'control_number': 'B', 'legacy_control_number': 'L-B', 'document_type': 'SOP'},
+            {'control_number': 'C', 'legacy_control_number': 'L-C', 'document_type': 'NOPE'},
+        ]
+        with self.assertRaises(importer.RecordError) as raised:
+            self.run_import('documents', records)
+        self.assertEqual(raised.exception.line, 3)
+        self.assertEqual(str(raised.exception), 'Record 3: Unknown document type "NOPE".')
+        # The failing batch is rolled back; the one before it is kept.
+        self.assertEqual(set(Document.objects.values_list('control_number', flat=True)), {'A', 'B'})
+
+        with self.assertRaisesMessage(importer.RecordError, 'Record 1: "major_revision" is required.'):
+            self.run_import('revisions', [{'control_number': 'A'}])
+
+    def test_database_conflicts_name_the_record(self):
+        self.document('OLD')
+        records = [
+            {'control_number': f'NEW-{number}', 'legacy_control_number': f'L-NEW-{number}', 'document_type': 'SOP'}
+            for number in range(1, 4)
+        ] + [{'control_number': 'CLASH', 'legacy_control_number': 'L-OLD', 'document_type': 'SOP'}]
+        with self.assertRaises(importer.RecordError) as raised:
+            importer.Importer('documents', batch_size=10).run(enumerate(records, start=1))
+        self.assertEqual(raised.exception.line, 4)
+        self.assertIn('Conflicts with existing data', str(raised.exception))
+        self.assertFalse(Document.objects.filter(control_number__startswith='NEW').exists())
+
+        self.revision(self.document('FIRST'), finished_device='SHIPPABLE', device_identifier_number='00844588003288')
+        self.document('SECOND')
+        record = {**self.revision_record('SECOND', 'A'), 'finished_device': 'SHIPPABLE', 'device_identifier_number': '844588003288'}
+        with self.assertRaisesMessage(importer.RecordError, 'Record 1: The current revision of another document'):
+            self.run_import('revisions', [record])
+
+    def test_command_reports_conflicts_without_a_traceback(self):
+        self.document('OLD')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('control_number,legacy_control_number,document_type\nNEW,L-NEW,SOP\nCLASH,L-OLD,SOP\n')
+        self.addCleanup(os.remove, f.name)
+        with self.assertRaisesMessage(CommandError, 'Record 2: Conflicts with existing data'):
+            call_command('import_documents', 'documents', f.name, stdout=io.StringIO())
+
+    def test_dry_run_collects_errors_and_saves_nothing(self):
+        stats = self.run_import('documents', [
+            {'control_number': 'A', 'legacy_control_number': 'L-A', 'document_type': 'SOP'},
+            {'document_type': 'SOP'},
+            {'control_number': 'C', 'legacy_control_number': 'L-C', 'document_type': 'SOP'},
+        ], dry_run=True)
+        self.assertEqual([error.line for error in stats.errors], [2])
+        self.assertEqual(stats.created, 1)
+        self.assertFalse(Document.objects.exists())
+
+    def test_part_cycles_are_rejected_at_their_record(self):
+        for number in ('TOP', 'SUB'):
+            self.revision(self.document(number))
+        with self.assertRaises(importer.RecordError) as raised:
+            self.run_import('input_parts', [
+                {'control_number': 'TOP', 'major_revision': 'A', 'input_part': 'SUB', 'order': 1},
+                {'control_number': 'TOP', 'major_revision': 'A', 'input_part': 'SUB', 'order': 1},
+                {'control_number': 'SUB', 'major_revision': 'A', 'input_part': 'TOP', 'order': 1},
+            ])
+        self.assertEqual(raised.exception.line, 3)
+        self.assertIn('already uses this document', str(raised.exception))
+        self.assertEqual(DocumentRevisionInputPart.objects.count(), 1)
+
+    def test_imported_parts_drop_the_rendering(self):
+        cache.clear()
+        revision = self.revision(self.document('TOP'))
+        self.document('SUB')
+        self.assertNotIn('L-SUB', rendering.render_revision(revision.pk)[1])
+        with self.committing():
+            self.run_import('input_parts', [{'control_number': 'TOP', 'major_revision': 'A', 'input_part': 'SUB', 'order': 1}])
+        self.assertIn('L-SUB', rendering.render_revision(revision.pk)[1])
+
+    def test_read_records_numbers_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'documents.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('control_number,document_type\nA,SOP\nB,SOP\n')
+            self.assertEqual(
+                [(line, record['control_number']) for line, record in importer.read_records(path)], [(1, 'A'), (2, 'B')],
+            )
+            path = os.path.join(directory, 'documents.jsonl')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('{"control_number": "A"}\n\n{"control_number": "B"}\n')
+            self.assertEqual([line for line, _ in importer.read_records(path)], [1, 2])
+
+
+class DiffTests(DocumentTestCase):
+    def setUp(self):
+        cache.clear()
+        self.operator = Role.objects.create(name='Operator')
+        document = self.document('TOP')
+        self.parts = {number: self.document(number) for number in ('P1', 'P2', 'P3')}
+        self.old = self.revision(document, 'A')
+        self.new = self.revision(document, 'B')
+        for revision, inputs, outputs, steps, sections in (
+            (self.old, [('P1', 1), ('P2', 2)], ['P3'], ['Mix', 'Heat', 'Store', 'Cool'],
+             [('Scope', 'Text', None), ('Detail', 'Text', 'Scope'), ('Purpose', 'Text', None)]),
+            (self.new, [('P2', 5), ('P3', 1)], [], ['Mix', 'Heat slowly', 'Cool', 'Pack'],
+             [('Scope', 'New text', None), ('Purpose', 'Text', None), ('Detail', 'Text', 'Purpose')]),
+        ):
+            for order, (number, quantity) in enumerate(inputs, start=1):
+                DocumentRevisionInputPart.objects.create(
+                    document_revision=revision, input_part=self.parts[number], quantity=quantity, order=order,
+                )
+            for order, number in enumerate(outputs, start=1):
+                DocumentRevisionOutputPart.objects.create(document_revision=revision, output_part=self.parts[number], order=order)
+            for order, description in enumerate(steps, start=1):
+                DocumentRevisionProcessStep.objects.create(document_revision=revision, order=order, description=description)
+            created = {}
+            for order, (header, text, parent) in enumerate(sections, start=1):
+                created[header] = DocumentRevisionPolicySection.objects.create(
+                    document_revision=revision, order=order, header=header, text=text, parent=created.get(parent),
+                )
+        DocumentRevision.objects.filter(pk=self.new.pk).update(title='New title')
+        DocumentRevisionProcessStep.objects.get(document_revision=self.new, description='Cool').roles.add(self.operator)
+
+    def diff(self):
+        return diff.diff_revisions(self.old.pk, self.new.pk)
+
+    def test_align(self):
+        cases = {
+            ('abc', 'ac'): [('equal', 'a', 'a'), ('removed', 'b', None), ('equal', 'c', 'c')],
+            ('ac', 'abc'): [('equal', 'a', 'a'), ('added', None, 'b'), ('equal', 'c', 'c')],
+            ('abcd', 'abxd'): [('equal', 'a', 'a'), ('equal', 'b', 'b'), ('replace', 'c', 'x'), ('equal', 'd', 'd')],
+            ('abcd', 'acbd'): [('equal', 'a', 'a'), ('moved', 'c', 'c'), ('equal', 'b', 'b'), ('equal', 'd', 'd')],
+        }
+        for (old, new), aligned in cases.items():
+            with self.subTest(old=old, new=new):
+                self.assertEqual(diff.align(list(old), list(new), str), aligned)
+
+    def test_fields_and_parts(self):
+        revision_diff = self.diff()
+        self.assertTrue(revision_diff.has_changes)
+        self.assertIn(diff.FieldChange('title', 'TOP A', 'New title'), revision_diff.fields)
+        self.assertIn(diff.FieldChange('major revision', 'A', 'B'), revision_diff.fields)
+        parts = {str(part): number for number, part in self.parts.items()}
+        self.assertEqual(
+            [(change.kind, parts[change.part], change.old_quantity, change.new_quantity) for change in revision_diff.input_parts],
+            [('removed', 'P1', 1, None), ('changed', 'P2', 2, 5), ('added', 'P3', None, 1)],
+        )
+        self.assertEqual([(change.kind, parts[change.part]) for change in revision_diff.output_parts], [('removed', 'P3')])
+
+    def test_steps(self):
+        steps = self.diff().steps
+        self.assertEqual(
+            [(step.kind, step.old_text, step.new_text) for step in steps],
+            [('unchanged', 'Mix', 'Mix'), ('edited', 'Heat', 'Heat slowly'), ('removed', 'Store', ''),
+             ('edited', 'Cool', 'Cool'), ('added', '', 'Pack')],
+        )
+        self.assertEqual(steps[3].assignments, [diff.SetChange('Roles', ['Operator'], [])])
+
+    def test_sections(self):
+        self.assertEqual(
+            [(section.kind, section.header, section.old_label, section.new_label) for section in self.diff().sections],
+            [('edited', 'Scope', '1', '1'), ('unchanged', 'Purpose', '2', '2'), ('moved', 'Detail', '1.1', '2.1')],
+        )
+
+    def test_identical_revisions_and_invalidation(self):
+        self.assertFalse(diff.diff_revisions(self.old.pk, self.old.pk).has_changes)
+        self.assertTrue(self.diff().fields)
+        with self.committing():
+            DocumentRevision.objects.filter(pk=self.new.pk).update(title='TOP A', major_revision='A2')
+            DocumentRevision.objects.get(pk=self.new.pk).save()
+        self.assertEqual([change.field for change in self.diff().fields], ['major revision'])
+
+
+class CloneTests(DocumentTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.operator, self.inspector = Role.objects.create(name='Operator'), Role.objects.create(name='Inspector')
+        self.line = Location.objects.create(name='Line 1')
+        self.tag = DocumentRevisionPreviousRevisionActionTag.objects.create(display_name='Scrap', description='-')
+        self.top = self.document('TOP')
+        self.source = self.revision(self.top, 'A', process_set_roles_by_step=True, process_purpose_and_scope='Scope')
+        self.source.process_locations.add(self.line)
+        self.source.previous_revision_action_tags.add(self.tag)
+        for order, number in enumerate(('P1', 'P2'), start=1):
+            part = self.document(number)
+            DocumentRevisionInputPart.objects.create(
+                document_revision=self.source, input_part=part, order=order, quantity=order * 3,
+            )
+        DocumentRevisionOutputPart.objects.create(document_revision=self.source, output_part=self.document('OUT'), order=1)
+        for order, roles in enumerate(([self.operator], [self.operator, self.inspector]), start=1):
+            step = DocumentRevisionProcessStep.objects.create(
+                document_revision=self.source, order=order, description=f'Step {order}',
+            )
+            step.roles.set(roles)
+            step.locations.add(self.line)
+        scope = DocumentRevisionPolicySection.objects.create(document_revision=self.source, order=1, header='Scope', text='-')
+        detail = DocumentRevisionPolicySection.objects.create(
+            document_revision=self.source, order=1, header='Detail', text='-', parent=scope,
+        )
+        DocumentRevisionPolicySection.objects.create(
+            document_revision=self.source, order=1, header='Note', text='-', parent=detail,
+        )
+        DocumentRevisionPolicySection.objects.create(document_revision=self.source, order=2, header='Purpose', text='-')
+        DocumentRevisionAttachedFile.objects.create(
+            document_revision=self.source, file=ContentFile(b'drawing', name='drawing.pdf'), description='Drawing', order=1,
+        )
+
+    def snapshot(self, revision):
+        return {
+            'inputs': list(
+                revision.documentrevisioninputpart_set.order_by('order').values_list('input_part', 'quantity', 'order')
+            ),
+            'outputs': list(revision.documentrevisionoutputpart_set.order_by('order').values_list('output_part', 'order')),
+            'steps': [
+                (step.order, step.description, set(step.roles.all()), set(step.locations.all()))
+                for step in revision.documentrevisionprocessstep_set.order_by('order')
+            ],
+            'sections': list(revision.documentrevisionpolicysection_set.order_by('path').values_list(
+                'header', 'parent__header', 'path', 'depth', 'number',
+            )),
+            'files': list(revision.documentrevisionattachedfile_set.values_list('file', 'sha256', 'description', 'order')),
+            'roles': set(revision.process_roles.all()),
+            'locations': set(revision.process_locations.all()),
+            'tags': set(revision.previous_revision_action_tags.all()),
+        }
+
+    def test_clone_copies_everything(self):
+        before = self.snapshot(self.source)
+        copy = clone.clone_revision(self.source, 'B', self.change, title='Copy')
+        self.assertEqual(self.snapshot(copy), before)
+        self.assertEqual(self.snapshot(self.source), before)
+        self.assertEqual(
+            (copy.title, copy.process_purpose_and_scope, copy.process_set_roles_by_step), ('Copy', 'Scope', True),
+        )
+        self.assertEqual(before['sections'][2][:2], ('Note', 'Detail'))
+
+        # The copied rows belong to the new revision, parents included.
+        self.assertFalse(DocumentRevisionPolicySection.objects.filter(
+            document_revision=copy, parent__document_revision=self.source,
+        ).exists())
+        self.assertFalse(DocumentRevisionProcessStep.objects.filter(document_revision=copy).filter(
+            pk__in=DocumentRevisionProcessStep.objects.filter(document_revision=self.source),
+        ).exists())
+
+    def test_derived_data_follows_the_clone(self):
+        copy = clone.clone_revision(self.source, 'B', self.change)
+        self.top.refresh_from_db()
+        self.assertEqual(self.top.effective_revision, copy)
+        self.assertEqual(
+            set(DocumentPartLink.objects.filter(parent=self.top).values_list('child__control_number', flat=True)),
+            {'P1', 'P2', 'OUT'},
+        )
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        self.assertEqual(
+            set(ProcessStepAssignment.objects.filter(document=self.top).values_list('step__document_revision', flat=True)),
+            {copy.pk},
+        )
+
+    def test_existing_revision_is_rejected(self):
+        with self.assertRaisesMessage(ValidationError, 'Revision A already exists.'):
+            clone.clone_revision(self.source, 'A', self.change)
+
+
+class RegisterExportTests(DocumentTestCase):
+    def setUp(self):
+        self.operator, self.inspector = Role.objects.create(name='Operator'), Role.objects.create(name='Inspector')
+        self.documents = [self.document(f'DOC-{number}') for number in range(1, 6)]
+        for document in self.documents[:4]:
+            self.revision(document, 'A')
+        top = self.revision(self.documents[0], 'B', title='Top, "current"')
+        top.process_roles.add(self.operator, self.inspector)
+        DocumentRevisionInputPart.objects.create(document_revision=top, input_part=self.documents[1], order=1, quantity=3)
+        DocumentRevisionInputPart.objects.create(document_revision=top, input_part=self.documents[2], order=2, quantity=1)
+        DocumentRevisionOutputPart.objects.create(document_revision=top, output_part=self.documents[3], order=1)
+
+    def test_rows_follow_the_effective_revision(self):
+        rows = list(export.iter_register(chunk_size=2))
+        self.assertEqual([row['control_number'] for row in rows], [f'DOC-{number}' for number in range(1, 6)])
+        self.assertEqual(list(rows[0]), list(export.COLUMNS))
+        self.assertEqual(
+            {name: rows[0][name] for name in ('major_revision', 'title', 'process_roles', 'input_parts', 'output_parts')},
+            {
+                'major_revision': 'B', 'title': 'Top, "current"', 'process_roles': ['Inspector', 'Operator'],
+                'input_parts': [{'control_number': 'DOC-2', 'quantity': 3}, {'control_number': 'DOC-3', 'quantity': 1}],
+                'output_parts': ['DOC-4'],
+            },
+        )
+        # A document without revisions still has its row.
+        self.assertEqual((rows[4]['major_revision'], rows[4]['input_parts']), ('', []))
+
+    def test_queries_are_made_per_chunk(self):
+        # The document query, then the revisions, roles, locations, inputs and outputs of
+        # each chunk; the last chunk only holds DOC-5, which has no revision to look into.
+        with self.assertNumQueries(1 + 5 * 2 + 1):
+            list(export.iter_register(chunk_size=2))
+        with self.assertNumQueries(1 + 5):
+            list(export.iter_register(chunk_size=10))
+
+    def test_view_streams_csv_and_jsonl(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get('/documents/register/export/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="document-register.csv"')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], list(export.COLUMNS))
+        first = dict(zip(rows[0], rows[1]))
+        self.assertEqual(first['title'], 'Top, "current"')
+        self.assertEqual(first['process_roles'], 'Inspector; Operator')
+        self.assertEqual(first['input_parts'], 'DOC-2 x3; DOC-3 x1')
+        self.assertEqual(len(rows), 6)
+
+        response = self.client.get('/documents/register/export/?format=jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['control_number'] for line in lines], [f'DOC-{number}' for number in range(1, 6)])
+        self.assertEqual(self.client.get('/documents/register/export/?format=xml').status_code, 404)
+
+    def test_command_writes_the_register(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'register.jsonl')
+            call_command('export_register', format='jsonl', output=path, chunk_size=2)
+            with open(path, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual(rows, json.loads(json.dumps(list(export.iter_register()))))
+
+
+class AttachmentTests(DocumentTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.storage = attachments.storage
+        self.revision_a = self.revision(self.document('DOC'))
+
+    def attach(self, content, name='drawing.pdf'):
+        return DocumentRevisionAttachedFile.objects.create(
+            document_revision=self.revision_a, file=ContentFile(content, name=name), description='-', order=1,
+        )
+
+    def age(self, name, seconds=7200):
+        then = os.path.getmtime(self.storage.path(name)) - seconds
+        os.utime(self.storage.path(name), (then, then))
+
+    def test_identical_content_is_stored_once(self):
+        first, second = self.attach(b'drawing'), self.attach(b'drawing', name='copy.PDF')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.sha256, digest_of(first.file.name))
+        blob = FileBlob.objects.get()
+        self.assertEqual((blob.name, blob.size, blob.ref_count), (first.file.name, 7, 2))
+
+        first.delete()
+        self.assertEqual(FileBlob.objects.get().ref_count, 1)
+        second.delete()
+        self.assertEqual(FileBlob.objects.get().ref_count, 0)
+        self.assertTrue(self.storage.exists(blob.name))
+
+    def test_garbage_collection_waits_for_min_age(self):
+        name = self.attach(b'old').file.name
+        DocumentRevisionAttachedFile.objects.all().delete()
+        kept = self.attach(b'kept').file.name
+        orphan = self.storage.save('document_revision_attached_files/orphan.pdf', ContentFile(b'orphan'))
+
+        self.assertEqual(attachments.collect_garbage(), [])
+        self.age(name)
+        self.age(orphan)
+        self.assertCountEqual(attachments.collect_garbage(dry_run=True), [name, orphan])
+        self.assertTrue(self.storage.exists(name))
+        self.assertCountEqual(attachments.collect_garbage(), [name, orphan])
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertEqual(list(FileBlob.objects.values_list('name', flat=True)), [kept])
+
+    def test_reused_blob_survives_a_running_collection(self):
+        name = self.attach(b'drawing').file.name
+        DocumentRevisionAttachedFile.objects.all().delete()
+        self.age(name)
+        cutoff = time.time() - 3600
+        # An upload of the same content lands after the collection picked its candidates.
+        self.attach(b'drawing')
+        self.assertFalse(self.storage.delete_blob(name, unused_since=cutoff))
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(attachments.collect_garbage(), [])
+
+    def test_attaching_a_collected_blob_fails(self):
+        name = self.attach(b'drawing').file.name
+        DocumentRevisionAttachedFile.objects.all().delete()
+        self.storage.delete_blob(name)
+        with self.assertRaises(FileBlob.DoesNotExist):
+            attachments.attach_blob(self.revision_a, digest_of(name), '-', 1)
+
+    def step(self, content, name='step.jpg'):
+        return DocumentRevisionProcessStep.objects.create(
+            document_revision=self.revision_a, order=1, description='-', image=ContentFile(content, name=name),
+        )
+
+    def test_step_images_are_blob_references(self):
+        step, attachment = self.step(b'photo'), self.attach(b'photo', name='photo.jpg')
+        self.assertEqual(step.image_sha256, digest_of(step.image.name))
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        rendition = derivatives.derivative_storage.save(derivatives.derivative_name(step.image.name, 'thumbnail'), ContentFile(b'jpg'))
+
+        attachment.delete()
+        self.assertEqual(attachments.collect_garbage(min_age=0), [])
+        step.delete()
+        self.assertEqual(FileBlob.objects.get().ref_count, 0)
+        self.assertCountEqual(attachments.collect_garbage(min_age=0), [step.image.name, attachment.file.name])
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(self.storage.exists(step.image.name))
+        self.assertFalse(derivatives.derivative_storage.exists(rendition))
+
+    def test_migration_backfills_uploads_made_before_content_addressing(self):
+        backfill = import_module('documents.migrations.0019_backfill_attachment_blobs').backfill
+        old_name = 'document_revision_attached_files/drawing_a1B2c3.pdf'
+        path = self.storage.path(old_name)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'drawing')
+        for order in (1, 2):
+            DocumentRevisionAttachedFile.objects.bulk_create([DocumentRevisionAttachedFile(
+                document_revision=self.revision_a, file=old_name, description='-', order=order,
+            )])
+
+        backfill(apps, None)
+        names = set(DocumentRevisionAttachedFile.objects.values_list('file', 'sha256'))
+        self.assertEqual(len(names), 1)
+        (name, digest), = names
+        self.assertEqual(digest, hashlib.sha256(b'drawing').hexdigest())
+        self.assertEqual(name, f'document_revision_attached_files/{digest[:2]}/{digest[2:4]}/{digest}.pdf')
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        self.assertFalse(os.path.exists(path))
+
+    def test_migration_backfills_step_images_made_before_content_addressing(self):
+        backfill = import_module('documents.migrations.0020_step_image_blobs').backfill
+        old_name = 'document_revision_process_step_images/photo_a1B2c3.jpg'
+        path = self.storage.path(old_name)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'photo')
+        self.attach(b'photo', name='photo.jpg')
+        DocumentRevisionProcessStep.objects.bulk_create([
+            DocumentRevisionProcessStep(document_revision=self.revision_a, order=1, description='-', image=old_name),
+        ])
+
+        backfill(apps, None)
+        step = DocumentRevisionProcessStep.objects.get()
+        digest = hashlib.sha256(b'photo').hexdigest()
+        self.assertEqual(step.image_sha256, digest)
+        self.assertEqual(step.image.name, f'document_revision_process_step_images/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+        self.assertFalse(os.path.exists(path))
+
+
+class DerivativeTests(DocumentTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        # Renditions are generated synchronously below rather than on the worker pool.
+        self.schedule = self.enterContext(mock.patch('documents.derivatives.schedule'))
+        photo = io.BytesIO()
+        Image.new('RGB', (3000, 200), 'red').save(photo, 'PNG')
+        self.step = DocumentRevisionProcessStep.objects.create(
+            document_revision=self.revision(self.document('DOC')), order=1, description='-',
+            image=ContentFile(photo.getvalue(), name='photo.png'),
+        )
+        self.image = self.step.image
+
+    def generate_all(self):
+        return [derivatives.generate(self.image.storage, self.image.name, rendition) for rendition in derivatives.RENDITIONS]
+
+    def test_generation_is_idempotent(self):
+        name = derivatives.generate(self.image.storage, self.image.name, 'thumbnail')
+        self.assertEqual(name, derivatives.derivative_name(self.image.name, 'thumbnail'))
+        self.assertIn(self.step.image_sha256, name)
+        with Image.open(derivatives.derivative_storage.path(name)) as rendition:
+            self.assertEqual((rendition.format, rendition.width), ('JPEG', 320))
+
+        with mock.patch('PIL.Image.open') as image_open:
+            self.assertEqual(derivatives.generate(self.image.storage, self.image.name, 'thumbnail'), name)
+        image_open.assert_not_called()
+
+    def test_template_tags_fall_back_to_the_original(self):
+        template = Template('{% load step_images %}{% step_image step "screen" %}|{% step_image_url step "print" %}')
+        html, url = template.render(Context({'step': self.step})).split('|')
+        self.assertEqual(html, f'<img src="{self.image.url}" alt="" loading="lazy">')
+        self.assertEqual(url, self.image.url)
+        self.schedule.assert_called()
+
+        self.generate_all()
+        self.schedule.reset_mock()
+        html, url = template.render(Context({'step': self.step})).split('|')
+        urls = {rendition: derivatives.existing_url(self.image, rendition) for rendition in derivatives.RENDITIONS}
+        self.assertIn(f'src="{urls["screen"]}"', html)
+        self.assertIn(f'{urls["thumbnail"]} 320w, {urls["screen"]} 1280w, {urls["print"]} 2400w', html)
+        self.assertEqual(url, urls['print'])
+        # Nothing is missing any more, so nothing is queued.
+        self.assertEqual([call.args[1:] for call in self.schedule.call_args_list], [([],)])
+
+    def test_steps_without_image_render_nothing(self):
+        step = DocumentRevisionProcessStep(order=2, description='-')
+        template = Template('{% load step_images %}{% step_image step %}{% step_image_url step %}{% step_image_srcset step %}')
+        self.assertEqual(template.render(Context({'step': step})), '')
+
+
+class AssignmentTests(DocumentTestCase):
+    def setUp(self):
+        self.operator, self.inspector = Role.objects.create(name='Operator'), Role.objects.create(name='Inspector')
+        self.line, self.lab = Location.objects.create(name='Line'), Location.objects.create(name='Lab')
+        self.top = self.document('TOP')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.source = self.revision(self.top, 'A')
+            self.source.process_roles.add(self.operator)
+            self.source.process_locations.add(self.line)
+            self.steps = [
+                DocumentRevisionProcessStep.objects.create(document_revision=self.source, order=order, description=f'Step {order}')
+                for order in (1, 2)
+            ]
+            self.steps[0].roles.add(self.inspector)
+            self.steps[1].locations.add(self.lab)
+
+    def rows(self):
+        return set(ProcessStepAssignment.objects.values_list('step__description', 'role__name', 'location__name'))
+
+    def assert_rebuild_agrees(self):
+        rows = self.rows()
+        assignments.rebuild()
+        self.assertEqual(self.rows(), rows)
+
+    def test_revision_wide_roles_and_locations(self):
+        self.assertEqual(self.rows(), {('Step 1', 'Operator', 'Line'), ('Step 2', 'Operator', 'Line')})
+        self.assert_rebuild_agrees()
+
+    def test_roles_and_locations_by_step(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.source.process_set_roles_by_step = True
+            self.source.save()
+        self.assertEqual(self.rows(), {('Step 1', 'Inspector', 'Line'), ('Step 2', None, 'Line')})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.source.process_set_locations_by_step = True
+            self.source.save()
+        self.assertEqual(self.rows(), {('Step 1', 'Inspector', None), ('Step 2', None, 'Lab')})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.operator.documentrevisionprocessstep_set.add(self.steps[1])
+            self.steps[0].roles.remove(self.inspector)
+        self.assertEqual(self.rows(), {('Step 2', 'Operator', 'Lab')})
+        self.assertEqual(list(assignments.steps(role=self.operator)), [self.steps[1]])
+        self.assertEqual(list(assignments.matrix()), [(self.operator.pk, self.lab.pk, 1, 1)])
+        self.assert_rebuild_agrees()
+
+    def test_rows_follow_the_effective_revision(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            newer = self.revision(self.top, 'B')
+        self.assertEqual(self.rows(), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DocumentRevisionProcessStep.objects.create(document_revision=newer, order=1, description='Step B')
+            newer.process_roles.add(self.inspector)
+        self.assertEqual(self.rows(), {('Step B', 'Inspector', None)})
+        self.assert_rebuild_agrees()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            newer.delete()
+        self.assertEqual(self.rows(), {('Step 1', 'Operator', 'Line'), ('Step 2', 'Operator', 'Line')})
+
+    def test_refresh_waits_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.source.process_roles.set([self.inspector])
+            self.steps[0].delete()
+            # The deleted step's rows go with it; the rest wait for the commit.
+            self.assertEqual(self.rows(), {('Step 2', 'Operator', 'Line')})
+        # One refresh for every change in the transaction.
+        self.assertEqual([callback.__self__.fn for callback in callbacks].count(assignments._refresh_pending), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.rows(), {('Step 2', 'Inspector', 'Line')})
+
+
+class EstimatedCountPaginatorTests(DocumentTestCase):
+    def setUp(self):
+        for number in range(5):
+            self.document(f'DOC{number}')
+
+    def count(self, queryset):
+        with mock.patch('documents.paginators.ESTIMATE_THRESHOLD', 0):
+            return EstimatedCountPaginator(queryset, 2).count
+
+    def test_counts_from_statistics(self):
+        # Without statistics the count is exact.
+        self.assertEqual(self.count(Document.objects.all()), 5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.document('DOC5')
+        # The estimate lags behind until the next ANALYZE; filtered counts do not.
+        self.assertEqual(self.count(Document.objects.all()), 5)
+        self.assertEqual(self.count(Document.objects.filter(control_number__startswith='DOC')), 6)
+        self.assertEqual(EstimatedCountPaginator(Document.objects.all(), 2).count, 6)
+
+
+class SyntheticDatasetTests(TestCase):
+    spec = synthetic.DatasetSpec(
+        document_types=2, documents=40, revisions=2, bom_depth=3, bom_fan_out=3, process_every=5, steps=2,
+        policy_every=10, sections=6, section_depth=2, roles=3, locations=2, users=2, changes=3, batch_size=15,
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.Generator(cls.spec).run()
+
+    def test_dataset_shape(self):
+        spec = self.spec
+        self.assertEqual(Document.objects.count(), spec.documents)
+        self.assertEqual(DocumentRevision.objects.count(), spec.documents * spec.revisions)
+        self.assertEqual(DocumentRevision.objects.effective().count(), spec.documents)
+        self.assertEqual(
+            list(DocumentRevision.objects.filter(document__control_number='0000000').values_list('major_revision', flat=True)
+                 .order_by('revision_sort_key')),
+            ['A', 'B'],
+        )
+        self.assertEqual(DocumentRevisionProcessStep.objects.count(), spec.documents // spec.process_every * spec.revisions * spec.steps)
+        self.assertEqual(
+            DocumentRevisionPolicySection.objects.filter(document_revision__document__control_number='0000000').count(),
+            spec.revisions * spec.sections,
+        )
+        self.assertFalse(DocumentRevisionPolicySection.objects.filter(depth__gte=spec.section_depth).exists())
+
+    def test_bom_depth_and_fan_out(self):
+        spec = self.spec
+        for number in range(spec.bom_depth + 1):
+            with self.subTest(level=number):
+                tree = bom.explode(Document.objects.get(control_number=f'{number:07d}'))
+                lines = list(tree.walk())
+                self.assertEqual(max((line.depth for line in lines), default=0), number)
+                self.assertEqual(len(tree.lines), spec.bom_fan_out if number else 0)
+                for line in lines:
+                    self.assertEqual(len(line.children), spec.bom_fan_out if line.depth < number else 0)
+
+    def test_indexes_are_built(self):
+        top = Document.objects.get(control_number=f'{self.spec.bom_depth:07d}')
+        self.assertEqual(
+            set(DocumentPartClosure.objects.filter(ancestor=top).values_list('descendant', flat=True)),
+            {line.document.pk for line in bom.explode(top).walk()},
+        )
+        self.assertTrue(ProcessStepAssignment.objects.exists())
+        self.assertTrue(search.search(synthetic.WORDS[0]))
+
+    # The benchmark client requests the admin as localhost, which DEBUG allows.
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmarks_run(self):
+        report = benchmarks.run(repeat=2, samples=3)
+        self.assertEqual(set(report['results']), set(benchmarks.BENCHMARKS))
+        for name, result in report['results'].items():
+            with self.subTest(benchmark=name):
+                self.assertLessEqual(result['min_ms'], result['median_ms'])
+                self.assertLessEqual(result['median_ms'], result['max_ms'])
+                self.assertEqual(result['queries'] == 0, name == 'revision_render_cached')
+        self.assertEqual(report['dataset'], {'documents': 40, 'revisions': 80})
+        self.assertEqual(report['settings'], {'repeat': 2, 'samples': 3, 'seed': 1})
+        json.dumps(report)
 
-# Create your tests here.
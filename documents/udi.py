@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from . import api
+from .models import Document, normalize_device_identifier
+
+CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class Resolution:
+    device_identifier: str
+    document_id: int
+    control_number: str
+    revision_id: Optional[int]
+    major_revision: Optional[str]
+
+
+def _lookup(device_identifiers):
+    """{normalized identifier: Resolution} for the current revisions carrying them, in one query."""
+    device_identifiers = set(device_identifiers) - {''}
+    if not device_identifiers:
+        return {}
+    rows = Document.objects.filter(device_identifier__in=device_identifiers).values_list(
+        'device_identifier', 'pk', 'control_number', 'effective_revision', 'effective_revision__major_revision',
+    )
+    return {row[0]: Resolution(*row) for row in rows}
+
+
+def resolve(identifiers):
+    """
+    Map each scanned or typed device identifier to the document whose current revision
+    carries it, or to None. Identifiers are normalized first, so a full GS1 UDI with
+    lot and serial resolves like its bare GTIN. Any number of identifiers takes one query.
+    """
+    normalized = {identifier: normalize_device_identifier(identifier) for identifier in identifiers}
+    found = _lookup(normalized.values())
+    return {identifier: found.get(device_identifier) for identifier, device_identifier in normalized.items()}
+
+
+class ResolutionCache:
+    """
+    A small in-process LRU of resolutions for scanner stations, which scan the same
+    few products over and over. Misses are cached too. The whole cache is dropped
+    when the API data generation changes, which every document and revision change
+    bumps, so a lookup costs one read of Django's cache and no query when it hits.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def resolve(self, identifiers):
+        normalized = {identifier: normalize_device_identifier(identifier) for identifier in identifiers}
+        generation = api.generation()
+        results, missing = {}, set()
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+            for device_identifier in set(normalized.values()):
+                if device_identifier in self._entries:
+                    self._entries.move_to_end(device_identifier)
+                    results[device_identifier] = self._entries[device_identifier]
+                else:
+                    missing.add(device_identifier)
+        if missing:
+            found = _lookup(missing)
+            with self._lock:
+                # Another caller may have moved the cache to a newer generation meanwhile;
+                # results read under the older one are returned but not kept.
+                if generation == self._generation:
+                    for device_identifier in missing:
+                        self._entries[device_identifier] = results[device_identifier] = found.get(device_identifier)
+                        if len(self._entries) > self.size:
+                            self._entries.popitem(last=False)
+                else:
+                    results.update((device_identifier, found.get(device_identifier)) for device_identifier in missing)
+        return {identifier: results[device_identifier] for identifier, device_identifier in normalized.items()}
+
+    def get(self, identifier):
+        return self.resolve([identifier])[identifier]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+scanner_cache = ResolutionCache()
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'documents'
+
+urlpatterns = [
+    path('revisions/<int:pk>/', views.revision_detail, name='revision_detail'),
+    path('revisions/<int:pk>/body/', views.revision_body, name='revision_body'),
+    path('revisions/<int:pk>/diff/<int:other_pk>/', views.revision_diff, name='revision_diff'),
+    path('register/export/', views.export_register, name='export_register'),
+]
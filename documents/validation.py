@@ -0,0 +1,231 @@
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count
+
+from . import where_used
+from .models import (
+    Document, DocumentRevision, DocumentRevisionInputPart, DocumentRevisionOutputPart, DocumentRevisionPolicySection,
+)
+from .policy_tree import ancestors
+
+PART_FIELDS = {DocumentRevisionInputPart: 'input_part', DocumentRevisionOutputPart: 'output_part'}
+
+
+def part_cycles(pairs):
+    """
+    The (document, part) pairs that would close a loop in the part graph, counting the
+    links of every revision: a loop through a superseded revision comes back when a
+    newer revision is deleted. The pairs themselves count too, so loops within a batch
+    are found. One query for all pairs, against the part reach index.
+    """
+    pairs = set(pairs)
+    cycles = {(document, part) for document, part in pairs if document == part}
+    candidates = pairs - cycles
+    if not candidates:
+        return cycles
+    # Any loop alternates between candidate links and existing paths from a candidate
+    # part to a candidate document, so the graph of those alone decides.
+    graph = defaultdict(set)
+    for document, part in candidates:
+        graph[document].add(part)
+    for part, document in where_used.reaching({part for _, part in candidates}, {document for document, _ in candidates}):
+        graph[part].add(document)
+    component = {}
+    for number, members in enumerate(_strongly_connected(graph)):
+        for member in members:
+            component[member] = number
+    return cycles | {(document, part) for document, part in candidates if component[document] == component[part]}
+
+
+def _document_of(link):
+    # Inline forms attach the revision being created before it has a primary key.
+    if type(link).document_revision.is_cached(link):
+        return link.document_revision.document_id
+    if link.document_revision_id is None:
+        return None
+    return DocumentRevision.objects.filter(pk=link.document_revision_id).values_list('document', flat=True).first()
+
+
+def validate_part_link(link):
+    """Reject an input or output part that is the document itself or already uses the document."""
+    field = PART_FIELDS[type(link)]
+    document_id, part_id = _document_of(link), getattr(link, f'{field}_id')
+    if document_id is None or part_id is None or not part_cycles([(document_id, part_id)]):
+        return
+    if document_id == part_id:
+        raise ValidationError({field: 'A document cannot be a part of itself.'})
+    raise ValidationError({field: 'A revision of this part already uses the document, directly or through its parts.'})
+
+
+def validate_policy_parent(section):
+    """Reject a parent from another revision, or the section itself or one of its subsections."""
+    if section.parent_id is None:
+        return
+    if section.parent_id == section.pk:
+        raise ValidationError({'parent': 'A policy section cannot be its own parent.'})
+    # Parent links rather than stored paths, which are only rebuilt when the transaction commits.
+    chain = ancestors(section.parent_id)
+    if section.parent_id not in chain:
+        return
+    if section.document_revision_id is not None and chain[section.parent_id] != section.document_revision_id:
+        raise ValidationError({'parent': 'The parent section must belong to the same revision.'})
+    if section.pk is not None and section.pk in chain:
+        raise ValidationError({'parent': 'A policy section cannot be placed under one of its own subsections.'})
+
+
+@dataclass
+class Problem:
+    kind: str
+    message: str
+    # Policy sections for policy problems, documents otherwise.
+    ids: list
+
+    def __str__(self):
+        return f'{self.kind}: {self.message}'
+
+
+def _strongly_connected(graph):
+    """Tarjan's algorithm without recursion; yields the components of a {node: successors} graph."""
+    index, lowlink, on_stack, stack = {}, {}, set(), []
+    counter = 0
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph.get(root, ())))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph.get(successor, ()))))
+                    break
+                if successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    yield component
+
+
+def part_graph_problems():
+    """Cycles among the part links of effective revisions, found in one pass over the links."""
+    graph = defaultdict(set)
+    effective = DocumentRevision.objects.effective()
+    for model, field in PART_FIELDS.items():
+        rows = model.objects.filter(document_revision__in=effective).order_by().values_list('document_revision__document', field)
+        for document, part in rows:
+            graph[document].add(part)
+    cyclic = [
+        sorted(component) for component in _strongly_connected(graph)
+        if len(component) > 1 or component[0] in graph.get(component[0], ())
+    ]
+    numbers = dict(Document.objects.filter(pk__in={pk for component in cyclic for pk in component}).values_list(
+        'pk', 'control_number'
+    ))
+    return [
+        Problem(
+            'part cycle',
+            f'{numbers[component[0]]} uses itself as a part.' if len(component) == 1
+            else 'Documents use each other as parts: ' + ', '.join(numbers[pk] for pk in component),
+            component,
+        )
+        for component in cyclic
+    ]
+
+
+def policy_tree_problems():
+    """Policy sections whose parent is in another revision, and parent loops, in one pass over the sections."""
+    problems = []
+    parents = {}
+    for pk, revision, parent, parent_revision in DocumentRevisionPolicySection.objects.order_by('pk').values_list(
+        'pk', 'document_revision', 'parent', 'parent__document_revision'
+    ):
+        if parent is not None and parent_revision != revision:
+            problems.append(Problem(
+                'policy parent', f'Section {pk} of revision {revision} has a parent in revision {parent_revision}.', [pk],
+            ))
+        parents[pk] = parent
+
+    # Every section has at most one parent, so following parents from each unvisited
+    # section either reaches a root, a section already cleared, or a loop.
+    state = {}
+    for start in parents:
+        trail = []
+        node = start
+        while node is not None and node not in state:
+            state[node] = start
+            trail.append(node)
+            node = parents.get(node)
+        if node is not None and state[node] == start:
+            loop = trail[trail.index(node):]
+            problems.append(Problem('policy cycle', 'Sections are their own ancestors: ' + ', '.join(map(str, loop)), loop))
+    return problems
+
+
+def device_identifier_problems():
+    """Device identifiers carried by the current revisions of more than one document."""
+    shared = (
+        DocumentRevision.objects.effective().exclude(device_identifier='').values('device_identifier')
+        .annotate(documents=Count('document')).filter(documents__gt=1).values('device_identifier')
+    )
+    holders = defaultdict(list)
+    for device_identifier, document, control_number in DocumentRevision.objects.effective().filter(
+        device_identifier__in=shared,
+    ).order_by('document__control_number').values_list('device_identifier', 'document', 'document__control_number'):
+        holders[device_identifier].append((document, control_number))
+    return [
+        Problem(
+            'device identifier',
+            f'{device_identifier} is used by ' + ', '.join(number for _, number in documents),
+            [document for document, _ in documents],
+        )
+        for device_identifier, documents in sorted(holders.items())
+    ]
+
+
+def where_used_problems():
+    """
+    Differences between the part graphs of documents.where_used and the part links they
+    index: the effective revisions' for the where-used index, every revision's for the
+    part reach index used by cycle checks.
+    """
+    problems = []
+    for graph, scope in ((where_used.effective_graph, 'no effective revision'), (where_used.revision_graph, 'no revision')):
+        wanted = {(parent, child) for parent, children in graph.children().items() for child in children}
+        indexed = set(graph.link_model.objects.values_list('parent', 'child'))
+        missing, stale = sorted(wanted - indexed), sorted(indexed - wanted)
+        numbers = dict(Document.objects.filter(
+            pk__in={pk for link in missing + stale for pk in link}
+        ).values_list('pk', 'control_number'))
+        problems += [
+            Problem('where-used', f'{numbers[parent]} -> {numbers[child]} is missing from the {graph.label}.', [parent, child])
+            for parent, child in missing
+        ] + [
+            Problem('where-used', f'{numbers[parent]} -> {numbers[child]} is in the {graph.label} but {scope} has it.', [parent, child])
+            for parent, child in stale
+        ]
+    return problems
+
+
+def audit():
+    """Every structural problem in the database, in time linear in the number of links, sections and revisions."""
+    return part_graph_problems() + where_used_problems() + policy_tree_problems() + device_identifier_problems()
@@ -1,3 +1,92 @@
+import hashlib
+import json
+from dataclasses import asdict
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+
+from tqms.routers import read_only_view, replica_iterator
+
+from . import api, diff, export, rendering, udi
+from .models import DocumentRevision
+
+
+@staff_member_required
+@read_only_view
+def export_register(request):
+    format = request.GET.get('format', 'csv')
+    if format not in export.FORMATS:
+        raise Http404(f'Unknown export format "{format}".')
+    writer, content_type = export.FORMATS[format]
+    response = StreamingHttpResponse(writer(replica_iterator(export.iter_register())), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="document-register.{format}"'
+    return response
+
+
+async def _rendered_revision(pk):
+    try:
+        return await rendering.arender_revision(pk)
+    except DocumentRevision.DoesNotExist:
+        raise Http404('No such document revision.')
+
+
+@login_required
+async def revision_detail(request, pk):
+    title, body = await _rendered_revision(pk)
+    return render(request, 'documents/revision_detail.html', {'title': title, 'body': body})
+
+
+@login_required
+async def revision_body(request, pk):
+    """The revision fragment alone, for terminals that poll it; unchanged content answers 304."""
+    _, body = await _rendered_revision(pk)
+    etag = quote_etag(hashlib.md5(body.encode(), usedforsecurity=False).hexdigest())
+    response = get_conditional_response(request, etag=etag) or HttpResponse(body)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def revision_diff(request, pk, other_pk):
+    try:
+        revision_diff = diff.diff_revisions(pk, other_pk)
+    except DocumentRevision.DoesNotExist:
+        raise Http404('No such document revision.')
+    return render(request, 'documents/revision_detail.html', {
+        'title': f'{revision_diff.old} → {revision_diff.new}', 'body': diff.render_diff(revision_diff),
+    })
+
 
-# Create your views here.
+@csrf_exempt
+def resolve_device_identifiers(request):
+    """
+    Resolve device identifiers to documents: GET with repeated `identifier`
+    parameters, as scanner stations send, or POST {"identifiers": [...]} for bulk
+    lookups. Read-only, so safe without a CSRF token.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    if request.method == 'POST':
+        try:
+            identifiers = json.loads(request.body)['identifiers']
+        except (ValueError, KeyError, TypeError):
+            identifiers = None
+        if not isinstance(identifiers, list) or not all(isinstance(identifier, str) for identifier in identifiers):
+            return JsonResponse({'error': 'Expected {"identifiers": [...]} with string identifiers.'}, status=400)
+    elif request.method == 'GET':
+        identifiers = request.GET.getlist('identifier')
+    else:
+        return JsonResponse({'error': 'Method not allowed.'}, status=405, headers={'Allow': 'GET, POST'})
+    if len(identifiers) > api.MAX_LIMIT:
+        return JsonResponse({'error': f'At most {api.MAX_LIMIT} identifiers per request.'}, status=400)
+    # Bulk lookups would only churn the scanner stations' cache.
+    resolve = udi.resolve if request.method == 'POST' else udi.scanner_cache.resolve
+    resolved = resolve(identifiers)
+    return JsonResponse({
+        'data': {identifier: asdict(resolution) if resolution else None for identifier, resolution in resolved.items()},
+    })
@@ -0,0 +1,236 @@
+import logging
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import (
+    Document, DocumentPartClosure, DocumentPartLink, DocumentPartReach, DocumentPartUse, DocumentRevision,
+    DocumentRevisionInputPart, DocumentRevisionOutputPart,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# Documents whose deletion is in progress on this thread. Their links are detached
+# up front, so the cascade of revision and part deletions must not re-add them.
+_state = threading.local()
+
+
+def _deleting():
+    if not hasattr(_state, 'deleting'):
+        _state.deleting = set()
+    return _state.deleting
+
+
+class PartGraph:
+    """
+    A table of direct part links between documents and its transitive closure, kept
+    current incrementally. Each closure row counts the distinct paths between its two
+    documents, so removing a link only subtracts the paths through it. Links that
+    would close a loop are left out and reported.
+    """
+
+    def __init__(self, link_model, closure_model, revisions, label):
+        self.link_model = link_model
+        self.closure_model = closure_model
+        self.revisions = revisions
+        self.label = label
+
+    def children(self, document_ids=None):
+        """{document: parts} through the input and output parts of the revisions this graph covers."""
+        revisions = self.revisions()
+        if document_ids is not None:
+            revisions = revisions.filter(document__in=document_ids)
+        children = defaultdict(set)
+        for model, field in ((DocumentRevisionInputPart, 'input_part'), (DocumentRevisionOutputPart, 'output_part')):
+            rows = model.objects.filter(document_revision__in=revisions).values_list('document_revision__document', field)
+            for parent, child in rows:
+                if parent != child:
+                    children[parent].add(child)
+        return children
+
+    def apply_link(self, parent, child, sign):
+        """Add (sign=1) or remove (sign=-1) the paths contributed by one direct link."""
+        closure = self.closure_model.objects
+        ancestors = dict(closure.filter(descendant=parent).values_list('ancestor', 'path_count'))
+        ancestors[parent] = 1
+        descendants = dict(closure.filter(ancestor=child).values_list('descendant', 'path_count'))
+        descendants[child] = 1
+        if sign > 0 and parent in descendants:
+            return False
+
+        existing = {
+            (row.ancestor_id, row.descendant_id): row
+            for row in closure.filter(ancestor__in=ancestors, descendant__in=descendants)
+        }
+        to_create, to_update, to_delete = [], [], []
+        for ancestor, up in ancestors.items():
+            for descendant, down in descendants.items():
+                row = existing.get((ancestor, descendant))
+                delta = sign * up * down
+                if row is None:
+                    if delta > 0:
+                        to_create.append(self.closure_model(ancestor_id=ancestor, descendant_id=descendant, path_count=delta))
+                elif row.path_count + delta > 0:
+                    row.path_count += delta
+                    to_update.append(row)
+                else:
+                    to_delete.append(row.pk)
+
+        closure.bulk_create(to_create, batch_size=BATCH_SIZE)
+        closure.bulk_update(to_update, ['path_count'], batch_size=BATCH_SIZE)
+        for start in range(0, len(to_delete), BATCH_SIZE):
+            closure.filter(pk__in=to_delete[start:start + BATCH_SIZE]).delete()
+        return True
+
+    def sync(self, document_ids, deleting=frozenset()):
+        """Bring the links of the given documents, and the closure above and below them, up to date."""
+        desired = self.children(document_ids)
+        current = defaultdict(set)
+        for parent, child in self.link_model.objects.filter(parent__in=document_ids).values_list('parent', 'child'):
+            current[parent].add(child)
+
+        cycles = []
+        for parent in document_ids:
+            wanted = desired[parent] - deleting
+            for child in current[parent] - wanted:
+                self.apply_link(parent, child, -1)
+                self.link_model.objects.filter(parent=parent, child=child).delete()
+            for child in wanted - current[parent]:
+                if self.apply_link(parent, child, 1):
+                    self.link_model.objects.create(parent_id=parent, child_id=child)
+                else:
+                    logger.warning(
+                        'Not indexing part link %s -> %s in the %s because it would form a cycle.', parent, child, self.label,
+                    )
+                    cycles.append((parent, child))
+        return cycles
+
+    def detach(self, document_id):
+        links = self.link_model.objects.filter(Q(parent=document_id) | Q(child=document_id))
+        for parent, child in links.values_list('parent', 'child'):
+            self.apply_link(parent, child, -1)
+        links.delete()
+
+    def rebuild(self):
+        """Recompute the whole link table and closure."""
+        self.closure_model.objects.all().delete()
+        self.link_model.objects.all().delete()
+
+        children = self.children()
+        cyclic = set()
+
+        # Path counts below each document, computed once per node in post-order.
+        reach = {}
+        visiting = set()
+        for root in list(children):
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if node in reach or (node in visiting and not expanded):
+                    continue
+                if not expanded:
+                    visiting.add(node)
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in children.get(node, ()) if child not in reach)
+                    continue
+                counts = defaultdict(int)
+                for child in children.get(node, ()):
+                    if child not in reach:
+                        # Only possible when the child is still on the stack, i.e. a cycle.
+                        logger.warning(
+                            'Not indexing part link %s -> %s in the %s because it forms a cycle.', node, child, self.label,
+                        )
+                        cyclic.add((node, child))
+                        continue
+                    counts[child] += 1
+                    for descendant, paths in reach[child].items():
+                        counts[descendant] += paths
+                reach[node] = counts
+                visiting.discard(node)
+
+        self.link_model.objects.bulk_create(
+            (
+                self.link_model(parent_id=parent, child_id=child)
+                for parent, kids in children.items() for child in kids if (parent, child) not in cyclic
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        self.closure_model.objects.bulk_create(
+            (
+                self.closure_model(ancestor_id=ancestor, descendant_id=descendant, path_count=paths)
+                for ancestor, counts in reach.items() for descendant, paths in counts.items()
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+
+# Where-used answers which current products use a document, so it follows effective
+# revisions only. Cycle checks must also see superseded revisions, which come back
+# into effect when a newer revision is deleted, so they use a second graph over all.
+effective_graph = PartGraph(
+    DocumentPartLink, DocumentPartClosure, lambda: DocumentRevision.objects.effective(), 'where-used index',
+)
+revision_graph = PartGraph(DocumentPartUse, DocumentPartReach, lambda: DocumentRevision.objects.all(), 'part reach index')
+GRAPHS = (effective_graph, revision_graph)
+
+
+@transaction.atomic
+def sync_documents(document_ids):
+    """
+    Bring both part graphs up to date for the given documents. Returns the
+    (parent, child) links left out because they would form a cycle;
+    validation.where_used_problems() reports them until the loop is broken.
+    """
+    deleting = _deleting()
+    document_ids = set(document_ids) - deleting
+    if not document_ids:
+        return []
+    cycles = []
+    for graph in GRAPHS:
+        cycles.extend(link for link in graph.sync(document_ids, deleting) if link not in cycles)
+    return cycles
+
+
+@transaction.atomic
+def detach_document(document_id):
+    """Remove every link into or out of a document that is about to be deleted."""
+    _deleting().add(document_id)
+    for graph in GRAPHS:
+        graph.detach(document_id)
+
+
+def document_deleted(document_id):
+    _deleting().discard(document_id)
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute both part graphs from the revisions' part links."""
+    for graph in GRAPHS:
+        graph.rebuild()
+
+
+def reaching(parts, documents):
+    """(part, document) pairs where the part uses the document through the links of any revision."""
+    return DocumentPartReach.objects.filter(ancestor__in=parts, descendant__in=documents).values_list(
+        'ancestor', 'descendant',
+    )
+
+
+def where_used(document_ids):
+    """Every document that consumes or produces any of the given documents, at any depth."""
+    return Document.objects.filter(
+        pk__in=DocumentPartClosure.objects.filter(descendant__in=document_ids).values('ancestor')
+    )
+
+
+def impacted_documents(document_change):
+    """The documents revised by a change plus every document that uses them, in one query."""
+    changed = DocumentRevision.objects.filter(document_change=document_change).values('document')
+    return Document.objects.filter(
+        Q(pk__in=changed) | Q(pk__in=DocumentPartClosure.objects.filter(descendant__in=changed).values('ancestor'))
+    )
@@ -1,5 +1,16 @@
 from django.contrib import admin
 from .models import Role, Location
 
-admin.site.register(Role)
-admin.site.register(Location)
\ No newline at end of file
+
+@admin.register(Role)
+class RoleAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+    ordering = ('name',)
+
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    list_display = ('name', 'registered_location')
+    list_filter = ('registered_location',)
+    search_fields = ('name',)
+    ordering = ('name',)
@@ -1,5 +1,7 @@
 from django.db import models
 
+from .reference_cache import ReferenceCache
+
 class Role(models.Model):
     name = models.CharField(max_length=255, unique=True)
 
@@ -12,3 +14,6 @@ class Location(models.Model):
 
     def __str__(self):
         return self.name
+
+roles = ReferenceCache(Role, 'name')
+locations = ReferenceCache(Location, 'name')
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+# Snapshots of superseded generations are left to expire.
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+
+class ReferenceCache:
+    """
+    An in-process copy of a small, rarely changing table, indexed by primary key and
+    by the given unique fields.
+
+    Every lookup compares the local copy's generation with a counter kept in Django's
+    cache; saving or deleting a row bumps the counter once the transaction commits,
+    so every worker sharing that cache reloads on its next lookup. A reloading worker
+    takes the rows from Django's cache when another worker already stored them, so in
+    steady state lookups do not touch the database. The counter is only as shared as
+    the cache: with the default per-process LocMemCache a save in one worker is never
+    seen by the others, so deployments running more than one process must select a
+    shared backend (TQMS_CACHE_BACKEND in tqms/settings.py).
+
+    Returned instances are shared between callers and must not be modified.
+    """
+
+    def __init__(self, model, *fields):
+        self.model = model
+        self.fields = fields
+        self.prefix = f'reference-cache:{model._meta.label_lower}'
+        self._snapshot = None
+        self._local = threading.local()
+        for signal in (post_save, post_delete):
+            signal.connect(self._changed, sender=model, weak=False, dispatch_uid=self.prefix)
+
+    def _changed(self, **kwargs):
+        self._snapshot = None
+        self._local.dirty = True
+        transaction.on_commit(self.invalidate)
+
+    def invalidate(self):
+        self._snapshot = None
+        self._local.dirty = False
+        try:
+            cache.incr(f'{self.prefix}:generation')
+        except ValueError:
+            cache.set(f'{self.prefix}:generation', time.time_ns(), None)
+
+    def _generation(self):
+        key = f'{self.prefix}:generation'
+        generation = cache.get(key)
+        if generation is None:
+            cache.add(key, time.time_ns(), None)
+            generation = cache.get(key)
+        return generation
+
+    def _load(self):
+        generation = self._generation()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == generation:
+            return snapshot
+
+        # Rows changed by this thread's open transaction must not leak to other callers.
+        shareable = not (getattr(self._local, 'dirty', False) and transaction.get_connection().in_atomic_block)
+        rows_key = f'{self.prefix}:{generation}'
+        objects = cache.get(rows_key) if shareable else None
+        if objects is None:
+            objects = list(self.model._default_manager.order_by('pk'))
+            if shareable:
+                cache.set(rows_key, objects, SNAPSHOT_TIMEOUT)
+        snapshot = (
+            generation,
+            {obj.pk: obj for obj in objects},
+            {field: {getattr(obj, field): obj for obj in objects} for field in self.fields},
+        )
+        if shareable:
+            self._snapshot = snapshot
+        return snapshot
+
+    def all(self):
+        return list(self._load()[1].values())
+
+    def get(self, pk=None, **lookup):
+        """get(pk) or get(field=value) for one of the indexed fields; raises DoesNotExist like the ORM."""
+        _, by_pk, by_field = self._load()
+        if pk is not None:
+            obj = by_pk.get(pk)
+        else:
+            (field, value), = lookup.items()
+            obj = by_field[field].get(value)
+        if obj is None:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching {pk or lookup} does not exist.')
+        return obj
+
+    def ids_by(self, field):
+        """{value: pk} for one of the indexed fields."""
+        return {value: obj.pk for value, obj in self._load()[2][field].items()}
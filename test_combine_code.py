@@ -0,0 +1,82 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import combine_code
+
+
+@mock.patch.object(combine_code, 'USE_GITIGNORE', False)
+class CombineCodeTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        self.write('app/models.py', 'class Model:\n    pass\n')
+        self.write('app/views.py', 'def view():\n    return 1\n')
+
+    def write(self, relative, content):
+        path = self.root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content)
+
+    def combine(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            combine_code.combine_code_from_walk(str(self.root), 'out.txt', max_workers=2)
+        return output.getvalue()
+
+    def test_unchanged_files_are_taken_from_the_previous_output(self):
+        first = self.combine()
+        self.assertIn('Processed: 2 files (0 unchanged since the last run).', first)
+        combined = (self.root / 'out.txt').read_text()
+
+        with mock.patch.object(combine_code, 'read_file', wraps=combine_code.read_file) as read_file:
+            self.assertIn('Processed: 2 files (2 unchanged since the last run).', self.combine())
+            read_file.assert_not_called()
+            self.assertEqual((self.root / 'out.txt').read_text(), combined)
+
+            self.write('app/views.py', 'def view():\n    return 2\n')
+            stat = (self.root / 'app/models.py').stat()
+            os.utime(self.root / 'app/views.py', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertIn('Processed: 2 files (1 unchanged since the last run).', self.combine())
+        self.assertEqual([call.args[1] for call in read_file.call_args_list], ['app/views.py'])
+        self.assertIn('return 2', (self.root / 'out.txt').read_text())
+
+        # An output edited since the last run is not trusted.
+        (self.root / 'out.txt').write_text('edited')
+        self.assertIn('(0 unchanged since the last run)', self.combine())
+
+    def test_summary_counts_skipped_directories_and_files(self):
+        self.write('app/migrations/0001_initial.py', '')
+        self.write('app/__pycache__/models.pyc', b'\0\0')
+        self.write('node_modules/lib/index.js', '')
+        self.write('.DS_Store', '')
+        summary = self.combine()
+        # .DS_Store and the output being written.
+        self.assertIn('Skipped:   2 files.', summary)
+        self.assertIn('Skipped:   3 directories (and their contents).', summary)
+
+    def test_binary_files_are_only_sniffed(self):
+        self.write('logo.png', b'\x89PNG\0' + b'x' * (combine_code.MAX_BINARY_CHECK_BYTES * 4))
+        entries = {entry.path: entry for entry in combine_code.iter_bundle(str(self.root), 'out.txt', incremental=False)}
+        self.assertTrue(entries['logo.png'].binary)
+        self.assertIsNone(entries['logo.png'].sha256)
+        self.assertIsNone(entries['logo.png'].content)
+        self.assertFalse(entries['app/models.py'].binary)
+        self.assertIn('class Model', entries['app/models.py'].content)
+
+    def test_workers_must_be_positive(self):
+        self.assertEqual(combine_code.positive_int('3'), 3)
+        for value in ('0', '-1', 'many'):
+            with self.subTest(value=value), self.assertRaises(argparse.ArgumentTypeError):
+                combine_code.positive_int(value)
+        with self.assertRaises(ValueError):
+            list(combine_code.iter_bundle(str(self.root), 'out.txt', max_workers=0))
@@ -0,0 +1,273 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections, transaction
+from django.shortcuts import render
+
+logger = logging.getLogger('tqms.queries')
+
+# A statement seen this many times in one request is reported as an N+1.
+N_PLUS_ONE_THRESHOLD = 5
+SLOWEST_COUNT = 5
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+# Plan lines that read a whole table, and sorts no index could avoid, per vendor.
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (\w+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+SORT = {
+    'sqlite': re.compile(r'\bUSE TEMP B-TREE FOR ORDER BY\b'),
+    'postgresql': re.compile(r'\bSort\b'),
+}
+
+_recent = deque(maxlen=getattr(settings, 'QUERY_LOG_SIZE', 200))
+_recent_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    """The statement with IN lists collapsed, so queries differing only in parameters match."""
+    return IN_LIST.sub('IN (...)', sql)
+
+
+@dataclass
+class Query:
+    sql: str
+    params: object
+    duration: float
+
+
+@dataclass(eq=False)
+class QueryRecorder:
+    """A connection.execute_wrapper that keeps every statement run through it."""
+    queries: list[Query] = field(default_factory=list)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(Query(sql, params, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(query.duration for query in self.queries)
+
+    def duplicates(self):
+        """{sql: count} for statements run more than once with the same parameters."""
+        counts = Counter((query.sql, repr(query.params)) for query in self.queries)
+        return {sql: count for (sql, _), count in counts.items() if count > 1}
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """{fingerprint: count} for statement shapes run at least `threshold` times, the usual N+1 signature."""
+        counts = Counter(fingerprint(query.sql) for query in self.queries)
+        return {sql: count for sql, count in counts.most_common() if count >= threshold}
+
+    def slowest(self, count=SLOWEST_COUNT):
+        return sorted(self.queries, key=lambda query: query.duration, reverse=True)[:count]
+
+    def report(self):
+        lines = [f'{self.count} queries in {self.duration * 1000:.1f} ms']
+        lines += [f'  {count} x {sql}' for sql, count in self.repeated(2).items()]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def record_queries(using=None):
+    """Record the queries run on the given databases (all of them by default) inside the block."""
+    recorder = QueryRecorder()
+    aliases = [using] if using else list(connections)
+    with _wrapped(aliases, recorder):
+        yield recorder
+
+
+@contextmanager
+def _wrapped(aliases, recorder):
+    if not aliases:
+        yield
+        return
+    with connections[aliases[0]].execute_wrapper(recorder), _wrapped(aliases[1:], recorder):
+        yield
+
+
+@contextmanager
+def assert_query_budget(budget, using=None):
+    """
+    Fail the test if the block runs more than `budget` queries:
+
+        with assert_query_budget(6):
+            self.client.get(url)
+    """
+    with record_queries(using) as recorder:
+        yield recorder
+    if recorder.count > budget:
+        raise AssertionError(f'Query budget of {budget} exceeded: {recorder.report()}')
+
+
+def query_plan(queryset):
+    """
+    The backend's plan for the queryset. On PostgreSQL, sequential scans and sorts are
+    priced out first, so they only show up where no index can avoid them, however
+    small the test tables are.
+    """
+    connection = connections[queryset.db]
+    with transaction.atomic(using=queryset.db):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+        return queryset.explain()
+
+
+def plan_problems(queryset, allow_sort=False):
+    """The plan lines showing a full table scan, or a sort unless `allow_sort` is set."""
+    vendor = connections[queryset.db].vendor
+    if vendor not in FULL_SCAN:
+        return []
+    tables = set(connections[queryset.db].introspection.table_names())
+    problems = []
+    for line in query_plan(queryset).splitlines():
+        scan = FULL_SCAN[vendor].search(line)
+        if (scan and scan[1] in tables) or (not allow_sort and SORT[vendor].search(line)):
+            problems.append(line.strip())
+    return problems
+
+
+def assert_indexed(queryset, allow_sort=False):
+    """Fail the test if the queryset's plan reads a whole table or sorts rows an index could order."""
+    problems = plan_problems(queryset, allow_sort)
+    if problems:
+        raise AssertionError(f'Query is not served by an index:\n{queryset.query}\n' + '\n'.join(problems))
+
+
+def _attach(recorder):
+    for connection in connections.all():
+        connection.execute_wrappers.append(recorder)
+
+
+def _detach(recorder):
+    for connection in connections.all():
+        if recorder in connection.execute_wrappers:
+            connection.execute_wrappers.remove(recorder)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Record the queries of each request. Adds a Server-Timing header, logs a summary
+    on the tqms.queries logger (at WARNING when an N+1 pattern shows up) and keeps a
+    sample of requests for the admin's recent queries page.
+
+    Works for sync and async requests alike. Under async views the recorder is
+    attached in the thread that runs their ORM calls. Queries run while a streaming
+    response is sent are counted too; such responses get no Server-Timing header,
+    since their headers go out before the queries run, and are logged at the end.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_LOG_SAMPLE_RATE', 0.0)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start, recorder = time.perf_counter(), QueryRecorder()
+        _attach(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            _detach(recorder)
+        if response.streaming and not response.is_async:
+            response.streaming_content = self._recorded(response.streaming_content, request, response, recorder, start)
+            return response
+        return self._finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        start, recorder = time.perf_counter(), QueryRecorder()
+        await sync_to_async(_attach)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_detach)(recorder)
+        if response.streaming:
+            content = self._arecorded if response.is_async else self._recorded
+            response.streaming_content = content(response.streaming_content, request, response, recorder, start)
+            return response
+        return self._finish(request, response, recorder, start)
+
+    def _recorded(self, content, request, response, recorder, start):
+        # Under ASGI a synchronous stream is consumed in a worker thread, which is where this runs.
+        _attach(recorder)
+        try:
+            yield from content
+        finally:
+            _detach(recorder)
+            self._report(request, response, recorder, time.perf_counter() - start)
+
+    async def _arecorded(self, content, request, response, recorder, start):
+        await sync_to_async(_attach)(recorder)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            await sync_to_async(_detach)(recorder)
+            self._report(request, response, recorder, time.perf_counter() - start)
+
+    def _finish(self, request, response, recorder, start):
+        total = time.perf_counter() - start
+        db_ms, total_ms = recorder.duration * 1000, total * 1000
+        response['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{recorder.count} queries", app;dur={total_ms - db_ms:.1f}'
+        )
+        self._report(request, response, recorder, total)
+        return response
+
+    def _report(self, request, response, recorder, total):
+        db_ms, total_ms = recorder.duration * 1000, total * 1000
+        repeated = recorder.repeated()
+        summary = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(db_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'duplicates': sum(count - 1 for count in recorder.duplicates().values()),
+            'n_plus_one': repeated,
+        }
+        logger.log(
+            logging.WARNING if repeated else logging.INFO,
+            '%(method)s %(path)s %(status)s: %(queries)d queries, %(db_ms).1f ms db, %(total_ms).1f ms total',
+            summary, extra={'query_summary': summary},
+        )
+        if self.sample_rate and random.random() < self.sample_rate:
+            summary['slowest'] = [(query.sql, round(query.duration * 1000, 2)) for query in recorder.slowest()]
+            summary['time'] = time.time()
+            with _recent_lock:
+                _recent.append(summary)
+
+
+@staff_member_required
+def recent_queries(request):
+    with _recent_lock:
+        entries = list(reversed(_recent))
+    return render(request, 'admin/recent_queries.html', {'title': 'Recent query profiles', 'entries': entries})
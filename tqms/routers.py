@@ -0,0 +1,72 @@
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+REPLICA = 'replica'
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """Route ORM reads made inside the block to the replica, if one is configured."""
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def read_only_view(view):
+    """Mark a view that never writes, so its reads can be served by the replica."""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            with replica_reads():
+                return await view(*args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with replica_reads():
+                return view(*args, **kwargs)
+    return wrapper
+
+
+def replica_iterator(iterable):
+    """
+    Wrap the iterable of a streaming response so it also reads from the replica; it
+    is consumed after the view has returned, outside read_only_view's block.
+    """
+    iterator = iter(iterable)
+    while True:
+        with replica_reads():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ReplicaRouter:
+    """Send reads to the replica inside replica_reads(); everything else uses the default database."""
+
+    def db_for_read(self, model, **hints):
+        # A lagging replica would serve stale invalidation counters from the database cache.
+        if model._meta.app_label == 'django_cache':
+            return None
+        if _read_from_replica.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the default database.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != REPLICA
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,8 +53,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tqms.instrumentation.QueryInstrumentationMiddleware',
 ]
 
+# Per-request query counts and timings (Server-Timing header, tqms.queries log).
+# A sampled share of requests is kept in memory for /admin/recent-queries/.
+QUERY_INSTRUMENTATION = os.environ.get('TQMS_QUERY_INSTRUMENTATION', '1' if DEBUG else '0') == '1'
+QUERY_LOG_SAMPLE_RATE = float(os.environ.get('TQMS_QUERY_LOG_SAMPLE_RATE', '0'))
+QUERY_LOG_SIZE = 200
+
 ROOT_URLCONF = 'tqms.urls'
 
 TEMPLATES = [
@@ -75,11 +85,102 @@ WSGI_APPLICATION = 'tqms.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+#
+# TQMS_DATABASE_PROFILE selects the backend: "sqlite" (default) or "postgresql".
+# Setting TQMS_DATABASE_REPLICA_HOST (PostgreSQL) or TQMS_DATABASE_REPLICA_NAME
+# (SQLite) adds a "replica" database that tqms.routers.ReplicaRouter sends the
+# reads of read-only views to.
+
+DATABASE_PROFILE = os.environ.get('TQMS_DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgresql':
+    DATABASE_POOL = os.environ.get('TQMS_DATABASE_POOL', '1') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('TQMS_DATABASE_NAME', 'tqms'),
+            'USER': os.environ.get('TQMS_DATABASE_USER', 'tqms'),
+            'PASSWORD': os.environ.get('TQMS_DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('TQMS_DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('TQMS_DATABASE_PORT', '5432'),
+            # A connection pool (psycopg[pool]) replaces persistent connections.
+            'OPTIONS': {'pool': True} if DATABASE_POOL else {},
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.environ.get('TQMS_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': not DATABASE_POOL,
+        }
+    }
+    if os.environ.get('TQMS_DATABASE_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ['TQMS_DATABASE_REPLICA_HOST'],
+            'PORT': os.environ.get('TQMS_DATABASE_REPLICA_PORT', DATABASES['default']['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
+elif DATABASE_PROFILE == 'sqlite':
+    SQLITE_OPTIONS = {
+        # WAL lets readers run alongside the single writer; IMMEDIATE transactions take
+        # the write lock up front instead of failing with "database is locked" on upgrade.
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            f'PRAGMA cache_size={os.environ.get("TQMS_SQLITE_CACHE_SIZE", "-65536")};'
+            f'PRAGMA mmap_size={os.environ.get("TQMS_SQLITE_MMAP_SIZE", "268435456")};'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': int(os.environ.get('TQMS_SQLITE_TIMEOUT', '20')),
+    }
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('TQMS_DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': SQLITE_OPTIONS,
+            'CONN_MAX_AGE': int(os.environ.get('TQMS_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            # A file rather than Django's shared-cache memory database, so tests lock like
+            # production (WAL, busy timeout) and can run concurrent writers.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+    if os.environ.get('TQMS_DATABASE_REPLICA_NAME'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'NAME': os.environ['TQMS_DATABASE_REPLICA_NAME'],
+            'OPTIONS': {**SQLITE_OPTIONS, 'transaction_mode': 'DEFERRED'},
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    raise ImproperlyConfigured(f'Unknown TQMS_DATABASE_PROFILE "{DATABASE_PROFILE}".')
+
+DATABASE_ROUTERS = ['tqms.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+#
+# Reference-table caches, renderings and the API's conditional GETs keep their
+# invalidation counters in the default cache, so every worker process must share it.
+# TQMS_CACHE_BACKEND selects "locmem" (default; private to each process, so only fit
+# for a single process such as runserver), "redis", "memcached", "database" (run
+# "manage.py createcachetable" first) or "file". TQMS_CACHE_LOCATION overrides the
+# backend's default location.
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', ''),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://localhost:6379/0'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', 'localhost:11211'),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'tqms_cache'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', BASE_DIR / 'cache'),
+}
+CACHE_BACKEND = os.environ.get('TQMS_CACHE_BACKEND', 'locmem')
 
-DATABASES = {
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(f'Unknown TQMS_CACHE_BACKEND "{CACHE_BACKEND}".')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.environ.get('TQMS_CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
     }
 }
 
@@ -126,6 +227,15 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+
+# Uploaded files (attachments, process step images)
+# https://docs.djangoproject.com/en/5.1/topics/files/
+
+MEDIA_URL = 'media/'
+
+MEDIA_ROOT = BASE_DIR / 'media'
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -15,8 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
+
+from .instrumentation import recent_queries
 
 urlpatterns = [
+    path('admin/recent-queries/', recent_queries, name='recent_queries'),
     path('admin/', admin.site.urls),
+    path('documents/', include('documents.urls')),
+    path('api/v1/', include('documents.api_urls')),
 ]